@@ -0,0 +1,198 @@
+"""
+Alert generation from newly raised fraud flags.
+
+Committed flags are handed to the module-level `alert_batcher`, which
+coalesces bursts for ALERT_WINDOW_SECONDS (or until ALERT_BATCH_MAX flags
+are waiting) and then:
+
+1. loads the invoice context of the whole batch in one query,
+2. correlates flags that share a supplier, cascade group or fingerprint –
+   carousel flags also join on the buyer, which links every leg of a
+   cycle – into connected components,
+3. inserts one alert per component with the summed exposure of its
+   distinct invoices, in a single bulk INSERT,
+4. broadcasts the new alerts as one `alert_batch` event.
+"""
+
+import os
+import asyncio
+import logging
+from collections import Counter
+from typing import Iterable, List, NamedTuple, Set
+
+import networkx as nx
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, insert
+from sqlalchemy.orm import aliased
+
+from app.cache import bump_data_version
+from app.database import SessionLocal
+from app.models import Alert, AlertSeverity, AlertStatus, Entity, FraudType, Invoice
+from app.schemas import AlertOut
+from app.websocket import broadcast_event
+
+logger = logging.getLogger(__name__)
+
+ALERT_WINDOW_SECONDS = float(os.getenv("ALERT_WINDOW_SECONDS", "2"))
+ALERT_BATCH_MAX = int(os.getenv("ALERT_BATCH_MAX", "5000"))
+
+SEVERITY_RANK = {s: i for i, s in enumerate(
+    [AlertSeverity.low, AlertSeverity.medium, AlertSeverity.high, AlertSeverity.critical]
+)}
+
+
+class Signal(NamedTuple):
+    """The parts of a flag that alerting needs, detached from any session."""
+    invoice_id: int
+    fraud_type: FraudType
+    confidence: float
+    severity: AlertSeverity
+
+
+def _signal(flag) -> Signal:
+    return Signal(
+        flag.invoice_id,
+        FraudType(flag.fraud_type),
+        flag.confidence,
+        AlertSeverity(flag.severity or AlertSeverity.medium),
+    )
+
+
+def _label(fraud_type: FraudType) -> str:
+    return fraud_type.value.replace("_", " ").title()
+
+
+def correlate(signals: List[Signal], context: dict) -> List[List[int]]:
+    """Group signal indices that share a supplier, cascade group, fingerprint or cycle."""
+    G = nx.Graph()
+    for i, s in enumerate(signals):
+        G.add_node(("signal", i))
+        inv = context.get(s.invoice_id)
+        if inv is None:
+            continue
+        keys = [("entity", inv.supplier_id), ("fingerprint", inv.fingerprint)]
+        if inv.cascade_group:
+            keys.append(("cascade", inv.cascade_group))
+        if s.fraud_type == FraudType.carousel_trade:
+            keys.append(("entity", inv.buyer_id))
+        for key in keys:
+            G.add_edge(("signal", i), key)
+
+    return [
+        sorted(i for kind, i in component if kind == "signal")
+        for component in nx.connected_components(G)
+        if any(kind == "signal" for kind, _ in component)
+    ]
+
+
+def build_alert(signals: List[Signal], context: dict) -> dict:
+    """Summarise one correlated group of signals as an alert row."""
+    lead = max(signals, key=lambda s: (SEVERITY_RANK[s.severity], s.confidence))
+    invoices = {s.invoice_id: context[s.invoice_id] for s in signals if s.invoice_id in context}
+    entity_ids: Set[int] = set()
+    for inv in invoices.values():
+        entity_ids.update(e for e in (inv.supplier_id, inv.buyer_id) if e)
+    types = Counter(s.fraud_type for s in signals)
+    exposure = sum(inv.amount for inv in invoices.values())
+
+    lead_inv = invoices.get(lead.invoice_id)
+    party = lead_inv.supplier_name if lead_inv and lead_inv.supplier_name else "Unknown supplier"
+    if len(types) == 1:
+        title = f"{_label(lead.fraud_type)} – {party}"
+    else:
+        title = f"Correlated Fraud Signals – {party}"
+    breakdown = ", ".join(f"{n} {_label(t).lower()}" for t, n in types.most_common())
+
+    return {
+        "title": title[:255],
+        "description": (
+            f"{len(signals)} new fraud flag{'s' if len(signals) != 1 else ''} across "
+            f"{len(invoices)} invoice{'s' if len(invoices) != 1 else ''} "
+            f"({breakdown}). Total exposure ${exposure:,.0f}."
+        ),
+        "severity": lead.severity,
+        "status": AlertStatus.open,
+        "fraud_type": lead.fraud_type,
+        "related_invoice_ids": ",".join(str(i) for i in sorted(invoices)),
+        "related_entity_ids": ",".join(str(e) for e in sorted(entity_ids)),
+        "total_exposure": exposure,
+    }
+
+
+async def create_alerts(signals: List[Signal]) -> List[AlertOut]:
+    """Correlate `signals`, insert their alerts in bulk and broadcast them once."""
+    if not signals:
+        return []
+
+    Supplier = aliased(Entity)
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Invoice.id, Invoice.supplier_id, Invoice.buyer_id, Invoice.amount,
+                   Invoice.cascade_group, Invoice.fingerprint, Supplier.name.label("supplier_name"))
+            .outerjoin(Supplier, Supplier.id == Invoice.supplier_id)
+            .where(Invoice.id.in_({s.invoice_id for s in signals}))
+        )
+        context = {row.id: row for row in result.all()}
+
+        rows = [build_alert([signals[i] for i in group], context)
+                for group in correlate(signals, context)]
+        alerts = (await db.scalars(insert(Alert).returning(Alert), rows)).all()
+        await db.commit()
+
+    out = [AlertOut.model_validate(a) for a in alerts]
+    await bump_data_version()
+    await broadcast_event("alert_batch", {"alerts": jsonable_encoder(out)})
+    return out
+
+
+class AlertBatcher:
+    """Coalesces flags submitted within a short window into one alert batch."""
+
+    def __init__(self, window: float = ALERT_WINDOW_SECONDS, max_batch: int = ALERT_BATCH_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: List[Signal] = []
+        self._timer = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    def submit(self, flags: Iterable):
+        """Queue committed flags (ORM objects or rows) for alerting."""
+        self.pending.extend(_signal(f) for f in flags)
+        if not self.pending:
+            return
+        if len(self.pending) >= self.max_batch:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                await create_alerts(batch)
+            except Exception:
+                logger.exception("could not create alerts for %d flags", len(batch))
+
+    async def drain(self):
+        """Flush whatever is waiting (used at shutdown)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+
+alert_batcher = AlertBatcher()
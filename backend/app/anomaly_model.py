@@ -0,0 +1,349 @@
+"""
+Invoice anomaly model.
+
+The rule engines each look at one signal against a fixed threshold.  The
+anomaly detector looks at all of them together: every snapshot invoice is
+turned into a row of FEATURES – amount against its trading pair's history,
+share of supplier revenue, 30-day supplier velocity, dilution and the
+trading parties' graph position – and an IsolationForest scores how easily
+that row is isolated from the rest.  Scores follow the original paper:
+around 0.5 is ordinary, towards 1 is anomalous.  Where "anomalous" starts
+depends on the data, so every fit also stores a threshold: the score that
+ANOMALY_CONTAMINATION of the training rows exceed (a tenth of that share
+for the high-severity threshold).
+
+Feature matrices are built for the whole snapshot with array operations
+(windowed and graph features need every row anyway) and scored in batches
+of ANOMALY_BATCH rows, so memory stays bounded on large tables.  The matrix
+of the latest snapshot generation is kept, so scoring and refitting the
+same generation build it once.
+
+The fitted model is written to ANOMALY_MODEL_PATH with joblib (through a
+unique temporary file, atomically replaced) and loaded on first use, so a
+restarted worker scores straight away; workers reload it when the file
+changes.  Every fit holds the refit lock, so one worker fits at a time,
+and none runs inside a scan: without a usable model the detector starts
+one in the background (`request_fit`) and skips that run.  A background
+task refits it every ANOMALY_REFIT_SECONDS once ANOMALY_REFIT_MIN_ROWS new
+invoices have arrived: ANOMALY_REFIT_TREES trees fit on the new rows are
+added to the forest (warm start) until it reaches ANOMALY_MAX_TREES, when
+it is refit from scratch.  scikit-learn and joblib are imported only when a
+model is fit or loaded.
+"""
+
+import os
+import copy
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import SessionLocal
+from app.locks import ANOMALY_REFIT_LOCK, try_lock
+from app.replay import rule_scores
+from app.snapshot import Snapshot, get_snapshot
+from app.engines.feasibility_monitor import trailing_volumes
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_MODEL_PATH = os.getenv("ANOMALY_MODEL_PATH", "models/anomaly_forest.joblib")
+ANOMALY_MIN_ROWS = int(os.getenv("ANOMALY_MIN_ROWS", "200"))
+ANOMALY_TREES = int(os.getenv("ANOMALY_TREES", "200"))
+ANOMALY_REFIT_TREES = int(os.getenv("ANOMALY_REFIT_TREES", "25"))
+ANOMALY_MAX_TREES = int(os.getenv("ANOMALY_MAX_TREES", "400"))
+ANOMALY_MAX_SAMPLES = int(os.getenv("ANOMALY_MAX_SAMPLES", "256"))
+ANOMALY_FIT_ROWS = int(os.getenv("ANOMALY_FIT_ROWS", "200000"))
+ANOMALY_BATCH = int(os.getenv("ANOMALY_BATCH", "50000"))
+ANOMALY_REFIT_SECONDS = float(os.getenv("ANOMALY_REFIT_SECONDS", "3600"))
+ANOMALY_REFIT_MIN_ROWS = int(os.getenv("ANOMALY_REFIT_MIN_ROWS", "5000"))
+ANOMALY_REFIT_ENABLED = os.getenv("ANOMALY_REFIT_ENABLED", "1") == "1"
+ANOMALY_CONTAMINATION = float(os.getenv("ANOMALY_CONTAMINATION", "0.01"))   # share of rows flagged
+ANOMALY_SEED = 42
+
+VELOCITY_DAYS = 30
+
+# Feature -> how flag descriptions name it, in matrix column order
+FEATURES = {
+    "log_amount": "amount",
+    "pair_multiple": "multiple of the pair's average",
+    "revenue_share": "share of supplier revenue",
+    "supplier_30d_count": "supplier's 30-day invoice count",
+    "supplier_30d_share": "supplier's 30-day volume vs revenue",
+    "same_day": "same-day follow-up",
+    "dilution": "dilution ratio",
+    "supplier_degree": "supplier's number of buyers",
+    "buyer_degree": "buyer's number of suppliers",
+    "supplier_risk": "supplier's graph risk",
+    "buyer_risk": "buyer's graph risk",
+}
+
+
+# ── Features ────────────────────────────────────────────────────────
+def _finite(scores: np.ndarray) -> np.ndarray:
+    """A rule score as a feature: 0 where the rule does not apply."""
+    return np.where(np.isfinite(scores), scores, 0.0)
+
+
+def _counts_of(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """How many distinct `values` each row's key has."""
+    pairs = np.unique(np.stack([keys, values]), axis=1)
+    unique_keys, counts = np.unique(pairs[0], return_counts=True)
+    return counts[np.searchsorted(unique_keys, keys)]
+
+
+def invoice_features(snap: Snapshot) -> np.ndarray:
+    """The (invoices × FEATURES) matrix, row-aligned with the snapshot."""
+    inv = snap.invoices
+    n = len(inv["id"])
+    X = np.zeros((n, len(FEATURES)))
+    if not n:
+        return X
+    column = {name: i for i, name in enumerate(FEATURES)}
+    amounts = inv["amount"]
+    suppliers, buyers = inv["supplier_id"], inv["buyer_id"]
+    scores = rule_scores(snap)
+
+    X[:, column["log_amount"]] = np.log1p(np.maximum(amounts, 0))
+    multiple = _finite(scores["over_invoice_ratio"])
+    X[:, column["pair_multiple"]] = np.log(np.where(multiple > 0, multiple, 1.0))
+    X[:, column["revenue_share"]] = _finite(scores["revenue_share"])
+    X[:, column["same_day"]] = np.isfinite(scores["same_day_amount"])
+    X[:, column["dilution"]] = _finite(scores["dilution_threshold"])
+
+    # Supplier's trailing 30-day count and volume at each invoice, on the
+    # same packed (supplier, day) key as the feasibility kernel
+    first_day = int(inv["day"].min())
+    span = int(inv["day"].max()) - first_day + VELOCITY_DAYS + 1
+    keys = suppliers * span + (inv["day"] - first_day)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    counts = np.empty(n)
+    volumes = np.empty(n)
+    counts[order] = trailing_volumes(sorted_keys, np.ones(n), VELOCITY_DAYS)
+    volumes[order] = trailing_volumes(sorted_keys, amounts[order], VELOCITY_DAYS)
+    revenue = snap.revenue_of(suppliers)
+    X[:, column["supplier_30d_count"]] = np.log1p(counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        X[:, column["supplier_30d_share"]] = np.where(revenue > 0, volumes / revenue, 0.0)
+
+    # Graph position: trading-pair degrees and the stored PageRank risk
+    X[:, column["supplier_degree"]] = np.log1p(_counts_of(suppliers, buyers))
+    X[:, column["buyer_degree"]] = np.log1p(_counts_of(buyers, suppliers))
+    X[:, column["supplier_risk"]] = snap.risk_of(suppliers) / 100
+    X[:, column["buyer_risk"]] = snap.risk_of(buyers) / 100
+    return X
+
+
+_features: Optional[Tuple[Snapshot, np.ndarray]] = None   # latest generation's matrix
+
+
+def snapshot_features(snap: Snapshot) -> np.ndarray:
+    """`invoice_features(snap)`, built once per snapshot generation.  CPU-bound."""
+    global _features
+    cached = _features
+    if cached is not None and cached[0] is snap:
+        return cached[1]
+    X = invoice_features(snap)
+    _features = (snap, X)
+    return X
+
+
+# ── Model ───────────────────────────────────────────────────────────
+class AnomalyModel:
+    """A fitted forest plus what is needed to score and explain its output."""
+
+    def __init__(self, forest, center: np.ndarray, scale: np.ndarray, threshold: float,
+                 high_threshold: float, max_id: int, rows: int):
+        self.forest = forest
+        self.features: List[str] = list(FEATURES)
+        self.center = center
+        self.scale = scale
+        self.threshold = threshold            # scores above it are flagged
+        self.high_threshold = high_threshold  # ... as high severity
+        self.max_id = max_id          # highest invoice id the forest has seen
+        self.rows = rows
+        self.trained_at = datetime.utcnow()
+
+    @property
+    def current(self) -> bool:
+        """Fit on today's FEATURES, with a calibrated threshold (older saves have none)."""
+        return self.features == list(FEATURES) and getattr(self, "threshold", None) is not None
+
+    @property
+    def trees(self) -> int:
+        return len(self.forest.estimators_)
+
+    def score(self, X: np.ndarray) -> np.ndarray:
+        """Anomaly score per row (0.5 ordinary, towards 1 anomalous), in batches."""
+        scores = np.empty(len(X))
+        for start in range(0, len(X), ANOMALY_BATCH):
+            scores[start:start + ANOMALY_BATCH] = -self.forest.score_samples(X[start:start + ANOMALY_BATCH])
+        return scores
+
+    def deviations(self, X: np.ndarray) -> np.ndarray:
+        """Robust z-score of every feature, for explaining a score."""
+        return (X - self.center) / self.scale
+
+
+def _sample(rows: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    if len(rows) <= ANOMALY_FIT_ROWS:
+        return rows
+    return np.sort(rng.choice(rows, ANOMALY_FIT_ROWS, replace=False))
+
+
+def fit_model(X: np.ndarray, ids: np.ndarray, previous: Optional[AnomalyModel] = None) -> AnomalyModel:
+    """
+    Grow `previous` by ANOMALY_REFIT_TREES trees fit on the rows it has not
+    seen, or fit a new forest when there is none, it was fit on other
+    features or it is already ANOMALY_MAX_TREES trees.  CPU-bound.
+    """
+    from sklearn.ensemble import IsolationForest
+
+    rng = np.random.default_rng(ANOMALY_SEED)
+    new_rows = np.flatnonzero(ids > previous.max_id) if previous is not None else None
+    if (previous is not None and previous.features == list(FEATURES) and len(new_rows)
+            and previous.trees + ANOMALY_REFIT_TREES <= ANOMALY_MAX_TREES):
+        # Copied, so the model being served is never modified mid-score
+        forest = copy.deepcopy(previous.forest)
+        forest.set_params(warm_start=True, n_estimators=previous.trees + ANOMALY_REFIT_TREES)
+        forest.fit(X[_sample(new_rows, rng)])
+        rows = previous.rows + len(new_rows)
+    else:
+        fit_rows = _sample(np.arange(len(ids)), rng)
+        forest = IsolationForest(
+            n_estimators=ANOMALY_TREES,
+            max_samples=min(ANOMALY_MAX_SAMPLES, len(fit_rows)),
+            random_state=ANOMALY_SEED,
+        )
+        forest.fit(X[fit_rows])
+        rows = len(ids)
+
+    reference = X[_sample(np.arange(len(X)), rng)]
+    center = np.median(reference, axis=0)
+    q25, q75 = np.percentile(reference, [25, 75], axis=0)
+    scale = (q75 - q25) / 1.349
+    scale = np.where(scale > 0, scale, reference.std(axis=0))
+    scale = np.where(scale > 0, scale, 1.0)
+    scores = -forest.score_samples(reference)
+    threshold, high_threshold = np.quantile(
+        scores, [1 - ANOMALY_CONTAMINATION, 1 - ANOMALY_CONTAMINATION / 10],
+    )
+    return AnomalyModel(forest, center, scale, float(threshold), float(high_threshold),
+                        int(ids.max()), rows)
+
+
+def save_model(model: AnomalyModel, path: str = ANOMALY_MODEL_PATH):
+    """Write `model` to `path`, atomically replacing the previous one."""
+    import joblib
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            joblib.dump(model, fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_model(path: str = ANOMALY_MODEL_PATH) -> Optional[AnomalyModel]:
+    """The model saved at `path`, or None if it is missing or unreadable."""
+    import joblib
+
+    try:
+        return joblib.load(path)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("could not load anomaly model from %s", path, exc_info=True)
+        return None
+
+
+_model: Optional[AnomalyModel] = None
+_model_mtime: Optional[float] = None
+
+
+def get_model() -> Optional[AnomalyModel]:
+    """This process's model, reloaded if another worker saved a newer one."""
+    global _model, _model_mtime
+    try:
+        mtime = os.stat(ANOMALY_MODEL_PATH).st_mtime
+    except OSError:
+        return _model
+    if mtime != _model_mtime:
+        loaded = load_model()
+        if loaded is not None:
+            _model, _model_mtime = loaded, mtime
+    return _model
+
+
+async def refit_model(db: AsyncSession, snap: Optional[Snapshot] = None,
+                      force: bool = False) -> Optional[AnomalyModel]:
+    """
+    Refit and save the model if enough invoices arrived since it was fit
+    (always when `force`, from scratch).  None while the snapshot has fewer
+    than ANOMALY_MIN_ROWS invoices.  Fits hold ANOMALY_REFIT_LOCK; while
+    another worker holds it, the current model (if any) is returned.
+    """
+    async with try_lock(ANOMALY_REFIT_LOCK) as held:
+        if not held:
+            return get_model()
+        return await _refit(db, snap, force)
+
+
+async def _refit(db: AsyncSession, snap: Optional[Snapshot], force: bool) -> Optional[AnomalyModel]:
+    global _model, _model_mtime
+    if snap is None:
+        snap = await get_snapshot(db)
+    ids = snap.invoices["id"]
+    if len(ids) < ANOMALY_MIN_ROWS:
+        return None
+    previous = None if force else get_model()
+    if previous is not None and previous.current:
+        if int((ids > previous.max_id).sum()) < ANOMALY_REFIT_MIN_ROWS:
+            return previous
+
+    def fit() -> AnomalyModel:
+        model = fit_model(snapshot_features(snap), ids, previous)
+        save_model(model)
+        return model
+
+    model = await asyncio.get_running_loop().run_in_executor(None, fit)
+    _model, _model_mtime = model, os.stat(ANOMALY_MODEL_PATH).st_mtime
+    logger.info("anomaly model fit: %d trees over %d invoices", model.trees, model.rows)
+    return model
+
+
+_fit_task: Optional[asyncio.Task] = None
+
+
+def request_fit(snap: Snapshot):
+    """Fit a model from scratch on `snap` in the background, unless this process already is."""
+    global _fit_task
+    if _fit_task is None or _fit_task.done():
+        _fit_task = asyncio.create_task(_background_fit(snap))
+
+
+async def _background_fit(snap: Snapshot):
+    try:
+        async with SessionLocal() as db:
+            await refit_model(db, snap, force=True)
+    except Exception:
+        logger.exception("anomaly model fit failed")
+
+
+async def anomaly_refitter():
+    """Refit the model every ANOMALY_REFIT_SECONDS, on one worker at a time, until cancelled."""
+    while True:
+        await asyncio.sleep(ANOMALY_REFIT_SECONDS)
+        try:
+            async with SessionLocal() as db:
+                await refit_model(db)
+        except Exception:
+            logger.exception("anomaly model refit failed")
@@ -0,0 +1,210 @@
+"""
+Response cache for read-heavy endpoints.
+
+Payloads are stored in Redis (or an in-process dict when REDIS_URL is not
+set) under a key that carries the data version they were built from.  Every
+write to invoices, flags, alerts or entities bumps the version, which turns
+cached entries stale rather than deleting them: stale entries are still
+served while a single background task rebuilds them (stale-while-revalidate).
+Concurrent misses for the same key share one build, and every response
+carries an ETag so unchanged payloads can be answered with 304.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL_SECONDS", "600"))
+CACHE_MEMORY_ENTRIES = int(os.getenv("CACHE_MEMORY_ENTRIES", "1000"))
+
+VERSION_KEY = "intellitrace:data_version"
+KEY_PREFIX = "intellitrace:cache:"
+
+Builder = Callable[[AsyncSession], Awaitable[Any]]
+
+
+# ── Stores ──────────────────────────────────────────────────────────
+class _MemoryStore:
+    """
+    Process-local fallback used when Redis is not configured.  Payloads are
+    kept least-recently-used up to `maxsize` entries (every query string is
+    a key); counters are kept apart so the data version is never evicted.
+    """
+
+    def __init__(self, maxsize: int = CACHE_MEMORY_ENTRIES):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        if key in self._counters:
+            return str(self._counters[key])
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+
+class _RedisStore:
+    """Thin wrapper over redis.asyncio with the same interface."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def incr(self, key: str) -> int:
+        return await self._client.incr(key)
+
+
+_store = _RedisStore(REDIS_URL) if REDIS_URL else _MemoryStore()
+_local_version = 0
+
+
+async def get_data_version() -> int:
+    """Current data version; falls back to the local counter if Redis is down."""
+    try:
+        value = await _store.get(VERSION_KEY)
+        return int(value or 0)
+    except Exception:
+        logger.warning("cache: could not read data version", exc_info=True)
+        return _local_version
+
+
+async def bump_data_version() -> int:
+    """Mark every cached payload stale.  Call after committing a write."""
+    global _local_version
+    _local_version += 1
+    try:
+        return await _store.incr(VERSION_KEY)
+    except Exception:
+        logger.warning("cache: could not bump data version", exc_info=True)
+        return _local_version
+
+
+# ── Build / coalesce / revalidate ───────────────────────────────────
+# Keyed by (key, version): a miss after a write never joins a build that
+# started before it
+_inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+_background: Set[asyncio.Task] = set()
+
+
+async def _build(key: str, version: int, builder: Builder) -> dict:
+    """Run the builder in its own session and store the serialized payload."""
+    async with SessionLocal() as db:
+        result = await builder(db)
+
+    body = json.dumps(jsonable_encoder(result), separators=(",", ":"))
+    entry = {
+        "v": version,
+        "t": time.time(),
+        "etag": '"' + hashlib.sha1(body.encode()).hexdigest() + '"',
+        "body": body,
+    }
+    try:
+        await _store.set(key, json.dumps(entry), ttl=CACHE_STALE_TTL)
+    except Exception:
+        logger.warning("cache: could not store %s", key, exc_info=True)
+    return entry
+
+
+async def _coalesced_build(key: str, version: int, builder: Builder) -> dict:
+    """Share a single build between all callers missing the same key."""
+    future = _inflight.get((key, version))
+    if future is None:
+        future = asyncio.ensure_future(_build(key, version, builder))
+        _inflight[key, version] = future
+        future.add_done_callback(lambda _: _inflight.pop((key, version), None))
+    return await asyncio.shield(future)
+
+
+def _revalidate(key: str, version: int, builder: Builder):
+    """Rebuild a stale entry in the background unless a build is running."""
+    if (key, version) in _inflight:
+        return
+
+    async def run():
+        try:
+            await _coalesced_build(key, version, builder)
+        except Exception:
+            logger.exception("cache: background refresh of %s failed", key)
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in [t[2:] if t.startswith("W/") else t for t in tags]
+
+
+def _render(request: Request, entry: dict, state: str) -> Response:
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "X-Cache": state}
+    if _etag_matches(request, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+async def cached_response(request: Request, name: str, builder: Builder) -> Response:
+    """
+    Serve `builder`'s payload through the cache.
+    The key combines `name` with the request's query string.
+    """
+    key = f"{KEY_PREFIX}{name}:{request.url.query}"
+    version = await get_data_version()
+
+    try:
+        raw = await _store.get(key)
+    except Exception:
+        logger.warning("cache: could not read %s", key, exc_info=True)
+        raw = None
+
+    if raw is not None:
+        entry = json.loads(raw)
+        fresh = entry["v"] == version and time.time() - entry["t"] < CACHE_TTL
+        if not fresh:
+            _revalidate(key, version, builder)
+        return _render(request, entry, "hit" if fresh else "stale")
+
+    entry = await _coalesced_build(key, version, builder)
+    return _render(request, entry, "miss")
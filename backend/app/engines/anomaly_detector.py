@@ -0,0 +1,93 @@
+"""
+Anomaly Detector
+Scores every invoice's combined feature profile with the IsolationForest
+in app.anomaly_model and flags those above the threshold calibrated when
+the model was fit, naming the features that set them apart.
+"""
+
+import asyncio
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import FraudFlag, FraudType, AlertSeverity
+from app.snapshot import Snapshot, get_snapshot, invoice_numbers
+from app.anomaly_model import (
+    ANOMALY_MIN_ROWS, FEATURES, AnomalyModel, get_model, request_fit, snapshot_features,
+)
+
+
+def anomaly_flag(model: AnomalyModel, invoice_id: int, invoice_number: Optional[str], score: float,
+                 deviations: Sequence[float]) -> FraudFlag:
+    """Flag one invoice; `deviations` are its robust z-scores in FEATURES order."""
+    labels = list(FEATURES.values())
+    top = np.argsort(-np.abs(np.asarray(deviations)))[:2]
+    unusual = ", ".join(f"{labels[i]} ({deviations[i]:+.1f} sd)" for i in top)
+    return FraudFlag(
+        invoice_id=invoice_id,
+        fraud_type=FraudType.ml_anomaly,
+        confidence=min(0.5 + 2 * (score - model.threshold), 0.9),
+        severity=AlertSeverity.high if score >= model.high_threshold else AlertSeverity.medium,
+        description=(
+            f"Invoice #{invoice_number}: anomaly score {score:.2f} "
+            f"(threshold {model.threshold:.2f}); most unusual: {unusual}"
+        ),
+        engine="anomaly_detector",
+        rule="isolation_forest",
+    )
+
+
+def _score(model: AnomalyModel, snap: Snapshot, rows: np.ndarray):
+    X = snapshot_features(snap)[rows]
+    return X, model.score(X)
+
+
+async def detect_anomalies_columnar(session: AsyncSession, snap: Snapshot,
+                                    invoice_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+    """
+    Score the snapshot's invoices (only `invoice_ids` when given) and flag
+    those above the model's threshold.  Without a usable model nothing is
+    flagged: a fit is started in the background for the next run.
+    """
+    inv = snap.invoices
+    if len(inv["id"]) < ANOMALY_MIN_ROWS:
+        return []
+    model = get_model()
+    if model is None or not model.current:
+        request_fit(snap)
+        return []
+
+    if invoice_ids is None:
+        rows = np.arange(len(inv["id"]))
+    else:
+        ids = np.asarray(list(invoice_ids), dtype=np.int64)
+        pos = np.clip(snap.invoice_positions(ids), 0, len(inv["id"]) - 1)
+        rows = np.unique(pos[inv["id"][pos] == ids])
+        if not len(rows):
+            return []
+
+    X, scores = await asyncio.get_running_loop().run_in_executor(None, _score, model, snap, rows)
+    hits = np.flatnonzero(scores > model.threshold)
+    if not len(hits):
+        return []
+
+    numbers = await invoice_numbers(session, inv["id"][rows[hits]])
+    deviations = model.deviations(X[hits])
+
+    flags: List[FraudFlag] = []
+    for k, h in enumerate(hits):
+        invoice_id = int(inv["id"][rows[h]])
+        flags.append(anomaly_flag(model, invoice_id, numbers.get(invoice_id),
+                                  float(scores[h]), deviations[k]))
+    return flags
+
+
+async def detect_anomalies(session: AsyncSession,
+                           invoice_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+    """
+    Flag anomalous invoices.  Restricted to `invoice_ids` when given
+    (features are still computed against every invoice).
+    """
+    snap = await get_snapshot(session)
+    return await detect_anomalies_columnar(session, snap, invoice_ids)
@@ -4,78 +4,135 @@ Detects fraudulent cascade patterns where an invoice at Tier 1 triggers
 repeated financing down through Tier 2 → Tier 3, multiplying exposure.
 """
 
-from typing import List, Dict, Set
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
 from collections import defaultdict
+import numpy as np
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Invoice, FraudFlag, FraudType, AlertSeverity, Entity
+from app.snapshot import Snapshot, TIER_NAMES
 
+CASCADE_MULTIPLIER = float(os.getenv("CASCADE_MULTIPLIER", "2"))  # total exposure vs root amount
 
-async def detect_cascade_fraud(session: AsyncSession) -> List[FraudFlag]:
+
+class CascadeRow(NamedTuple):
+    id: int
+    amount: float
+    tier: str
+
+
+def cascade_flags(group_id: str, group_invoices: Sequence) -> List[FraudFlag]:
+    """Check one cascade group for amount multiplication across tiers."""
+    flags: List[FraudFlag] = []
+
+    if len(group_invoices) < 2:
+        return flags
+
+    # Separate by tier
+    tier_invoices = defaultdict(list)
+    for inv in group_invoices:
+        tier_invoices[inv.tier.value if hasattr(inv.tier, 'value') else inv.tier].append(inv)
+
+    # Calculate total per tier
+    tier_totals = {}
+    for tier, invs in tier_invoices.items():
+        tier_totals[tier] = sum(i.amount for i in invs)
+
+    # Check for multiplication pattern
+    total_cascade = sum(tier_totals.values())
+    root_amount = min(tier_totals.values())  # Original root should be smallest
+
+    if total_cascade > root_amount * CASCADE_MULTIPLIER:
+        multiplier = total_cascade / root_amount
+        excess = multiplier / CASCADE_MULTIPLIER - 1   # 0 at the threshold
+        for inv in group_invoices:
+            flags.append(FraudFlag(
+                invoice_id=inv.id,
+                fraud_type=FraudType.cascade_fraud,
+                confidence=min(0.5 + excess * 0.3, 0.99),
+                severity=AlertSeverity.critical if excess > 0.5 else AlertSeverity.high,
+                description=(
+                    f"Cross-tier cascade detected in group '{group_id}': "
+                    f"{len(group_invoices)} invoices across {len(tier_invoices)} tiers. "
+                    f"Total exposure ${total_cascade:,.0f} is {multiplier:.1f}x "
+                    f"the root amount ${root_amount:,.0f}. "
+                    f"Tier breakdown: {dict(tier_totals)}"
+                ),
+                engine="cascade_detector",
+                rule="tier_multiplication",
+            ))
+
+    return flags
+
+
+async def detect_cascade_fraud(session: AsyncSession,
+                               cascade_groups: Optional[Iterable[str]] = None) -> List[FraudFlag]:
     """
     Detect cross-tier cascade fraud:
     1. Find invoices that share cascade groups
     2. Check if amounts multiply across tiers
-    3. Flag when total cascaded amount exceeds original by > 2x
+    3. Flag when total cascaded amount exceeds original by > CASCADE_MULTIPLIER
+    Restricted to `cascade_groups` when given.
     """
     flags: List[FraudFlag] = []
 
     # Find all invoices with cascade groups
-    result = await session.execute(
+    query = (
         select(Invoice)
         .where(Invoice.cascade_group.isnot(None))
         .order_by(Invoice.cascade_group, Invoice.tier)
     )
+    if cascade_groups is not None:
+        query = query.where(Invoice.cascade_group.in_(list(cascade_groups)))
+    result = await session.execute(query)
     invoices = result.scalars().all()
 
     # Group by cascade group
-    cascade_groups: Dict[str, List[Invoice]] = defaultdict(list)
+    groups: Dict[str, List[Invoice]] = defaultdict(list)
     for inv in invoices:
-        cascade_groups[inv.cascade_group].append(inv)
+        groups[inv.cascade_group].append(inv)
 
-    for group_id, group_invoices in cascade_groups.items():
-        if len(group_invoices) < 2:
-            continue
+    for group_id, group_invoices in groups.items():
+        flags.extend(cascade_flags(group_id, group_invoices))
+
+    return flags
 
-        # Separate by tier
-        tier_invoices = defaultdict(list)
-        for inv in group_invoices:
-            tier_invoices[inv.tier.value if hasattr(inv.tier, 'value') else inv.tier].append(inv)
-
-        # Calculate total per tier
-        tier_totals = {}
-        for tier, invs in tier_invoices.items():
-            tier_totals[tier] = sum(i.amount for i in invs)
-
-        # Check for multiplication pattern
-        total_cascade = sum(tier_totals.values())
-        root_amount = min(tier_totals.values())  # Original root should be smallest
-
-        if total_cascade > root_amount * 2:
-            multiplier = total_cascade / root_amount
-            for inv in group_invoices:
-                existing = await session.execute(
-                    select(FraudFlag)
-                    .where(FraudFlag.invoice_id == inv.id)
-                    .where(FraudFlag.fraud_type == FraudType.cascade_fraud)
-                )
-                if existing.scalar_one_or_none():
-                    continue
-
-                flags.append(FraudFlag(
-                    invoice_id=inv.id,
-                    fraud_type=FraudType.cascade_fraud,
-                    confidence=min(0.5 + (multiplier - 2) * 0.15, 0.99),
-                    severity=AlertSeverity.critical if multiplier > 3 else AlertSeverity.high,
-                    description=(
-                        f"Cross-tier cascade detected in group '{group_id}': "
-                        f"{len(group_invoices)} invoices across {len(tier_invoices)} tiers. "
-                        f"Total exposure ${total_cascade:,.0f} is {multiplier:.1f}x "
-                        f"the root amount ${root_amount:,.0f}. "
-                        f"Tier breakdown: {dict(tier_totals)}"
-                    ),
-                    engine="cascade_detector",
-                ))
 
+async def detect_cascade_fraud_columnar(session: AsyncSession, snap: Snapshot) -> List[FraudFlag]:
+    """
+    Full cascade scan over a columnar snapshot: per-group tier totals are
+    summed in one pass and only groups that multiply are expanded.
+    """
+    inv = snap.invoices
+    rows = np.flatnonzero(inv["cascade"] >= 0)
+    if not len(rows):
+        return []
+    groups, tiers, amounts = inv["cascade"][rows], inv["tier"][rows], inv["amount"][rows]
+
+    n_groups = len(snap.cascade_groups)
+    totals = np.zeros((n_groups, 4))
+    np.add.at(totals, (groups, tiers), amounts)
+    present = np.zeros((n_groups, 4), dtype=bool)
+    present[groups, tiers] = True
+    counts = np.bincount(groups, minlength=n_groups)
+
+    cascade_total = totals.sum(axis=1)
+    root = np.where(present, totals, np.inf).min(axis=1)
+    suspect = np.flatnonzero((counts >= 2) & (cascade_total > root * CASCADE_MULTIPLIER))
+    if not len(suspect):
+        return []
+
+    # Group rows ordered by tier, as the row-wise scan reads them
+    members = rows[np.isin(groups, suspect)]
+    members = members[np.lexsort((inv["tier"][members], inv["cascade"][members]))]
+    by_group: Dict[int, List[CascadeRow]] = defaultdict(list)
+    for i in members:
+        by_group[int(inv["cascade"][i])].append(
+            CascadeRow(int(inv["id"][i]), float(inv["amount"][i]), TIER_NAMES.get(int(inv["tier"][i])))
+        )
+    flags: List[FraudFlag] = []
+    for code, group_invoices in by_group.items():
+        flags.extend(cascade_flags(snap.cascade_groups[code], group_invoices))
     return flags
@@ -4,66 +4,99 @@ Monitors cash collection vs expected amounts to detect dilution fraud.
 Dilution = when collected cash is significantly less than financed amount.
 """
 
-from typing import List
+import os
+from typing import Iterable, List, NamedTuple, Optional
+import numpy as np
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import CashCollection, Invoice, FraudFlag, FraudType, AlertSeverity, Entity
+from app.models import CashCollection, Invoice, FraudFlag, FraudType, AlertSeverity
+from app.entity_cache import get_entities, entity_name
+from app.snapshot import Snapshot, invoice_numbers
 
+DILUTION_THRESHOLD = float(os.getenv("DILUTION_THRESHOLD", "0.20"))
 
-async def detect_dilution(session: AsyncSession) -> List[FraudFlag]:
+
+class CollectionRow(NamedTuple):
+    invoice_id: int
+    expected_amount: float
+    collected_amount: float
+    dilution_ratio: float
+
+
+def dilution_flag(coll, invoice_number: str, supplier_name: Optional[str]) -> FraudFlag:
+    """Build the flag for one collection whose dilution exceeds the threshold."""
+    supplier_name = supplier_name or "Unknown"
+
+    severity = AlertSeverity.low
+    if coll.dilution_ratio > 0.50:
+        severity = AlertSeverity.critical
+    elif coll.dilution_ratio > 0.35:
+        severity = AlertSeverity.high
+    elif coll.dilution_ratio > 0.20:
+        severity = AlertSeverity.medium
+
+    return FraudFlag(
+        invoice_id=coll.invoice_id,
+        fraud_type=FraudType.dilution,
+        confidence=min(0.5 + coll.dilution_ratio, 0.99),
+        severity=severity,
+        description=(
+            f"Dilution detected for {supplier_name}: "
+            f"expected ${coll.expected_amount:,.0f}, "
+            f"collected ${coll.collected_amount:,.0f} "
+            f"({coll.dilution_ratio*100:.1f}% dilution). "
+            f"Invoice #{invoice_number}"
+        ),
+        engine="dilution_monitor",
+        rule="dilution_ratio",
+    )
+
+
+async def detect_dilution(session: AsyncSession,
+                          collection_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
     """
     Detect dilution fraud:
     1. Compare expected vs collected amounts
     2. Flag when dilution ratio exceeds threshold
     3. Aggregate dilution by supplier to catch systemic issues
+    Restricted to `collection_ids` when given.
     """
     flags: List[FraudFlag] = []
 
-    # Get all cash collection records with significant dilution
-    result = await session.execute(
-        select(CashCollection)
-        .where(CashCollection.dilution_ratio > 0.20)  # >20% dilution
+    # Collections with significant dilution, with their invoice and supplier
+    query = (
+        select(CashCollection, Invoice.invoice_number, Invoice.supplier_id)
+        .join(Invoice, Invoice.id == CashCollection.invoice_id)
+        .where(CashCollection.dilution_ratio > DILUTION_THRESHOLD)
     )
-    collections = result.scalars().all()
-
-    for coll in collections:
-        invoice = await session.get(Invoice, coll.invoice_id)
-        if not invoice:
-            continue
+    if collection_ids is not None:
+        query = query.where(CashCollection.id.in_(list(collection_ids)))
+    result = await session.execute(query)
+    rows = result.all()
 
-        existing = await session.execute(
-            select(FraudFlag)
-            .where(FraudFlag.invoice_id == coll.invoice_id)
-            .where(FraudFlag.fraud_type == FraudType.dilution)
-        )
-        if existing.scalar_one_or_none():
-            continue
-
-        supplier = await session.get(Entity, invoice.supplier_id)
-        supplier_name = supplier.name if supplier else "Unknown"
-
-        severity = AlertSeverity.low
-        if coll.dilution_ratio > 0.50:
-            severity = AlertSeverity.critical
-        elif coll.dilution_ratio > 0.35:
-            severity = AlertSeverity.high
-        elif coll.dilution_ratio > 0.20:
-            severity = AlertSeverity.medium
-
-        flags.append(FraudFlag(
-            invoice_id=coll.invoice_id,
-            fraud_type=FraudType.dilution,
-            confidence=min(0.5 + coll.dilution_ratio, 0.99),
-            severity=severity,
-            description=(
-                f"Dilution detected for {supplier_name}: "
-                f"expected ${coll.expected_amount:,.0f}, "
-                f"collected ${coll.collected_amount:,.0f} "
-                f"({coll.dilution_ratio*100:.1f}% dilution). "
-                f"Invoice #{invoice.invoice_number}"
-            ),
-            engine="dilution_monitor",
-        ))
+    suppliers = await get_entities(session, {supplier_id for _, _, supplier_id in rows})
+    for coll, invoice_number, supplier_id in rows:
+        flags.append(dilution_flag(coll, invoice_number, entity_name(suppliers, supplier_id)))
 
     return flags
+
+
+async def detect_dilution_columnar(session: AsyncSession, snap: Snapshot) -> List[FraudFlag]:
+    """Full dilution scan over a columnar snapshot."""
+    col = snap.collections
+    rows = np.flatnonzero(col["dilution_ratio"] > DILUTION_THRESHOLD)
+    if not len(rows):
+        return []
+    invoice_ids = col["invoice_id"][rows]
+    suppliers = snap.invoices["supplier_id"][snap.invoice_positions(invoice_ids)]
+    numbers = await invoice_numbers(session, invoice_ids)
+    return [
+        dilution_flag(
+            CollectionRow(int(invoice_id), float(col["expected_amount"][i]),
+                          float(col["collected_amount"][i]), float(col["dilution_ratio"][i])),
+            numbers.get(int(invoice_id)),
+            snap.entity_names.get(int(supplier_id)),
+        )
+        for i, invoice_id, supplier_id in zip(rows, invoice_ids, suppliers)
+    ]
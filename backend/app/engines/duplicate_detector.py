@@ -3,18 +3,91 @@ Duplicate Detection Engine
 Uses invoice fingerprints to detect duplicate financing across lenders.
 """
 
-from typing import List
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+from collections import defaultdict
+import numpy as np
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Invoice, FraudFlag, FraudType, AlertSeverity
+from app.snapshot import Snapshot, group_bounds
 
 
-async def detect_duplicates(session: AsyncSession, invoice: Invoice = None) -> List[FraudFlag]:
+class FingerprintMatch(NamedTuple):
+    """An earlier invoice sharing a fingerprint."""
+    id: int
+    amount: float
+    lender_id: Optional[int]
+
+
+def duplicate_flag(invoice, duplicates: Sequence) -> Optional[FraudFlag]:
+    """
+    Build the flag for an invoice whose fingerprint matches `duplicates`
+    (objects exposing id, amount and lender_id).
+    """
+    if not duplicates:
+        return None
+
+    dup_ids = [str(d.id) for d in duplicates]
+    total_exposure = sum(d.amount for d in duplicates) + invoice.amount
+
+    # Check if financed by different lenders – worst case
+    lender_ids = {d.lender_id for d in duplicates if d.lender_id}
+    if invoice.lender_id:
+        lender_ids.add(invoice.lender_id)
+
+    multi_lender = len(lender_ids) > 1
+
+    return FraudFlag(
+        invoice_id=invoice.id,
+        fraud_type=FraudType.duplicate_financing,
+        confidence=0.95 if multi_lender else 0.80,
+        severity=AlertSeverity.critical if multi_lender else AlertSeverity.high,
+        description=(
+            f"Invoice fingerprint matches {len(duplicates)} other invoice(s) "
+            f"[IDs: {', '.join(dup_ids)}]. "
+            f"Total exposure: ${total_exposure:,.0f}. "
+            f"{'Multiple lenders involved – likely double financing!' if multi_lender else 'Same lender – possible resubmission.'}"
+        ),
+        engine="duplicate_detector",
+        rule="fingerprint",
+    )
+
+
+def duplicate_group_flags(invoices: Sequence) -> List[FraudFlag]:
+    """Flag every invoice sharing one fingerprint."""
+    flags: List[FraudFlag] = []
+    if len(invoices) < 2:
+        return flags
+
+    count = len(invoices)
+    total_exposure = sum(inv.amount for inv in invoices)
+    lender_ids = {inv.lender_id for inv in invoices if inv.lender_id}
+
+    for inv in invoices:
+        flags.append(FraudFlag(
+            invoice_id=inv.id,
+            fraud_type=FraudType.duplicate_financing,
+            confidence=0.95 if len(lender_ids) > 1 else 0.80,
+            severity=AlertSeverity.critical if len(lender_ids) > 1 else AlertSeverity.high,
+            description=(
+                f"Duplicate fingerprint found across {count} invoices. "
+                f"Total exposure: ${total_exposure:,.0f}. "
+                f"Lenders involved: {len(lender_ids)}"
+            ),
+            engine="duplicate_detector",
+            rule="fingerprint",
+        ))
+
+    return flags
+
+
+async def detect_duplicates(session: AsyncSession, invoice: Invoice = None,
+                            fingerprints: Optional[Iterable[str]] = None) -> List[FraudFlag]:
     """
     Detect duplicate invoices using fingerprint matching.
     If invoice is provided, check only against that invoice.
-    Otherwise, scan all pending invoices.
+    Otherwise, scan all invoices – or only the given fingerprints.
     """
     flags: List[FraudFlag] = []
 
@@ -25,70 +98,50 @@ async def detect_duplicates(session: AsyncSession, invoice: Invoice = None) -> L
             .where(Invoice.fingerprint == invoice.fingerprint)
             .where(Invoice.id != invoice.id)
         )
-        duplicates = result.scalars().all()
-
-        if duplicates:
-            dup_ids = [str(d.id) for d in duplicates]
-            total_exposure = sum(d.amount for d in duplicates) + invoice.amount
-
-            # Check if financed by different lenders – worst case
-            lender_ids = {d.lender_id for d in duplicates if d.lender_id}
-            if invoice.lender_id:
-                lender_ids.add(invoice.lender_id)
-
-            multi_lender = len(lender_ids) > 1
-
-            flags.append(FraudFlag(
-                invoice_id=invoice.id,
-                fraud_type=FraudType.duplicate_financing,
-                confidence=0.95 if multi_lender else 0.80,
-                severity=AlertSeverity.critical if multi_lender else AlertSeverity.high,
-                description=(
-                    f"Invoice fingerprint matches {len(duplicates)} other invoice(s) "
-                    f"[IDs: {', '.join(dup_ids)}]. "
-                    f"Total exposure: ${total_exposure:,.0f}. "
-                    f"{'Multiple lenders involved – likely double financing!' if multi_lender else 'Same lender – possible resubmission.'}"
-                ),
-                engine="duplicate_detector",
-            ))
+        flag = duplicate_flag(invoice, result.scalars().all())
+        if flag:
+            flags.append(flag)
     else:
         # Full scan: find all fingerprints that appear more than once
-        dup_query = await session.execute(
+        query = (
             select(Invoice.fingerprint, func.count(Invoice.id).label("cnt"))
             .group_by(Invoice.fingerprint)
             .having(func.count(Invoice.id) > 1)
         )
+        if fingerprints is not None:
+            query = query.where(Invoice.fingerprint.in_(list(fingerprints)))
+        dup_query = await session.execute(query)
         dup_fingerprints = dup_query.all()
 
-        for fp, count in dup_fingerprints:
-            inv_result = await session.execute(
-                select(Invoice).where(Invoice.fingerprint == fp)
-            )
-            invoices = inv_result.scalars().all()
-            total_exposure = sum(inv.amount for inv in invoices)
-            lender_ids = {inv.lender_id for inv in invoices if inv.lender_id}
-
-            for inv in invoices:
-                # Check if already flagged
-                existing = await session.execute(
-                    select(FraudFlag)
-                    .where(FraudFlag.invoice_id == inv.id)
-                    .where(FraudFlag.fraud_type == FraudType.duplicate_financing)
-                )
-                if existing.scalar_one_or_none():
-                    continue
-
-                flags.append(FraudFlag(
-                    invoice_id=inv.id,
-                    fraud_type=FraudType.duplicate_financing,
-                    confidence=0.95 if len(lender_ids) > 1 else 0.80,
-                    severity=AlertSeverity.critical if len(lender_ids) > 1 else AlertSeverity.high,
-                    description=(
-                        f"Duplicate fingerprint found across {count} invoices. "
-                        f"Total exposure: ${total_exposure:,.0f}. "
-                        f"Lenders involved: {len(lender_ids)}"
-                    ),
-                    engine="duplicate_detector",
-                ))
+        inv_result = await session.execute(
+            select(Invoice)
+            .where(Invoice.fingerprint.in_([fp for fp, _ in dup_fingerprints]))
+            .order_by(Invoice.id)
+        ) if dup_fingerprints else None
+        invoices = inv_result.scalars().all() if inv_result else []
+
+        groups = defaultdict(list)
+        for inv in invoices:
+            groups[inv.fingerprint].append(inv)
+        for group in groups.values():
+            flags.extend(duplicate_group_flags(group))
+
+    return flags
+
+
+async def detect_duplicates_columnar(session: AsyncSession, snap: Snapshot) -> List[FraudFlag]:
+    """Full duplicate scan over a columnar snapshot."""
+    inv = snap.invoices
+    order = np.argsort(inv["fingerprint"], kind="stable")  # stable: id order within a group
+    codes = inv["fingerprint"][order]
+    starts, sizes = group_bounds(codes)
+    groups = [order[starts[g]:starts[g] + sizes[g]] for g in np.flatnonzero(sizes > 1)]
+    if not groups:
+        return []
 
+    flags: List[FraudFlag] = []
+    for rows in groups:
+        group = [FingerprintMatch(int(inv["id"][i]), float(inv["amount"][i]), int(inv["lender_id"][i]) or None)
+                 for i in rows]
+        flags.extend(duplicate_group_flags(group))
     return flags
@@ -0,0 +1,155 @@
+"""
+Rolling Feasibility Monitor
+Compares each supplier's trailing invoiced volume with what its annual
+revenue can plausibly support, so phantom volume split into many
+individually unremarkable invoices is still caught.
+"""
+
+import os
+import json
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import FraudFlag, FraudType, AlertSeverity
+from app.snapshot import Snapshot, invoice_numbers
+
+# Trailing window (days) -> ceiling as a share of annual revenue
+DEFAULT_CEILINGS = {30: 0.25, 90: 0.5, 365: 1.0}
+FEASIBILITY_CEILINGS: Dict[int, float] = {
+    int(days): float(share)
+    for days, share in (json.loads(os.getenv("FEASIBILITY_CEILINGS", "null")) or DEFAULT_CEILINGS).items()
+}
+
+_VOLUME_COLUMNS = ",\n           ".join(
+    f"SUM(i.amount) OVER (PARTITION BY i.supplier_id ORDER BY i.invoice_date "
+    f"RANGE BETWEEN INTERVAL '{days - 1} days' PRECEDING AND CURRENT ROW) AS vol_{days}"
+    for days in sorted(FEASIBILITY_CEILINGS)
+)
+_BREACHES = " OR ".join(
+    f"w.vol_{days} > w.annual_revenue * {share!r}" for days, share in sorted(FEASIBILITY_CEILINGS.items())
+)
+
+# One pass over every supplier's invoices in (supplier_id, invoice_date)
+# order – the order of ix_invoice_supplier_date – keeping only invoices at
+# which some trailing window is over its ceiling
+ROLLING_VOLUME_SQL = f"""
+SELECT w.* FROM (
+    SELECT i.id, i.invoice_number, i.supplier_id, i.invoice_date, i.amount,
+           e.name AS supplier_name, e.annual_revenue,
+           {_VOLUME_COLUMNS}
+    FROM invoices i
+    JOIN entities e ON e.id = i.supplier_id
+    WHERE e.annual_revenue > 0 {{supplier_filter}}
+) w
+WHERE {_BREACHES}
+ORDER BY w.supplier_id, w.invoice_date, w.id
+"""
+
+
+def rolling_feasibility_flags(rows: Sequence) -> List[FraudFlag]:
+    """
+    Flag every invoice at which a trailing window's volume exceeds its
+    revenue ceiling, describing the window breached by the widest margin.
+    `rows` expose id, invoice_number, supplier_name, annual_revenue and
+    vol_<days> for each configured window.
+    """
+    flags: List[FraudFlag] = []
+    for row in rows:
+        days, ratio = max(
+            ((d, getattr(row, f"vol_{d}") / (row.annual_revenue * share))
+             for d, share in FEASIBILITY_CEILINGS.items()),
+            key=lambda item: item[1],
+        )
+        if ratio <= 1:
+            continue
+        volume = getattr(row, f"vol_{days}")
+        flags.append(FraudFlag(
+            invoice_id=row.id,
+            fraud_type=FraudType.phantom_invoice,
+            confidence=min(0.6 + 0.2 * (ratio - 1), 0.95),
+            severity=AlertSeverity.critical if ratio > 2 else AlertSeverity.high,
+            description=(
+                f"{row.supplier_name} invoiced ${volume:,.0f} in the {days} days to "
+                f"Invoice #{row.invoice_number} – {volume / row.annual_revenue * 100:.0f}% of "
+                f"annual revenue ${row.annual_revenue:,.0f}, "
+                f"{ratio:.1f}x the {FEASIBILITY_CEILINGS[days] * 100:.0f}% ceiling"
+            ),
+            engine="feasibility_monitor",
+            rule="rolling_volume",
+        ))
+    return flags
+
+
+async def detect_infeasible_volume(session: AsyncSession,
+                                   supplier_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+    """
+    Flag invoices that push a supplier's trailing 30/90/365-day volume past
+    a revenue-based ceiling.  Restricted to `supplier_ids` when given (their
+    full history is still windowed).
+    """
+    params = {}
+    supplier_filter = ""
+    if supplier_ids is not None:
+        params["supplier_ids"] = list(supplier_ids)
+        if not params["supplier_ids"]:
+            return []
+        supplier_filter = "AND i.supplier_id = ANY(CAST(:supplier_ids AS INTEGER[]))"
+
+    rows = (await session.execute(
+        text(ROLLING_VOLUME_SQL.format(supplier_filter=supplier_filter)), params
+    )).all()
+    return rolling_feasibility_flags(rows)
+
+
+def trailing_volumes(keys: np.ndarray, amounts: np.ndarray, days: int) -> np.ndarray:
+    """
+    Sum of `amounts` over the trailing `days` for rows sorted by `keys`
+    (supplier and day packed into one integer), peers on the same day
+    included – the same frame as ROLLING_VOLUME_SQL's RANGE window.
+    """
+    cumulative = np.r_[0.0, np.cumsum(amounts)]
+    first = np.searchsorted(keys, keys - (days - 1), side="left")
+    last = np.searchsorted(keys, keys, side="right")
+    return cumulative[last] - cumulative[first]
+
+
+async def detect_infeasible_volume_columnar(session: AsyncSession, snap: Snapshot) -> List[FraudFlag]:
+    """Full rolling-volume scan over a columnar snapshot."""
+    inv = snap.invoices
+    revenue = snap.revenue_of(inv["supplier_id"])
+    rows = np.flatnonzero(revenue > 0)
+    if not len(rows):
+        return []
+    # Pack (supplier, day) so one sorted key drives every window; day offsets
+    # never cross into another supplier's range
+    span = int(inv["day"][rows].max()) - int(inv["day"][rows].min()) + max(FEASIBILITY_CEILINGS) + 1
+    keys = inv["supplier_id"][rows] * span + (inv["day"][rows] - int(inv["day"][rows].min()))
+    order = np.argsort(keys, kind="stable")
+    rows, keys, revenue = rows[order], keys[order], revenue[rows][order]
+    amounts = inv["amount"][rows]
+
+    volumes = {days: trailing_volumes(keys, amounts, days) for days in FEASIBILITY_CEILINGS}
+    breach = np.zeros(len(rows), dtype=bool)
+    for days, share in FEASIBILITY_CEILINGS.items():
+        breach |= volumes[days] > revenue * share
+    hits = np.flatnonzero(breach)
+    if not len(hits):
+        return []
+
+    numbers = await invoice_numbers(session, inv["id"][rows[hits]])
+
+    breaches = []
+    for h in hits:
+        invoice_id = int(inv["id"][rows[h]])
+        breaches.append(SimpleNamespace(
+            id=invoice_id,
+            invoice_number=numbers.get(invoice_id),
+            supplier_name=snap.entity_names.get(int(inv["supplier_id"][rows[h]])),
+            annual_revenue=float(revenue[h]),
+            **{f"vol_{days}": float(v[h]) for days, v in volumes.items()},
+        ))
+    return rolling_feasibility_flags(breaches)
@@ -7,9 +7,10 @@ Uses NetworkX for:
 4. Centrality-based risk scoring
 """
 
-from typing import List, Dict, Tuple, Set
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from collections import defaultdict
 import networkx as nx
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import (
@@ -110,53 +111,77 @@ def detect_carousel_cycles(G: nx.DiGraph) -> List[List[int]]:
     return cycles
 
 
-async def detect_carousel_fraud(session: AsyncSession) -> List[FraudFlag]:
-    """Flag invoices involved in carousel trade cycles."""
+def carousel_flags(cycle: List[int], by_pair: Dict[Tuple[int, int], Sequence],
+                   names: Dict[int, str], flagged: Set[int]) -> List[FraudFlag]:
+    """
+    Flag the invoices along each edge of one cycle.
+    `by_pair` maps (supplier_id, buyer_id) to invoices; `flagged` holds
+    invoice ids flagged for earlier cycles in this run and is updated in
+    place, so an invoice on several cycles is flagged for the first.
+    """
+    flags: List[FraudFlag] = []
+    entity_names = [names[nid] for nid in cycle if names.get(nid)]
+
+    for i, node_id in enumerate(cycle):
+        next_node = cycle[(i + 1) % len(cycle)]
+
+        for inv in by_pair.get((node_id, next_node), []):
+            if inv.id in flagged:
+                continue
+            flagged.add(inv.id)
+
+            flags.append(FraudFlag(
+                invoice_id=inv.id,
+                fraud_type=FraudType.carousel_trade,
+                confidence=0.85,
+                severity=AlertSeverity.critical,
+                description=(
+                    f"Carousel trade cycle detected: "
+                    f"{' → '.join(entity_names)} → {entity_names[0]}. "
+                    f"Invoice ${inv.amount:,.0f} is part of a circular trading pattern."
+                ),
+                engine="graph_analytics",
+                rule="cycle",
+            ))
+
+    return flags
+
+
+async def detect_carousel_fraud(session: AsyncSession,
+                                entity_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+    """
+    Flag invoices involved in carousel trade cycles.
+    Only cycles passing through `entity_ids` are examined when given.
+    """
     flags: List[FraudFlag] = []
 
     G = await build_network(session)
+    if entity_ids is not None:
+        # Cycles never leave a connected component, so search only the touched ones
+        touched = set(entity_ids)
+        nodes = set()
+        for component in nx.weakly_connected_components(G):
+            if touched & component:
+                nodes |= component
+        G = G.subgraph(nodes)
     cycles = detect_carousel_cycles(G)
-
+    if entity_ids is not None:
+        cycles = [c for c in cycles if touched.intersection(c)]
+
+    # Invoices along every cycle edge, in one query
+    pairs = {(c[i], c[(i + 1) % len(c)]) for c in cycles for i in range(len(c))}
+    by_pair: Dict[Tuple[int, int], List[Invoice]] = defaultdict(list)
+    if pairs:
+        inv_result = await session.execute(
+            select(Invoice).where(tuple_(Invoice.supplier_id, Invoice.buyer_id).in_(list(pairs)))
+        )
+        for inv in inv_result.scalars().all():
+            by_pair[(inv.supplier_id, inv.buyer_id)].append(inv)
+
+    flagged: Set[int] = set()
+    names = {n: data.get("name") for n, data in G.nodes(data=True)}
     for cycle in cycles:
-        # Find invoices between entities in this cycle
-        cycle_set = set(cycle)
-        for i, node_id in enumerate(cycle):
-            next_node = cycle[(i + 1) % len(cycle)]
-
-            inv_result = await session.execute(
-                select(Invoice)
-                .where(Invoice.supplier_id == node_id)
-                .where(Invoice.buyer_id == next_node)
-            )
-            invoices = inv_result.scalars().all()
-
-            for inv in invoices:
-                existing = await session.execute(
-                    select(FraudFlag)
-                    .where(FraudFlag.invoice_id == inv.id)
-                    .where(FraudFlag.fraud_type == FraudType.carousel_trade)
-                )
-                if existing.scalar_one_or_none():
-                    continue
-
-                entity_names = []
-                for nid in cycle:
-                    e = await session.get(Entity, nid)
-                    if e:
-                        entity_names.append(e.name)
-
-                flags.append(FraudFlag(
-                    invoice_id=inv.id,
-                    fraud_type=FraudType.carousel_trade,
-                    confidence=0.85,
-                    severity=AlertSeverity.critical,
-                    description=(
-                        f"Carousel trade cycle detected: "
-                        f"{' → '.join(entity_names)} → {entity_names[0]}. "
-                        f"Invoice ${inv.amount:,.0f} is part of a circular trading pattern."
-                    ),
-                    engine="graph_analytics",
-                ))
+        flags.extend(carousel_flags(cycle, by_pair, names, flagged))
 
     return flags
 
@@ -4,14 +4,23 @@ Validates invoices against PO, GRN, and delivery confirmations.
 Checks feasibility metrics (revenue vs invoice volume) to flag phantoms.
 """
 
+import os
 import hashlib
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import Invoice, Entity, FraudFlag, FraudType, AlertSeverity, Tier
+from app.models import Invoice, FraudFlag, FraudType, AlertSeverity, Tier
+from app.entity_cache import get_entity
+from app.pair_stats import PairStats, load_pair_stats
+
+OVER_INVOICE_MODE = os.getenv("OVER_INVOICE_MODE", "ratio")  # ratio / zscore / quantile
+OVER_INVOICE_RATIO = float(os.getenv("OVER_INVOICE_RATIO", "2.5"))
+OVER_INVOICE_ZSCORE = float(os.getenv("OVER_INVOICE_ZSCORE", "3"))
+OVER_INVOICE_QUANTILE = float(os.getenv("OVER_INVOICE_QUANTILE", "0.99"))
+REVENUE_SHARE_THRESHOLD = float(os.getenv("REVENUE_SHARE_THRESHOLD", "0.25"))
+QUANTILE_MIN_HISTORY = 20  # fewer invoices and the top quantile is just the maximum
 
 
 def compute_fingerprint(invoice_number: str, supplier_id: int, buyer_id: int,
@@ -21,11 +30,10 @@ def compute_fingerprint(invoice_number: str, supplier_id: int, buyer_id: int,
     return hashlib.sha256(raw.encode()).hexdigest()
 
 
-async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[FraudFlag]:
-    """Run all validation checks on a single invoice."""
+def document_flags(invoice) -> List[FraudFlag]:
+    """PO/GRN/delivery checks that only need the invoice's own fields."""
     flags: List[FraudFlag] = []
 
-    # 1. PO/GRN/Delivery validation
     if not invoice.po_validated and invoice.po_number:
         flags.append(FraudFlag(
             invoice_id=invoice.id,
@@ -34,6 +42,7 @@ async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[Frau
             severity=AlertSeverity.medium,
             description=f"PO #{invoice.po_number} could not be validated against ERP records",
             engine="invoice_validator",
+            rule="po_unvalidated",
         ))
 
     if not invoice.grn_validated and invoice.grn_number:
@@ -44,6 +53,7 @@ async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[Frau
             severity=AlertSeverity.medium,
             description=f"GRN #{invoice.grn_number} mismatch – goods receipt not confirmed",
             engine="invoice_validator",
+            rule="grn_mismatch",
         ))
 
     if not invoice.delivery_confirmed:
@@ -54,6 +64,7 @@ async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[Frau
             severity=AlertSeverity.high,
             description="No delivery confirmation found for this invoice",
             engine="invoice_validator",
+            rule="no_delivery",
         ))
 
     # No PO or GRN at all – suspicious
@@ -65,47 +76,92 @@ async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[Frau
             severity=AlertSeverity.high,
             description="Invoice has no associated PO or GRN – potential phantom invoice",
             engine="invoice_validator",
+            rule="no_po_grn",
         ))
 
-    # 2. Feasibility check – invoice amount vs supplier annual revenue
-    supplier = await session.get(Entity, invoice.supplier_id)
-    if supplier and supplier.annual_revenue > 0:
-        ratio = invoice.amount / supplier.annual_revenue
-        if ratio > 0.25:
-            flags.append(FraudFlag(
-                invoice_id=invoice.id,
-                fraud_type=FraudType.phantom_invoice,
-                confidence=min(0.5 + ratio, 0.99),
-                severity=AlertSeverity.critical if ratio > 0.5 else AlertSeverity.high,
-                description=(
-                    f"Single invoice is {ratio*100:.1f}% of supplier annual revenue "
-                    f"(${invoice.amount:,.0f} vs ${supplier.annual_revenue:,.0f})"
-                ),
-                engine="feasibility_checker",
-            ))
-
-    # 3. Over-invoicing: check if amount exceeds 2x the average for this supplier-buyer pair
-    avg_result = await session.execute(
-        select(func.avg(Invoice.amount), func.count(Invoice.id))
-        .where(Invoice.supplier_id == invoice.supplier_id)
-        .where(Invoice.buyer_id == invoice.buyer_id)
-        .where(Invoice.id != invoice.id)
+    return flags
+
+
+def feasibility_flag(invoice, annual_revenue: Optional[float]) -> Optional[FraudFlag]:
+    """Flag a single invoice that is an implausible share of supplier revenue."""
+    if not annual_revenue or annual_revenue <= 0:
+        return None
+    ratio = invoice.amount / annual_revenue
+    if ratio <= REVENUE_SHARE_THRESHOLD:
+        return None
+    return FraudFlag(
+        invoice_id=invoice.id,
+        fraud_type=FraudType.phantom_invoice,
+        confidence=min(0.5 + ratio, 0.99),
+        severity=AlertSeverity.critical if ratio > 0.5 else AlertSeverity.high,
+        description=(
+            f"Single invoice is {ratio*100:.1f}% of supplier annual revenue "
+            f"(${invoice.amount:,.0f} vs ${annual_revenue:,.0f})"
+        ),
+        engine="feasibility_checker",
+        rule="revenue_share",
     )
-    row = avg_result.one_or_none()
-    if row and row[0] and row[1] >= 3:
-        avg_amount = row[0]
-        if invoice.amount > avg_amount * 2.5:
-            flags.append(FraudFlag(
-                invoice_id=invoice.id,
-                fraud_type=FraudType.over_invoicing,
-                confidence=0.75,
-                severity=AlertSeverity.high,
-                description=(
-                    f"Invoice amount ${invoice.amount:,.0f} is "
-                    f"{invoice.amount/avg_amount:.1f}x the historical average "
-                    f"${avg_amount:,.0f} for this trading pair"
-                ),
-                engine="over_invoice_detector",
-            ))
+
+
+def over_invoicing_flag(invoice, stats: Optional[PairStats]) -> Optional[FraudFlag]:
+    """
+    Flag an amount far above the trading pair's history.  OVER_INVOICE_MODE
+    picks the threshold: a multiple of the mean (ratio), standard deviations
+    above it (zscore) or a historical quantile (quantile).  The statistical
+    modes fall back to the ratio while the pair has too little history.
+    """
+    if not stats or stats.count < 3 or not stats.mean:
+        return None
+    multiple = invoice.amount / stats.mean
+
+    if OVER_INVOICE_MODE == "zscore" and stats.std > 0:
+        zscore = (invoice.amount - stats.mean) / stats.std
+        if zscore <= OVER_INVOICE_ZSCORE:
+            return None
+        reason = f"{zscore:.1f} standard deviations above"
+    elif OVER_INVOICE_MODE == "quantile" and stats.count >= QUANTILE_MIN_HISTORY:
+        threshold = stats.quantile(OVER_INVOICE_QUANTILE)
+        if invoice.amount <= threshold:
+            return None
+        reason = f"above the p{OVER_INVOICE_QUANTILE*100:g} amount ${threshold:,.0f} and {multiple:.1f}x"
+    else:
+        if multiple <= OVER_INVOICE_RATIO:
+            return None
+        reason = f"{multiple:.1f}x"
+
+    return FraudFlag(
+        invoice_id=invoice.id,
+        fraud_type=FraudType.over_invoicing,
+        confidence=0.75,
+        severity=AlertSeverity.high,
+        description=(
+            f"Invoice amount ${invoice.amount:,.0f} is "
+            f"{reason} the historical average "
+            f"${stats.mean:,.0f} for this trading pair"
+        ),
+        engine="over_invoice_detector",
+        rule="pair_average",
+    )
+
+
+async def validate_invoice(session: AsyncSession, invoice: Invoice) -> List[FraudFlag]:
+    """Run all validation checks on a single invoice."""
+    # 1. PO/GRN/Delivery validation
+    flags = document_flags(invoice)
+
+    # 2. Feasibility check – invoice amount vs supplier annual revenue
+    supplier = await get_entity(session, invoice.supplier_id)
+    flag = feasibility_flag(invoice, supplier.annual_revenue if supplier else None)
+    if flag:
+        flags.append(flag)
+
+    # 3. Over-invoicing against the pair's running statistics, which
+    #    already include this (stored) invoice
+    pair = (invoice.supplier_id, invoice.buyer_id)
+    stats = (await load_pair_stats(session, [pair])).get(pair)
+    if stats:
+        flag = over_invoicing_flag(invoice, stats.without(invoice.amount))
+        if flag:
+            flags.append(flag)
 
     return flags
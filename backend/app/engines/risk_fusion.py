@@ -0,0 +1,121 @@
+"""
+Risk Score Fusion
+Combines the flags raised against each invoice into one 0-100 risk score.
+Flags are grouped by invoice in a single vectorized pass and fused with a
+configurable model (RISK_FUSION_MODEL):
+1. max      – strongest single flag (the historical behaviour)
+2. noisy_or – independent evidence: 1 - Π(1 - confidence)
+3. logistic – weighted sum of the strongest confidence per fraud type,
+              squashed through a sigmoid (weights via RISK_FUSION_WEIGHTS)
+"""
+
+import os
+import json
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import FraudFlag, FraudType
+
+FUSION_MODELS = ("max", "noisy_or", "logistic")
+FUSION_MODEL = os.getenv("RISK_FUSION_MODEL", "max")
+
+# Logistic weights per fraud type plus an intercept
+DEFAULT_WEIGHTS = {
+    "bias": -3.0,
+    FraudType.phantom_invoice.value: 4.0,
+    FraudType.duplicate_financing.value: 5.0,
+    FraudType.over_invoicing.value: 3.0,
+    FraudType.carousel_trade.value: 5.0,
+    FraudType.dilution.value: 3.0,
+    FraudType.velocity_anomaly.value: 2.5,
+    FraudType.cascade_fraud.value: 4.5,
+    FraudType.ml_anomaly.value: 2.0,
+}
+WEIGHTS = {**DEFAULT_WEIGHTS, **json.loads(os.getenv("RISK_FUSION_WEIGHTS", "{}"))}
+
+FRAUD_TYPES = [t.value for t in FraudType]
+_TYPE_INDEX = {t: i for i, t in enumerate(FRAUD_TYPES)}
+
+FLAGGED_THRESHOLD = 50
+
+APPLY_SCORES_SQL = text("""
+UPDATE invoices
+SET risk_score = GREATEST(invoices.risk_score, v.score),
+    status = CASE WHEN GREATEST(invoices.risk_score, v.score) > :threshold
+                  THEN 'flagged' ELSE invoices.status END
+FROM unnest(CAST(:ids AS INTEGER[]), CAST(:scores AS DOUBLE PRECISION[])) AS v(id, score)
+WHERE invoices.id = v.id AND invoices.status = 'pending'
+""")
+
+
+def _type_value(fraud_type) -> str:
+    return fraud_type.value if hasattr(fraud_type, 'value') else str(fraud_type)
+
+
+def fuse_scores(invoice_ids: Sequence[int], fraud_types: Sequence, confidences: Sequence[float],
+                model: Optional[str] = None) -> Dict[int, float]:
+    """Fuse parallel (invoice, fraud type, confidence) columns into a score per invoice."""
+    model = model or FUSION_MODEL
+    if model not in FUSION_MODELS:
+        raise ValueError(f"Unknown risk fusion model {model!r}")
+    if len(invoice_ids) == 0:
+        return {}
+
+    ids, group = np.unique(np.asarray(invoice_ids, dtype=np.int64), return_inverse=True)
+    conf = np.clip(np.asarray(confidences, dtype=np.float64), 0.0, 1.0)
+
+    if model == "max":
+        fused = np.zeros(len(ids))
+        np.maximum.at(fused, group, conf)
+    elif model == "noisy_or":
+        log_miss = np.zeros(len(ids))
+        np.add.at(log_miss, group, np.log1p(-np.minimum(conf, 1 - 1e-9)))
+        fused = 1.0 - np.exp(log_miss)
+    else:
+        types = np.fromiter((_TYPE_INDEX[_type_value(t)] for t in fraud_types),
+                            dtype=np.int64, count=len(conf))
+        evidence = np.zeros((len(ids), len(FRAUD_TYPES)))
+        np.maximum.at(evidence, (group, types), conf)
+        weights = np.array([WEIGHTS.get(t, 0.0) for t in FRAUD_TYPES])
+        fused = 1.0 / (1.0 + np.exp(-(WEIGHTS["bias"] + evidence @ weights)))
+
+    scores = np.round(fused * 100, 1)
+    return dict(zip(ids.tolist(), scores.tolist()))
+
+
+def fuse_flags(flags: Iterable[FraudFlag], model: Optional[str] = None) -> Dict[int, float]:
+    """Fuse in-memory flags (e.g. freshly raised ones) into a score per invoice."""
+    flags = list(flags)
+    return fuse_scores(
+        [f.invoice_id for f in flags],
+        [f.fraud_type for f in flags],
+        [f.confidence for f in flags],
+        model,
+    )
+
+
+async def apply_risk_scores(session: AsyncSession, invoice_ids: Iterable[int]) -> Dict[int, float]:
+    """
+    Re-fuse every unresolved flag on `invoice_ids` and write the scores of
+    pending invoices with one bulk UPDATE, flagging those above the threshold.
+    Scores only ever rise, so manual or earlier assessments are kept.
+    """
+    invoice_ids = list(set(invoice_ids))
+    if not invoice_ids:
+        return {}
+
+    result = await session.execute(
+        select(FraudFlag.invoice_id, FraudFlag.fraud_type, FraudFlag.confidence)
+        .where(FraudFlag.invoice_id.in_(invoice_ids))
+        .where(FraudFlag.resolved.isnot(True))
+    )
+    rows = result.all()
+    scores = fuse_scores([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+    if scores:
+        await session.execute(APPLY_SCORES_SQL, {
+            "ids": list(scores), "scores": list(scores.values()), "threshold": FLAGGED_THRESHOLD,
+        })
+    return scores
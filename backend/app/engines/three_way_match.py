@@ -0,0 +1,169 @@
+"""
+Three-Way Match Engine
+Matches invoices against the ERP ledger – the buyer's purchase order and
+the goods receipts against it – checking that the documents exist and agree,
+that billing stays within the ordered and received value, and that the
+order, receipt and invoice dates run in sequence.
+"""
+
+import os
+from datetime import timedelta
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import FraudFlag, FraudType, AlertSeverity
+
+AMOUNT_TOLERANCE = float(os.getenv("ERP_AMOUNT_TOLERANCE", "0.02"))     # share of the PO/received value
+DATE_TOLERANCE = timedelta(days=int(os.getenv("ERP_DATE_TOLERANCE_DAYS", "7")))
+
+# Every CTE is a set-based aggregate over the scoped invoices' POs, so the
+# planner hash-joins invoices, POs and receipts in one pass.  Only buyers
+# with POs on the ledger are matched; `billed_to_date` is the PO's running
+# invoiced total in invoice order, so only invoices past the limit are flagged.
+MATCH_SQL = """
+WITH scoped AS (
+    SELECT id, invoice_number, supplier_id, buyer_id, amount, invoice_date,
+           po_number, grn_number, po_validated, grn_validated
+    FROM invoices
+    WHERE (po_number IS NOT NULL OR grn_number IS NOT NULL) {invoice_filter}
+),
+covered AS (
+    SELECT DISTINCT buyer_id FROM purchase_orders
+    WHERE buyer_id IN (SELECT buyer_id FROM scoped)
+),
+received AS (
+    SELECT r.supplier_id, r.po_number, SUM(r.quantity) AS received_qty,
+           MIN(r.received_date) AS first_received
+    FROM goods_receipts r
+    WHERE (r.supplier_id, r.po_number) IN (SELECT supplier_id, po_number FROM scoped)
+    GROUP BY r.supplier_id, r.po_number
+),
+billed AS (
+    SELECT b.id, SUM(b.amount) OVER (
+               PARTITION BY b.supplier_id, b.po_number ORDER BY b.invoice_date, b.id
+           ) AS billed_to_date
+    FROM invoices b
+    WHERE (b.supplier_id, b.po_number) IN (SELECT supplier_id, po_number FROM scoped)
+)
+SELECT s.*,
+       po.id AS po_id, po.buyer_id AS po_buyer_id, po.quantity AS po_quantity,
+       po.unit_price, po.amount AS po_amount, po.issue_date,
+       g.id AS grn_id, g.po_number AS grn_po_number,
+       rc.received_qty, rc.first_received, bl.billed_to_date
+FROM scoped s
+JOIN covered cv ON cv.buyer_id = s.buyer_id
+LEFT JOIN purchase_orders po ON po.supplier_id = s.supplier_id AND po.po_number = s.po_number
+LEFT JOIN goods_receipts g ON g.supplier_id = s.supplier_id AND g.grn_number = s.grn_number
+LEFT JOIN received rc ON rc.supplier_id = s.supplier_id AND rc.po_number = s.po_number
+LEFT JOIN billed bl ON bl.id = s.id
+ORDER BY s.id
+"""
+
+
+def _flag(row, fraud_type: FraudType, confidence: float, severity: AlertSeverity,
+          rule: str, description: str) -> FraudFlag:
+    return FraudFlag(
+        invoice_id=row.id,
+        fraud_type=fraud_type,
+        confidence=confidence,
+        severity=severity,
+        description=f"Invoice #{row.invoice_number}: {description}",
+        engine="three_way_match",
+        rule=rule,
+    )
+
+
+def _excess_flag(row, limit: float, rule: str, what: str) -> Optional[FraudFlag]:
+    """Flag billing past `limit` (plus tolerance); `what` names the limit."""
+    if row.billed_to_date is None or row.billed_to_date <= limit * (1 + AMOUNT_TOLERANCE):
+        return None
+    ratio = row.billed_to_date / limit if limit > 0 else float("inf")
+    return _flag(
+        row, FraudType.over_invoicing,
+        min(0.6 + 0.2 * (ratio - 1), 0.95),
+        AlertSeverity.critical if ratio > 1.5 else AlertSeverity.high,
+        rule,
+        f"${row.billed_to_date:,.0f} billed against PO #{row.po_number} "
+        f"exceeds the {what} ${limit:,.0f}",
+    )
+
+
+def three_way_flags(rows: Sequence) -> List[FraudFlag]:
+    """
+    Apply the match rules to MATCH_SQL rows.  Existence rules only fire for
+    invoices that passed the inline check (it ran before the ledger knew the
+    buyer); invoices it rejected already carry a validator flag.
+    """
+    flags: List[FraudFlag] = []
+    for row in rows:
+        found: List[Optional[FraudFlag]] = []
+
+        # 1. Document existence and agreement
+        if row.po_number and row.po_validated:
+            if row.po_id is None:
+                found.append(_flag(row, FraudType.phantom_invoice, 0.80, AlertSeverity.high, "po_not_found",
+                                   f"PO #{row.po_number} is not on the buyer's ERP ledger"))
+            elif row.po_buyer_id != row.buyer_id:
+                found.append(_flag(row, FraudType.phantom_invoice, 0.85, AlertSeverity.high, "po_buyer_mismatch",
+                                   f"PO #{row.po_number} was issued by a different buyer"))
+        if row.grn_number and row.grn_validated:
+            if row.grn_id is None:
+                found.append(_flag(row, FraudType.phantom_invoice, 0.75, AlertSeverity.high, "grn_not_found",
+                                   f"GRN #{row.grn_number} is not on the ERP ledger"))
+            elif row.po_number and row.grn_po_number != row.po_number:
+                found.append(_flag(row, FraudType.phantom_invoice, 0.70, AlertSeverity.medium, "grn_po_mismatch",
+                                   f"GRN #{row.grn_number} receives PO #{row.grn_po_number}, "
+                                   f"not PO #{row.po_number}"))
+
+        if row.po_id is not None:
+            # 2. Quantities and amounts
+            if row.received_qty is not None and row.received_qty > row.po_quantity * (1 + AMOUNT_TOLERANCE):
+                found.append(_flag(row, FraudType.phantom_invoice, 0.60, AlertSeverity.medium, "over_received",
+                                   f"{row.received_qty:,.0f} units received against "
+                                   f"{row.po_quantity:,.0f} ordered on PO #{row.po_number}"))
+            found.append(_excess_flag(row, row.po_amount, "over_po", "PO value"))
+            if row.received_qty is not None:
+                found.append(_excess_flag(row, row.received_qty * row.unit_price, "over_receipt",
+                                          "value of goods received"))
+
+            # 3. Date sequence: PO, then receipt, then invoice
+            if row.invoice_date < row.issue_date - DATE_TOLERANCE:
+                found.append(_flag(row, FraudType.phantom_invoice, 0.70, AlertSeverity.high, "invoice_before_po",
+                                   f"dated {row.invoice_date}, before PO #{row.po_number} "
+                                   f"was issued on {row.issue_date}"))
+            if row.first_received is not None:
+                if row.first_received < row.issue_date - DATE_TOLERANCE:
+                    found.append(_flag(row, FraudType.phantom_invoice, 0.60, AlertSeverity.medium,
+                                       "receipt_before_po",
+                                       f"goods for PO #{row.po_number} received {row.first_received}, "
+                                       f"before the PO was issued on {row.issue_date}"))
+                if row.invoice_date < row.first_received - DATE_TOLERANCE:
+                    found.append(_flag(row, FraudType.phantom_invoice, 0.55, AlertSeverity.medium,
+                                       "billed_before_receipt",
+                                       f"dated {row.invoice_date}, before the first goods receipt "
+                                       f"on {row.first_received}"))
+
+        flags.extend(f for f in found if f)
+    return flags
+
+
+async def detect_three_way_mismatches(session: AsyncSession,
+                                      invoice_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+    """
+    Match invoices to their POs and goods receipts.  Restricted to
+    `invoice_ids` when given (running PO totals still count every invoice).
+    """
+    params = {}
+    invoice_filter = ""
+    if invoice_ids is not None:
+        params["invoice_ids"] = list(invoice_ids)
+        if not params["invoice_ids"]:
+            return []
+        invoice_filter = "AND id = ANY(CAST(:invoice_ids AS INTEGER[]))"
+
+    rows = (await session.execute(
+        text(MATCH_SQL.format(invoice_filter=invoice_filter)), params
+    )).all()
+    return three_way_flags(rows)
@@ -3,27 +3,102 @@ Velocity & Sequencing Anomaly Detector
 Detects unusual patterns in invoice submission frequency per tier.
 """
 
-from typing import List
+import os
+from typing import Iterable, List, NamedTuple, Optional, Sequence
 from datetime import timedelta
+import numpy as np
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Invoice, FraudFlag, FraudType, AlertSeverity, Entity
+from app.snapshot import Snapshot, group_bounds, invoice_numbers
 
+SAME_DAY_MIN_AMOUNT = float(os.getenv("SAME_DAY_MIN_AMOUNT", "50000"))
 
-async def detect_velocity_anomalies(session: AsyncSession) -> List[FraudFlag]:
+
+class InvoiceRow(NamedTuple):
+    id: int
+    amount: float
+    invoice_number: Optional[str]
+
+
+def same_day_flag(supplier_name: str, invoice, previous) -> FraudFlag:
+    """Flag `invoice`, submitted the same day as `previous` from one supplier."""
+    return FraudFlag(
+        invoice_id=invoice.id,
+        fraud_type=FraudType.velocity_anomaly,
+        confidence=0.70,
+        severity=AlertSeverity.high,
+        description=(
+            f"Rapid sequential invoice from {supplier_name}: "
+            f"${invoice.amount:,.0f} submitted same day as "
+            f"${previous.amount:,.0f} (Invoice #{previous.invoice_number})"
+        ),
+        engine="velocity_detector",
+        rule="same_day",
+    )
+
+
+def volume_spike_flag(supplier_name: str, invoice_id: int, avg_recent: float,
+                      hist_avg_amount: float) -> FraudFlag:
+    """Flag the latest invoice of a supplier whose recent amounts spiked."""
+    return FraudFlag(
+        invoice_id=invoice_id,
+        fraud_type=FraudType.velocity_anomaly,
+        confidence=0.80,
+        severity=AlertSeverity.high,
+        description=(
+            f"Invoice volume spike for {supplier_name}: "
+            f"recent avg ${avg_recent:,.0f} is "
+            f"{avg_recent/hist_avg_amount:.1f}x historical avg ${hist_avg_amount:,.0f}"
+        ),
+        engine="velocity_spike_detector",
+        rule="volume_spike",
+    )
+
+
+def velocity_flags(supplier_name: str, invoices: Sequence) -> List[FraudFlag]:
+    """Apply the velocity rules to one supplier's invoices (ordered by date)."""
+    flags: List[FraudFlag] = []
+
+    if len(invoices) < 3:
+        return flags
+
+    # 1. Check for rapid sequential invoices (< 1 day apart)
+    for i in range(1, len(invoices)):
+        gap = (invoices[i].invoice_date - invoices[i - 1].invoice_date).days
+        if gap == 0 and invoices[i].amount > SAME_DAY_MIN_AMOUNT:
+            flags.append(same_day_flag(supplier_name, invoices[i], invoices[i - 1]))
+
+    # 2. Volume spike detection – compare recent vs historical
+    if len(invoices) >= 6:
+        recent_count = len(invoices[-3:])
+        recent_total = sum(inv.amount for inv in invoices[-3:])
+        hist_avg_amount = sum(inv.amount for inv in invoices[:-3]) / len(invoices[:-3])
+
+        avg_recent = recent_total / recent_count
+        if avg_recent > hist_avg_amount * 3:
+            flags.append(volume_spike_flag(supplier_name, invoices[-1].id, avg_recent, hist_avg_amount))
+
+    return flags
+
+
+async def detect_velocity_anomalies(session: AsyncSession,
+                                    supplier_ids: Optional[Iterable[int]] = None) -> List[FraudFlag]:
     """
     Detect velocity anomalies:
     1. Sudden spike in invoice count per supplier within a rolling window
     2. Unusually rapid sequential invoices
     3. Tier-specific submission rate anomalies
+    Restricted to `supplier_ids` when given.
     """
     flags: List[FraudFlag] = []
 
     # Get all suppliers
-    suppliers_result = await session.execute(
-        select(Entity).where(Entity.entity_type == "supplier")
-    )
+    query = select(Entity).where(Entity.entity_type == "supplier")
+    if supplier_ids is not None:
+        query = query.where(Entity.id.in_(list(supplier_ids)))
+    suppliers_result = await session.execute(query)
     suppliers = suppliers_result.scalars().all()
 
     for supplier in suppliers:
@@ -35,62 +110,59 @@ async def detect_velocity_anomalies(session: AsyncSession) -> List[FraudFlag]:
         )
         invoices = inv_result.scalars().all()
 
-        if len(invoices) < 3:
-            continue
-
-        # 1. Check for rapid sequential invoices (< 1 day apart)
-        for i in range(1, len(invoices)):
-            gap = (invoices[i].invoice_date - invoices[i - 1].invoice_date).days
-            if gap == 0 and invoices[i].amount > 50000:
-                # Check if already flagged
-                existing = await session.execute(
-                    select(FraudFlag)
-                    .where(FraudFlag.invoice_id == invoices[i].id)
-                    .where(FraudFlag.fraud_type == FraudType.velocity_anomaly)
-                )
-                if existing.scalar_one_or_none():
-                    continue
-
-                flags.append(FraudFlag(
-                    invoice_id=invoices[i].id,
-                    fraud_type=FraudType.velocity_anomaly,
-                    confidence=0.70,
-                    severity=AlertSeverity.high,
-                    description=(
-                        f"Rapid sequential invoice from {supplier.name}: "
-                        f"${invoices[i].amount:,.0f} submitted same day as "
-                        f"${invoices[i-1].amount:,.0f} (Invoice #{invoices[i-1].invoice_number})"
-                    ),
-                    engine="velocity_detector",
-                ))
-
-        # 2. Volume spike detection – compare recent vs historical
-        if len(invoices) >= 6:
-            recent_count = len(invoices[-3:])
-            recent_total = sum(inv.amount for inv in invoices[-3:])
-            hist_avg_amount = sum(inv.amount for inv in invoices[:-3]) / len(invoices[:-3])
-
-            avg_recent = recent_total / recent_count
-            if avg_recent > hist_avg_amount * 3:
-                target_inv = invoices[-1]
-                existing = await session.execute(
-                    select(FraudFlag)
-                    .where(FraudFlag.invoice_id == target_inv.id)
-                    .where(FraudFlag.fraud_type == FraudType.velocity_anomaly)
-                    .where(FraudFlag.engine == "velocity_spike_detector")
-                )
-                if not existing.scalar_one_or_none():
-                    flags.append(FraudFlag(
-                        invoice_id=target_inv.id,
-                        fraud_type=FraudType.velocity_anomaly,
-                        confidence=0.80,
-                        severity=AlertSeverity.high,
-                        description=(
-                            f"Invoice volume spike for {supplier.name}: "
-                            f"recent avg ${avg_recent:,.0f} is "
-                            f"{avg_recent/hist_avg_amount:.1f}x historical avg ${hist_avg_amount:,.0f}"
-                        ),
-                        engine="velocity_spike_detector",
-                    ))
+        flags.extend(velocity_flags(supplier.name, invoices))
+
+    return flags
+
 
+async def detect_velocity_anomalies_columnar(session: AsyncSession, snap: Snapshot) -> List[FraudFlag]:
+    """
+    Full velocity scan over a columnar snapshot: every supplier's invoices
+    are sorted by date once and both rules are evaluated as array masks.
+    """
+    inv = snap.invoices
+    rows = np.flatnonzero(snap.is_supplier(inv["supplier_id"]))
+    order = rows[np.lexsort((inv["id"][rows], inv["day"][rows], inv["supplier_id"][rows]))]
+    suppliers, days, amounts = inv["supplier_id"][order], inv["day"][order], inv["amount"][order]
+    starts, sizes = group_bounds(suppliers)
+    if not len(starts):
+        return []
+    group_size = np.repeat(sizes, sizes)
+
+    # 1. Same-day follow-ups (within suppliers with at least 3 invoices)
+    same_day = np.zeros(len(order), dtype=bool)
+    same_day[1:] = (suppliers[1:] == suppliers[:-1]) & (days[1:] == days[:-1])
+    same_day &= (amounts > SAME_DAY_MIN_AMOUNT) & (group_size >= 3)
+    same_day_pos = np.flatnonzero(same_day)
+
+    # 2. Last three invoices' average vs the earlier average
+    ends = starts + sizes
+    spiking = sizes >= 6
+    totals = np.add.reduceat(amounts, starts)
+    recent = np.zeros(len(starts))
+    for back in (1, 2, 3):
+        recent[spiking] += amounts[ends[spiking] - back]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hist_avg = (totals - recent) / (sizes - 3)
+    avg_recent = recent / 3
+    spike_groups = np.flatnonzero(spiking & (avg_recent > hist_avg * 3))
+
+    if not len(same_day_pos) and not len(spike_groups):
+        return []
+
+    flags: List[FraudFlag] = []
+    numbers = await invoice_numbers(session, (inv["id"][order[p - 1]] for p in same_day_pos))
+    for p in same_day_pos:
+        current, previous = order[p], order[p - 1]
+        flags.append(same_day_flag(
+            snap.entity_names.get(int(suppliers[p])),
+            InvoiceRow(int(inv["id"][current]), float(inv["amount"][current]), None),
+            InvoiceRow(int(inv["id"][previous]), float(inv["amount"][previous]),
+                       numbers.get(int(inv["id"][previous]))),
+        ))
+    for g in spike_groups:
+        flags.append(volume_spike_flag(
+            snap.entity_names.get(int(suppliers[starts[g]])), int(inv["id"][order[ends[g] - 1]]),
+            float(avg_recent[g]), float(hist_avg[g]),
+        ))
     return flags
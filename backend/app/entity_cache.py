@@ -0,0 +1,90 @@
+"""
+Process-level read-through cache of entity rows.
+
+Entities (suppliers, buyers, lenders) change rarely – essentially only when
+risk scores are recomputed – yet nearly every invoice path needs a name,
+revenue or risk score.  `get_entities` serves them from an LRU/TTL cache and
+loads all misses in one query; unknown ids are cached as None.
+
+Writers call `invalidate_entities`, which drops the ids locally and
+publishes an `entities_updated` message on the bus's invalidation channel;
+every worker's `entity_subscriber` drops them too.
+ENTITY_CACHE_TTL_SECONDS bounds staleness if a message is missed.
+"""
+
+import os
+import json
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Entity
+from app.pubsub import INVALIDATION_CHANNEL, publish, run_subscriber
+from app.ttl_cache import TTLCache
+
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "300"))
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "100000"))
+INVALIDATE_EVENT = "entities_updated"
+
+
+class CachedEntity(NamedTuple):
+    id: int
+    name: str
+    entity_type: str
+    tier: Optional[str]
+    annual_revenue: Optional[float]
+    risk_score: float
+
+
+entity_cache = TTLCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+
+
+async def get_entities(db: AsyncSession, ids: Iterable[int]) -> Dict[int, Optional[CachedEntity]]:
+    """Entities by id, None for ids that do not exist; misses cost one query."""
+    found, missing = entity_cache.get_many(i for i in ids if i is not None)
+    if missing:
+        rows = (await db.execute(
+            select(Entity.id, Entity.name, Entity.entity_type, Entity.tier,
+                   Entity.annual_revenue, Entity.risk_score)
+            .where(Entity.id.in_(missing))
+        )).all()
+        loaded = {
+            r.id: CachedEntity(r.id, r.name, r.entity_type, r.tier.value if r.tier else None,
+                               r.annual_revenue, r.risk_score or 0.0)
+            for r in rows
+        }
+        for entity_id in missing:
+            found[entity_id] = loaded.get(entity_id)
+            entity_cache.set(entity_id, found[entity_id])
+    return found
+
+
+async def get_entity(db: AsyncSession, entity_id: int) -> Optional[CachedEntity]:
+    return (await get_entities(db, [entity_id])).get(entity_id)
+
+
+def entity_name(entities: Dict[int, Optional[CachedEntity]], entity_id: Optional[int]) -> Optional[str]:
+    entity = entities.get(entity_id)
+    return entity.name if entity else None
+
+
+async def invalidate_entities(ids: Optional[Iterable[int]] = None):
+    """Drop `ids` (or every entity) from the cache in all workers."""
+    ids = sorted(set(ids)) if ids is not None else None
+    entity_cache.invalidate(ids)
+    await publish(json.dumps({"type": INVALIDATE_EVENT, "data": {"entity_ids": ids}}), INVALIDATION_CHANNEL)
+
+
+def _on_event(message: str):
+    try:
+        event = json.loads(message)
+    except ValueError:
+        return
+    if event.get("type") == INVALIDATE_EVENT:
+        entity_cache.invalidate((event.get("data") or {}).get("entity_ids"))
+
+
+async def entity_subscriber():
+    """Apply other workers' invalidations until cancelled."""
+    await run_subscriber(_on_event, INVALIDATION_CHANNEL)
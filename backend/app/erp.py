@@ -0,0 +1,286 @@
+"""
+ERP purchase-order and goods-receipt ledger.
+
+Bulk loaders stream PO and GRN extracts (NDJSON or CSV, parsed by the same
+`iter_stream_rows` as invoice ingestion) into the ledger chunk by chunk:
+each chunk is COPY'd into a session-local staging table and upserted on its
+natural key – (supplier_id, po_number) or (supplier_id, grn_number) – by one
+INSERT ... SELECT, so a re-sent extract updates rows instead of failing and
+a load of millions of lines is a few hundred statements.
+
+Invoices are checked against the ledger in two places:
+
+- inline (`POST /api/invoices/`, bulk ingestion, precheck) `po_validated`
+  and `grn_validated` now mean the PO exists for the supplier and buyer and
+  the GRN exists for that PO (`validate_documents`; ingestion applies the
+  same rule to a whole chunk in SQL).  Found documents are cached per
+  worker, so a supplier billing the same PO again does not query the ledger;
+  a load publishes `documents_updated` on the bus's invalidation channel
+  and every worker's `erp_subscriber` drops its cache;
+- in batch, the three-way match engine compares amounts, received
+  quantities and dates (see `app.engines.three_way_match`).  The event
+  pipeline also re-matches stored invoices whenever their PO or GRN is
+  loaded (see `app.listener`).
+
+A buyer counts as covered once any of its POs is loaded.  Until then there
+is nothing to validate against and the old presence check still applies.
+"""
+
+import os
+import json
+import time
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import engine
+from app.models import PurchaseOrder, GoodsReceipt
+from app.schemas import PurchaseOrderIn, GoodsReceiptIn
+from app.ingest import iter_stream_rows, _row_error
+from app.pubsub import INVALIDATION_CHANNEL, publish, run_subscriber
+from app.ttl_cache import MISSING, TTLCache
+
+ERP_CHUNK_SIZE = int(os.getenv("ERP_CHUNK_SIZE", "50000"))
+ERP_CACHE_TTL = float(os.getenv("ERP_CACHE_TTL_SECONDS", "600"))
+ERP_CACHE_SIZE = int(os.getenv("ERP_CACHE_SIZE", "200000"))
+COVERAGE_TTL = 60.0
+INVALIDATE_EVENT = "documents_updated"
+
+
+# ── Ledger specs ────────────────────────────────────────────────────
+class Ledger(NamedTuple):
+    """How one document type is staged and upserted."""
+    schema: Type[BaseModel]
+    staging: str
+    staging_ddl: str
+    columns: List[str]
+    reject_sql: str
+    upsert_sql: str
+
+
+PURCHASE_ORDERS = Ledger(
+    schema=PurchaseOrderIn,
+    staging="po_staging",
+    staging_ddl="""
+CREATE TEMP TABLE IF NOT EXISTS po_staging (
+    row_no INTEGER,
+    po_number TEXT,
+    supplier_id INTEGER,
+    buyer_id INTEGER,
+    quantity DOUBLE PRECISION,
+    unit_price DOUBLE PRECISION,
+    amount DOUBLE PRECISION,
+    currency TEXT,
+    issue_date DATE
+) ON COMMIT DELETE ROWS
+""",
+    columns=["row_no", "po_number", "supplier_id", "buyer_id", "quantity",
+             "unit_price", "amount", "currency", "issue_date"],
+    reject_sql="""
+SELECT s.row_no, sup.id IS NOT NULL AS supplier_ok, buy.id IS NOT NULL AS buyer_ok
+FROM po_staging s
+LEFT JOIN entities sup ON sup.id = s.supplier_id
+LEFT JOIN entities buy ON buy.id = s.buyer_id
+WHERE sup.id IS NULL OR buy.id IS NULL
+""",
+    # DISTINCT ON: the last line wins when an extract repeats a PO
+    upsert_sql="""
+INSERT INTO purchase_orders (po_number, supplier_id, buyer_id, quantity, unit_price,
+                             amount, currency, issue_date, created_at)
+SELECT DISTINCT ON (s.supplier_id, s.po_number)
+       s.po_number, s.supplier_id, s.buyer_id, s.quantity, s.unit_price,
+       s.amount, s.currency, s.issue_date, NOW() AT TIME ZONE 'utc'
+FROM po_staging s
+JOIN entities sup ON sup.id = s.supplier_id
+JOIN entities buy ON buy.id = s.buyer_id
+ORDER BY s.supplier_id, s.po_number, s.row_no DESC
+ON CONFLICT (supplier_id, po_number) DO UPDATE
+SET buyer_id = EXCLUDED.buyer_id, quantity = EXCLUDED.quantity,
+    unit_price = EXCLUDED.unit_price, amount = EXCLUDED.amount,
+    currency = EXCLUDED.currency, issue_date = EXCLUDED.issue_date
+""",
+)
+
+GOODS_RECEIPTS = Ledger(
+    schema=GoodsReceiptIn,
+    staging="grn_staging",
+    staging_ddl="""
+CREATE TEMP TABLE IF NOT EXISTS grn_staging (
+    row_no INTEGER,
+    grn_number TEXT,
+    supplier_id INTEGER,
+    po_number TEXT,
+    quantity DOUBLE PRECISION,
+    received_date DATE
+) ON COMMIT DELETE ROWS
+""",
+    columns=["row_no", "grn_number", "supplier_id", "po_number", "quantity", "received_date"],
+    reject_sql="""
+SELECT s.row_no, sup.id IS NOT NULL AS supplier_ok
+FROM grn_staging s
+LEFT JOIN entities sup ON sup.id = s.supplier_id
+WHERE sup.id IS NULL
+""",
+    upsert_sql="""
+INSERT INTO goods_receipts (grn_number, supplier_id, po_number, quantity, received_date, created_at)
+SELECT DISTINCT ON (s.supplier_id, s.grn_number)
+       s.grn_number, s.supplier_id, s.po_number, s.quantity, s.received_date,
+       NOW() AT TIME ZONE 'utc'
+FROM grn_staging s
+JOIN entities sup ON sup.id = s.supplier_id
+ORDER BY s.supplier_id, s.grn_number, s.row_no DESC
+ON CONFLICT (supplier_id, grn_number) DO UPDATE
+SET po_number = EXCLUDED.po_number, quantity = EXCLUDED.quantity,
+    received_date = EXCLUDED.received_date
+""",
+)
+
+
+def _record(row_no: int, doc: BaseModel) -> tuple:
+    if isinstance(doc, PurchaseOrderIn):
+        return (row_no, doc.po_number, doc.supplier_id, doc.buyer_id, doc.quantity,
+                doc.unit_price, doc.amount or doc.quantity * doc.unit_price,
+                doc.currency, doc.issue_date)
+    return (row_no, doc.grn_number, doc.supplier_id, doc.po_number, doc.quantity, doc.received_date)
+
+
+# ── Bulk loading ────────────────────────────────────────────────────
+async def _load_chunk(conn, ledger: Ledger, chunk: List[Tuple[int, BaseModel]]) -> List[dict]:
+    """Stage and upsert one chunk inside the caller's transaction; returns rejected rows."""
+    await conn.copy_records_to_table(
+        ledger.staging, columns=ledger.columns, records=[_record(row_no, doc) for row_no, doc in chunk],
+    )
+    rejected = []
+    for r in await conn.fetch(ledger.reject_sql):
+        missing = [name for name in ("supplier", "buyer") if r.get(f"{name}_ok") is False]
+        rejected.append({"row": r["row_no"], "status": "rejected",
+                         "error": f"unknown entity: {', '.join(f'{m}_id' for m in missing)}"})
+    await conn.execute(ledger.upsert_sql)
+    return rejected
+
+
+async def load_documents(stream: AsyncIterator[bytes], fmt: str, ledger: Ledger,
+                         report: str = "errors") -> dict:
+    """Load an NDJSON/CSV extract into `ledger`; only failed rows are reported."""
+    started = time.perf_counter()
+    results: List[dict] = []
+    counts = {"loaded": 0, "rejected": 0, "error": 0}
+
+    def record(rows: List[dict]):
+        for r in rows:
+            counts[r["status"]] += 1
+            if report == "errors":
+                results.append(r)
+
+    async with engine.connect() as sa_conn:
+        conn = (await sa_conn.get_raw_connection()).driver_connection
+        await conn.execute(ledger.staging_ddl)
+
+        async def flush(chunk):
+            async with conn.transaction():
+                rejected = await _load_chunk(conn, ledger, chunk)
+            counts["loaded"] += len(chunk) - len(rejected)
+            record(rejected)
+
+        chunk: List[Tuple[int, BaseModel]] = []
+        async for row_no, data, error in iter_stream_rows(stream, fmt):
+            if error is None:
+                try:
+                    chunk.append((row_no, ledger.schema.model_validate(data)))
+                except ValidationError as exc:
+                    error = _row_error(exc)
+            if error is not None:
+                record([{"row": row_no, "status": "error", "error": error}])
+            if len(chunk) >= ERP_CHUNK_SIZE:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+
+    # Cached documents may have been replaced; coverage may have grown
+    await invalidate_documents()
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    return {
+        "rows": total,
+        "loaded": counts["loaded"],
+        "rejected": counts["rejected"],
+        "errors": counts["error"],
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        "results": results,
+    }
+
+
+# ── Inline validation ───────────────────────────────────────────────
+# ("po", supplier_id, po_number) -> buyer_id and ("grn", supplier_id, grn_number)
+# -> po_number.  Found documents only, so a PO loaded after a miss is seen on
+# the next invoice.
+documents = TTLCache(ERP_CACHE_SIZE, ERP_CACHE_TTL)
+coverage = TTLCache(ERP_CACHE_SIZE, COVERAGE_TTL)   # buyer_id -> bool
+
+
+async def _document(db: AsyncSession, kind: str, supplier_id: int, number: str):
+    key = (kind, supplier_id, number)
+    found = documents.get(key)
+    if found is not MISSING:
+        return found
+    if kind == "po":
+        query = select(PurchaseOrder.buyer_id).where(
+            PurchaseOrder.supplier_id == supplier_id, PurchaseOrder.po_number == number)
+    else:
+        query = select(GoodsReceipt.po_number).where(
+            GoodsReceipt.supplier_id == supplier_id, GoodsReceipt.grn_number == number)
+    found = (await db.execute(query)).scalar_one_or_none()
+    if found is not None:
+        documents.set(key, found)
+    return found
+
+
+async def buyer_covered(db: AsyncSession, buyer_id: int) -> bool:
+    """Whether any of the buyer's purchase orders are on the ledger."""
+    covered = coverage.get(buyer_id)
+    if covered is MISSING:
+        covered = bool((await db.execute(
+            select(exists().where(PurchaseOrder.buyer_id == buyer_id))
+        )).scalar())
+        coverage.set(buyer_id, covered)
+    return covered
+
+
+async def validate_documents(db: AsyncSession, supplier_id: int, buyer_id: int,
+                             po_number: Optional[str], grn_number: Optional[str]) -> Tuple[bool, bool]:
+    """(po_validated, grn_validated) for an invoice's PO and GRN references."""
+    po_buyer = await _document(db, "po", supplier_id, po_number) if po_number else None
+    grn_po = await _document(db, "grn", supplier_id, grn_number) if grn_number else None
+    po_ok = po_buyer is not None and po_buyer == buyer_id
+    grn_ok = grn_po is not None and (not po_number or grn_po == po_number)
+    unmatched = (po_number and not po_ok) or (grn_number and not grn_ok)
+    if unmatched and po_buyer is None and not await buyer_covered(db, buyer_id):
+        return bool(po_number), bool(grn_number)
+    return po_ok, grn_ok
+
+
+async def invalidate_documents():
+    """Drop cached documents and coverage in all workers."""
+    documents.invalidate()
+    coverage.invalidate()
+    await publish(json.dumps({"type": INVALIDATE_EVENT}), INVALIDATION_CHANNEL)
+
+
+def _on_event(message: str):
+    try:
+        event = json.loads(message)
+    except ValueError:
+        return
+    if event.get("type") == INVALIDATE_EVENT:
+        documents.invalidate()
+        coverage.invalidate()
+
+
+async def erp_subscriber():
+    """Apply other workers' invalidations until cancelled."""
+    await run_subscriber(_on_event, INVALIDATION_CHANNEL)
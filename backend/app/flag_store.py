@@ -0,0 +1,130 @@
+"""
+Idempotent fraud flag persistence.
+
+A flag is identified by its natural key (invoice_id, fraud_type, engine,
+rule): re-detecting the same finding refreshes the stored confidence,
+severity and description instead of inserting another row, so rescans
+no longer grow `fraud_flags`.  Engines therefore re-emit every finding on
+each run; a re-detection that changes nothing is not written at all.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import text, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.models import FraudFlag, FraudType
+
+NATURAL_KEY = ("invoice_id", "fraud_type", "engine", "rule")
+UPSERT_BATCH = 1000  # rows per INSERT; asyncpg caps a statement at 32767 parameters
+
+# Rule names for flags stored before the column existed (and for the seed
+# data), keyed on engine and description prefix.  Validator flags matching no
+# prefix are the older catch-all phantom finding.
+BACKFILL_RULES_SQL = """
+UPDATE fraud_flags SET rule = CASE
+    WHEN engine = 'invoice_validator' AND description LIKE 'PO #%' THEN 'po_unvalidated'
+    WHEN engine = 'invoice_validator' AND description LIKE 'Fake PO reference%' THEN 'po_unvalidated'
+    WHEN engine = 'invoice_validator' AND description LIKE 'GRN #%' THEN 'grn_mismatch'
+    WHEN engine = 'invoice_validator' AND description LIKE 'No delivery confirmation%' THEN 'no_delivery'
+    WHEN engine = 'invoice_validator' AND description LIKE 'Invoice has no associated PO or GRN%' THEN 'no_po_grn'
+    WHEN engine = 'invoice_validator' AND fraud_type = 'phantom_invoice' THEN 'no_po_grn'
+    WHEN engine = 'feasibility_checker' THEN 'revenue_share'
+    WHEN engine = 'over_invoice_detector' THEN 'pair_average'
+    WHEN engine = 'duplicate_detector' THEN 'fingerprint'
+    WHEN engine = 'velocity_detector' THEN 'same_day'
+    WHEN engine = 'velocity_spike_detector' THEN 'volume_spike'
+    WHEN engine = 'cascade_detector' THEN 'tier_multiplication'
+    WHEN engine = 'dilution_monitor' THEN 'dilution_ratio'
+    WHEN engine = 'graph_analytics' THEN 'cycle'
+    ELSE rule
+END
+WHERE rule = ''
+"""
+
+# Keep the earliest row of every natural key
+COMPACT_SQL = """
+DELETE FROM fraud_flags f
+USING fraud_flags keep
+WHERE f.invoice_id = keep.invoice_id
+  AND f.fraud_type = keep.fraud_type
+  AND f.engine = keep.engine
+  AND f.rule = keep.rule
+  AND f.id > keep.id
+"""
+
+NATURAL_KEY_DDL = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_fraud_flag_natural_key "
+    "ON fraud_flags(invoice_id, fraud_type, engine, rule)"
+)
+
+
+async def compact_flags(conn) -> int:
+    """Delete duplicate flags left by earlier scans; returns how many were removed."""
+    result = await conn.execute(text(COMPACT_SQL))
+    return result.rowcount
+
+
+async def ensure_fraud_types(conn: AsyncConnection):
+    """Add FraudType values introduced after the database was created."""
+    for fraud_type in FraudType:
+        await conn.execute(text(f"ALTER TYPE fraud_type_enum ADD VALUE IF NOT EXISTS '{fraud_type.value}'"))
+
+
+async def ensure_natural_key(conn: AsyncConnection):
+    """
+    Bring an existing database up to the natural key: add and backfill the
+    `rule` column, compact duplicates, then create the unique index.
+    """
+    await conn.execute(text("ALTER TABLE fraud_flags ADD COLUMN IF NOT EXISTS rule VARCHAR(50) NOT NULL DEFAULT ''"))
+    await conn.execute(text(BACKFILL_RULES_SQL))
+    await compact_flags(conn)
+    await conn.execute(text(NATURAL_KEY_DDL))
+
+
+def _dedupe(flags: Sequence[FraudFlag]) -> List[dict]:
+    """One row per natural key (the most confident), as ON CONFLICT cannot touch a row twice."""
+    rows: Dict[Tuple, dict] = {}
+    for f in flags:
+        row = {
+            "invoice_id": f.invoice_id,
+            "fraud_type": f.fraud_type,
+            "confidence": f.confidence,
+            "severity": f.severity,
+            "description": f.description,
+            "engine": f.engine,
+            "rule": f.rule or "",
+        }
+        key = tuple(row[k] for k in NATURAL_KEY)
+        if key not in rows or row["confidence"] > rows[key]["confidence"]:
+            rows[key] = row
+    return list(rows.values())
+
+
+async def persist_flags(db: AsyncSession, flags: Sequence[FraudFlag]) -> List:
+    """
+    Upsert `flags` in batches within the caller's transaction.
+    Returns the rows written – new flags and those whose confidence,
+    severity or description changed – each with an `inserted` column
+    telling new flags apart from refreshed ones.
+    """
+    table = FraudFlag.__table__
+    rows = _dedupe(flags)
+    stored = []
+    for start in range(0, len(rows), UPSERT_BATCH):
+        stmt = pg_insert(table).values(rows[start:start + UPSERT_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[k] for k in NATURAL_KEY],
+            set_={
+                "confidence": stmt.excluded.confidence,
+                "severity": stmt.excluded.severity,
+                "description": stmt.excluded.description,
+            },
+            # Unchanged re-detections: no new row version, not returned
+            where=tuple_(table.c.confidence, table.c.severity, table.c.description).is_distinct_from(
+                tuple_(stmt.excluded.confidence, stmt.excluded.severity, stmt.excluded.description)
+            ),
+        ).returning(*table.c, literal_column("xmax = 0").label("inserted"))
+        stored.extend((await db.execute(stmt)).all())
+    return stored
@@ -0,0 +1,400 @@
+"""
+Bulk invoice ingestion for ERP feeds.
+
+Streams NDJSON or CSV bodies, validates rows with the same schema as
+`POST /api/invoices/`, and loads them chunk by chunk:
+
+1. COPY the parsed chunk into a session-local staging table
+2. one set-based query matches PO/GRN references against the ERP ledger,
+   one resolves parties, supplier revenue and running pair statistics for
+   the whole chunk, one more fetches fingerprint matches
+3. validation and duplicate rules run in memory over the chunk
+4. INSERT ... SELECT moves accepted rows into `invoices`, and the
+   resulting flags are COPY'd straight into `fraud_flags`
+
+Each chunk commits on its own so a bad row never loses the rest of the feed.
+"""
+
+import os
+import csv
+import json
+import time
+from datetime import datetime
+from collections import defaultdict, deque
+from typing import AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.database import engine
+from app.models import InvoiceStatus
+from app.schemas import InvoiceCreate
+from app.engines.invoice_validator import (
+    compute_fingerprint, document_flags, feasibility_flag, over_invoicing_flag,
+)
+from app.engines.duplicate_detector import FingerprintMatch, duplicate_flag
+from app.pair_stats import PairStats
+from app.engines.risk_fusion import fuse_flags, FLAGGED_THRESHOLD
+from app.alerting import alert_batcher
+
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+
+STAGING_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS invoice_staging (
+    row_no INTEGER,
+    invoice_number TEXT,
+    fingerprint TEXT,
+    supplier_id INTEGER,
+    buyer_id INTEGER,
+    lender_id INTEGER,
+    tier TEXT,
+    amount DOUBLE PRECISION,
+    currency TEXT,
+    invoice_date DATE,
+    due_date DATE,
+    po_number TEXT,
+    grn_number TEXT,
+    delivery_confirmed BOOLEAN,
+    po_validated BOOLEAN,
+    grn_validated BOOLEAN,
+    invoice_id INTEGER,
+    risk_score DOUBLE PRECISION,
+    status TEXT
+) ON COMMIT DELETE ROWS
+"""
+
+STAGING_COLUMNS = [
+    "row_no", "invoice_number", "fingerprint", "supplier_id", "buyer_id",
+    "lender_id", "tier", "amount", "currency", "invoice_date", "due_date",
+    "po_number", "grn_number", "delivery_confirmed",
+]
+
+# Same rule as app.erp.validate_documents: a PO must exist for the supplier
+# and buyer, a GRN for the supplier (and the invoice's PO); buyers with no PO
+# on the ledger keep the presence check
+STAGED_DOCUMENTS_SQL = """
+UPDATE invoice_staging s
+SET po_validated = CASE WHEN d.fallback THEN s.po_number IS NOT NULL ELSE d.po_ok END,
+    grn_validated = CASE WHEN d.fallback THEN s.grn_number IS NOT NULL ELSE d.grn_ok END
+FROM (
+    SELECT s.row_no,
+           COALESCE(po.buyer_id = s.buyer_id, FALSE) AS po_ok,
+           g.id IS NOT NULL AND (s.po_number IS NULL OR g.po_number = s.po_number) AS grn_ok,
+           po.id IS NULL AND NOT EXISTS (
+               SELECT 1 FROM purchase_orders c WHERE c.buyer_id = s.buyer_id
+           ) AS fallback
+    FROM invoice_staging s
+    LEFT JOIN purchase_orders po ON po.supplier_id = s.supplier_id AND po.po_number = s.po_number
+    LEFT JOIN goods_receipts g ON g.supplier_id = s.supplier_id AND g.grn_number = s.grn_number
+) d
+WHERE s.row_no = d.row_no
+"""
+
+LOOKUP_SQL = """
+SELECT s.row_no, s.po_validated, s.grn_validated,
+       sup.id IS NOT NULL AS supplier_ok,
+       buy.id IS NOT NULL AS buyer_ok,
+       s.lender_id IS NULL OR len.id IS NOT NULL AS lender_ok,
+       sup.annual_revenue,
+       ps.count AS pair_count, ps.mean AS pair_mean, ps.m2 AS pair_m2, ps.sketch AS pair_sketch
+FROM invoice_staging s
+LEFT JOIN entities sup ON sup.id = s.supplier_id
+LEFT JOIN entities buy ON buy.id = s.buyer_id
+LEFT JOIN entities len ON len.id = s.lender_id
+LEFT JOIN pair_amount_stats ps ON ps.supplier_id = s.supplier_id AND ps.buyer_id = s.buyer_id
+"""
+
+FINGERPRINT_SQL = """
+SELECT i.fingerprint, i.id, i.amount, i.lender_id
+FROM invoices i
+JOIN (SELECT DISTINCT fingerprint FROM invoice_staging) s ON s.fingerprint = i.fingerprint
+ORDER BY i.id
+"""
+
+DECISION_SQL = """
+UPDATE invoice_staging s
+SET invoice_id = v.invoice_id, risk_score = v.risk_score, status = v.status
+FROM unnest($1::int[], $2::int[], $3::float8[], $4::text[])
+     AS v(row_no, invoice_id, risk_score, status)
+WHERE s.row_no = v.row_no
+"""
+
+INSERT_SQL = """
+INSERT INTO invoices (
+    id, invoice_number, fingerprint, supplier_id, buyer_id, lender_id, tier,
+    amount, currency, invoice_date, due_date, status, po_number, grn_number,
+    delivery_confirmed, po_validated, grn_validated, risk_score, created_at
+)
+SELECT invoice_id, invoice_number, fingerprint, supplier_id, buyer_id, lender_id,
+       tier::tier_enum, amount, currency, invoice_date, due_date,
+       status::invoice_status_enum, po_number, grn_number, delivery_confirmed,
+       po_validated, grn_validated, risk_score,
+       NOW() AT TIME ZONE 'utc'
+FROM invoice_staging
+WHERE invoice_id IS NOT NULL
+ORDER BY row_no
+"""
+
+FLAG_COLUMNS = [
+    "invoice_id", "fraud_type", "confidence", "severity",
+    "description", "engine", "rule", "detected_at", "resolved",
+]
+
+
+class StagedInvoice(NamedTuple):
+    """Just enough of an invoice for the validator and duplicate rules."""
+    id: int
+    amount: float
+    lender_id: Optional[int]
+    po_number: Optional[str]
+    grn_number: Optional[str]
+    delivery_confirmed: bool
+    po_validated: bool
+    grn_validated: bool
+
+
+# ── Stream parsing ──────────────────────────────────────────────────
+def _row_error(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in exc.errors()
+    )
+
+
+class _LineFeed:
+    """Iterator that `csv.reader` pulls physical lines from as they are fed in."""
+
+    def __init__(self):
+        self.lines: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def iter_stream_rows(stream: AsyncIterator[bytes], fmt: str
+                           ) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Split an NDJSON or CSV byte stream into `(row_no, data, error)` tuples.
+    Row numbers count data rows from 1; blank lines and the CSV header are skipped.
+    Empty CSV cells become None.  CSV lines are fed to one `csv.reader`,
+    which is only asked for a record once its quotes balance, so quoted
+    fields may span lines.
+    """
+    buffer = b""
+    header: Optional[List[str]] = None
+    row_no = 0
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    open_quotes = False     # the fed lines end inside a quoted CSV field
+
+    async def lines():
+        nonlocal buffer
+        async for chunk in stream:
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line
+        if buffer:
+            yield buffer
+
+    async for raw in lines():
+        line = raw.decode("utf-8", errors="replace").strip("\r\n")
+        if not open_quotes and not line.strip():
+            continue
+
+        if fmt == "csv":
+            feed.lines.append(line + "\n")
+            open_quotes ^= line.count('"') % 2 == 1
+            if open_quotes:
+                continue
+            values = next(reader)
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            row_no += 1
+            if len(values) != len(header):
+                yield row_no, None, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            yield row_no, {k: (v if v != "" else None) for k, v in zip(header, values)}, None
+        else:
+            row_no += 1
+            try:
+                data = json.loads(line)
+            except ValueError as exc:
+                yield row_no, None, f"invalid JSON: {exc}"
+                continue
+            if not isinstance(data, dict):
+                yield row_no, None, "expected a JSON object"
+                continue
+            yield row_no, data, None
+
+    if open_quotes:
+        yield row_no + 1, None, "unterminated quoted field"
+
+
+# ── Chunk loading ───────────────────────────────────────────────────
+async def _load_chunk(conn, chunk: List[Tuple[int, InvoiceCreate]]) -> Tuple[List[dict], list]:
+    """
+    Stage, validate and insert one chunk inside the caller's transaction.
+    Returns the per-row results and the flags raised.
+    """
+    fingerprints = {
+        row_no: compute_fingerprint(d.invoice_number, d.supplier_id, d.buyer_id,
+                                    d.amount, d.invoice_date)
+        for row_no, d in chunk
+    }
+    await conn.copy_records_to_table(
+        "invoice_staging",
+        columns=STAGING_COLUMNS,
+        records=[
+            (row_no, d.invoice_number, fingerprints[row_no], d.supplier_id, d.buyer_id,
+             d.lender_id, d.tier.value, d.amount, d.currency, d.invoice_date, d.due_date,
+             d.po_number, d.grn_number, d.delivery_confirmed)
+            for row_no, d in chunk
+        ],
+    )
+
+    await conn.execute(STAGED_DOCUMENTS_SQL)
+    lookups = {r["row_no"]: r for r in await conn.fetch(LOOKUP_SQL)}
+    matches: Dict[str, List[FingerprintMatch]] = defaultdict(list)
+    for r in await conn.fetch(FINGERPRINT_SQL):
+        matches[r["fingerprint"]].append(FingerprintMatch(r["id"], r["amount"], r["lender_id"]))
+
+    accepted = [
+        (row_no, d) for row_no, d in chunk
+        if lookups[row_no]["supplier_ok"] and lookups[row_no]["buyer_ok"] and lookups[row_no]["lender_ok"]
+    ]
+    ids = [r[0] for r in await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence('invoices', 'id')) FROM generate_series(1, $1)",
+        len(accepted),
+    )] if accepted else []
+    new_ids = {row_no: invoice_id for (row_no, _), invoice_id in zip(accepted, ids)}
+
+    results: List[dict] = []
+    flag_records = []
+    chunk_flags = []
+    staged = []
+    decisions = ([], [], [], [])
+    detected_at = datetime.utcnow()
+
+    for row_no, d in chunk:
+        lookup = lookups[row_no]
+        if row_no not in new_ids:
+            missing = [name for name, ok in (
+                ("supplier_id", lookup["supplier_ok"]),
+                ("buyer_id", lookup["buyer_ok"]),
+                ("lender_id", lookup["lender_ok"]),
+            ) if not ok]
+            results.append({"row": row_no, "status": "rejected",
+                            "error": f"unknown entity: {', '.join(missing)}"})
+            continue
+
+        inv = StagedInvoice(
+            id=new_ids[row_no], amount=d.amount, lender_id=d.lender_id,
+            po_number=d.po_number, grn_number=d.grn_number,
+            delivery_confirmed=d.delivery_confirmed,
+            po_validated=lookup["po_validated"], grn_validated=lookup["grn_validated"],
+        )
+        flags = document_flags(inv)
+        for flag in (
+            feasibility_flag(inv, lookup["annual_revenue"]),
+            over_invoicing_flag(inv, PairStats.from_row(
+                lookup["pair_count"], lookup["pair_mean"], lookup["pair_m2"], lookup["pair_sketch"],
+            )),
+            duplicate_flag(inv, matches[fingerprints[row_no]]),
+        ):
+            if flag:
+                flags.append(flag)
+        # Later rows in the feed are checked against earlier ones too
+        matches[fingerprints[row_no]].append(FingerprintMatch(inv.id, inv.amount, inv.lender_id))
+
+        chunk_flags.extend(flags)
+        flag_records.extend(
+            (f.invoice_id, f.fraud_type.value, f.confidence, f.severity.value,
+             f.description, f.engine, f.rule, detected_at, False)
+            for f in flags
+        )
+        result = {
+            "row": row_no, "status": "accepted", "invoice_id": inv.id,
+            "risk_score": 0.0, "flags": [f.fraud_type.value for f in flags],
+        }
+        staged.append(result)
+        results.append(result)
+
+    # Score the whole chunk in one fusion pass
+    scores = fuse_flags(chunk_flags)
+    for result in staged:
+        risk_score = scores.get(result["invoice_id"], 0.0)
+        status = InvoiceStatus.flagged if risk_score > FLAGGED_THRESHOLD else InvoiceStatus.pending
+        for column, value in zip(decisions, (result["row"], result["invoice_id"], risk_score, status.value)):
+            column.append(value)
+        result["risk_score"] = risk_score
+
+    if accepted:
+        await conn.execute(DECISION_SQL, *decisions)
+        await conn.execute(INSERT_SQL)
+    if flag_records:
+        await conn.copy_records_to_table("fraud_flags", columns=FLAG_COLUMNS, records=flag_records)
+
+    return results, chunk_flags
+
+
+async def ingest_invoices(stream: AsyncIterator[bytes], fmt: str, report: str = "all") -> dict:
+    """Ingest an NDJSON/CSV invoice stream and return per-row results."""
+    from app.precheck import pair_stats   # precheck imports StagedInvoice from here
+    started = time.perf_counter()
+    results: List[dict] = []
+    counts = {"accepted": 0, "rejected": 0, "error": 0}
+    flagged = 0
+
+    def record(rows: List[dict]):
+        nonlocal flagged
+        for r in rows:
+            counts[r["status"]] += 1
+            if r["status"] == "accepted" and r["risk_score"] > FLAGGED_THRESHOLD:
+                flagged += 1
+            if report == "all" or (report == "errors" and r["status"] != "accepted"):
+                results.append(r)
+
+    async with engine.connect() as sa_conn:
+        conn = (await sa_conn.get_raw_connection()).driver_connection
+        await conn.execute(STAGING_DDL)
+
+        async def flush(chunk):
+            async with conn.transaction():
+                rows, flags = await _load_chunk(conn, chunk)
+            accepted = {r["row"] for r in rows if r["status"] == "accepted"}
+            pair_stats.invalidate({(d.supplier_id, d.buyer_id) for row_no, d in chunk if row_no in accepted})
+            record(rows)
+            alert_batcher.submit(flags)
+
+        chunk: List[Tuple[int, InvoiceCreate]] = []
+        async for row_no, data, error in iter_stream_rows(stream, fmt):
+            if error is None:
+                try:
+                    chunk.append((row_no, InvoiceCreate.model_validate(data)))
+                except ValidationError as exc:
+                    error = _row_error(exc)
+            if error is not None:
+                record([{"row": row_no, "status": "error", "error": error}])
+            if len(chunk) >= CHUNK_SIZE:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    return {
+        "rows": total,
+        "accepted": counts["accepted"],
+        "rejected": counts["rejected"],
+        "errors": counts["error"],
+        "flagged": flagged,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        "results": results,
+    }
@@ -0,0 +1,249 @@
+"""
+Event-driven fraud detection via Postgres LISTEN/NOTIFY.
+
+Statement-level AFTER INSERT triggers on `invoices`, `cash_collections`,
+`supply_chain_edges`, `purchase_orders` and `goods_receipts` read their
+transition table and NOTIFY one id range per statement, so a bulk load
+costs one notification rather than one per row.  The ERP loaders upsert,
+so the two document tables also notify AFTER UPDATE: a re-sent PO or GRN
+re-matches the stored invoices that reference it by (supplier_id,
+po_number).
+
+A single consumer in the cluster (whoever holds the pipeline lock)
+LISTENs, coalesces notifications for EVENT_BATCH_SECONDS, resolves the
+ranges to the suppliers, cascade groups, fingerprints, trading parties and
+collections they touch, and runs the affected engines over just that scope
+through the scan sink – so velocity, cascade, dilution and carousel risks
+surface within seconds instead of waiting for the next scan.
+
+The trigger DDL is installed from Python because init.sql is split on ";"
+and cannot carry function bodies.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, text, or_, tuple_
+
+from app.cache import bump_data_version
+from app.database import engine, SessionLocal
+from app.locks import xact_lock, try_lock
+from app.models import Invoice, CashCollection, SupplyChainEdge, PurchaseOrder, GoodsReceipt
+from app.scanner import FlagSink, run_engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "intellitrace_rows"
+PIPELINE_LOCK = "intellitrace:event_pipeline"  # held by the one listening consumer
+TRIGGER_DDL_LOCK = "intellitrace:event_pipeline_ddl"
+EVENT_PIPELINE_ENABLED = os.getenv("EVENT_PIPELINE_ENABLED", "1") == "1"
+EVENT_BATCH_SECONDS = float(os.getenv("EVENT_BATCH_SECONDS", "1"))
+EVENT_BATCH_MAX = int(os.getenv("EVENT_BATCH_MAX", "1000"))
+LOCK_RETRY_SECONDS = 10.0
+HEALTH_CHECK_SECONDS = 30.0
+
+WATCHED_TABLES = (
+    "invoices", "cash_collections", "supply_chain_edges", "purchase_orders", "goods_receipts",
+)
+UPSERTED_TABLES = ("purchase_orders", "goods_receipts")   # also notify on update
+
+# Engines fed by each kind of change, in scan order.  The anomaly detector
+# scores against the whole snapshot, so it is left to the scheduler's cadence.
+INVOICE_ENGINES = [
+    "three_way_match", "duplicate_detector", "feasibility_monitor",
+    "velocity_detector", "cascade_detector", "graph_analytics",
+]
+COLLECTION_ENGINES = ["dilution_monitor"]
+EDGE_ENGINES = ["graph_analytics"]
+DOCUMENT_ENGINES = ["three_way_match"]
+
+NOTIFY_FUNCTION_DDL = f"""
+CREATE OR REPLACE FUNCTION intellitrace_notify_inserts() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', json_build_object(
+        'table', TG_TABLE_NAME, 'min', min(id), 'max', max(id), 'count', count(*)
+    )::text)
+    FROM new_rows
+    HAVING count(*) > 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+async def install_triggers(conn):
+    """(Re)create the notify function and the statement-level triggers per table."""
+    await xact_lock(conn, TRIGGER_DDL_LOCK)  # concurrent workers starting up
+    await conn.execute(text(NOTIFY_FUNCTION_DDL))
+    # A trigger with a transition table may only fire on one event
+    triggers = [(table, "insert") for table in WATCHED_TABLES]
+    triggers += [(table, "update") for table in UPSERTED_TABLES]
+    for table, event in triggers:
+        name = f"intellitrace_notify_{table}" if event == "insert" else f"intellitrace_notify_{table}_{event}"
+        await conn.execute(text(
+            f"CREATE OR REPLACE TRIGGER {name} AFTER {event.upper()} ON {table} "
+            f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT "
+            f"EXECUTE FUNCTION intellitrace_notify_inserts()"
+        ))
+
+
+def merge_ranges(events: List[dict]) -> Dict[str, List[Tuple[int, int]]]:
+    """Collapse notified id ranges per table, merging overlapping/adjacent ones."""
+    by_table = defaultdict(list)
+    for e in events:
+        by_table[e["table"]].append((int(e["min"]), int(e["max"])))
+    merged = {}
+    for table, ranges in by_table.items():
+        out: List[Tuple[int, int]] = []
+        for lo, hi in sorted(ranges):
+            if out and lo <= out[-1][1] + 1:
+                out[-1] = (out[-1][0], max(out[-1][1], hi))
+            else:
+                out.append((lo, hi))
+        merged[table] = out
+    return merged
+
+
+def _in_ranges(column, ranges: List[Tuple[int, int]]):
+    return or_(*[column.between(lo, hi) for lo, hi in ranges])
+
+
+async def resolve_scope(db, ranges: Dict[str, List[Tuple[int, int]]]) -> dict:
+    """Turn notified id ranges into the engine scope (same keys as a scan's)."""
+    scope = {
+        "invoice_ids": set(), "fingerprints": set(), "supplier_ids": set(),
+        "cascade_groups": set(), "entity_ids": set(), "collection_ids": set(),
+    }
+    if ranges.get("invoices"):
+        rows = (await db.execute(
+            select(Invoice.id, Invoice.supplier_id, Invoice.buyer_id,
+                   Invoice.fingerprint, Invoice.cascade_group)
+            .where(_in_ranges(Invoice.id, ranges["invoices"]))
+        )).all()
+        for r in rows:
+            scope["invoice_ids"].add(r.id)
+            scope["fingerprints"].add(r.fingerprint)
+            scope["supplier_ids"].add(r.supplier_id)
+            scope["entity_ids"].update((r.supplier_id, r.buyer_id))
+            if r.cascade_group:
+                scope["cascade_groups"].add(r.cascade_group)
+    if ranges.get("cash_collections"):
+        scope["collection_ids"].update((await db.execute(
+            select(CashCollection.id).where(_in_ranges(CashCollection.id, ranges["cash_collections"]))
+        )).scalars().all())
+    if ranges.get("supply_chain_edges"):
+        for source_id, target_id in (await db.execute(
+            select(SupplyChainEdge.source_id, SupplyChainEdge.target_id)
+            .where(_in_ranges(SupplyChainEdge.id, ranges["supply_chain_edges"]))
+        )).all():
+            scope["entity_ids"].update((source_id, target_id))
+    documents = set()   # (supplier_id, po_number) of loaded POs and GRNs
+    if ranges.get("purchase_orders"):
+        documents.update((await db.execute(
+            select(PurchaseOrder.supplier_id, PurchaseOrder.po_number)
+            .where(_in_ranges(PurchaseOrder.id, ranges["purchase_orders"]))
+        )).all())
+    if ranges.get("goods_receipts"):
+        documents.update((await db.execute(
+            select(GoodsReceipt.supplier_id, GoodsReceipt.po_number)
+            .where(_in_ranges(GoodsReceipt.id, ranges["goods_receipts"]))
+        )).all())
+    if documents:
+        scope["invoice_ids"].update((await db.execute(
+            select(Invoice.id).where(tuple_(Invoice.supplier_id, Invoice.po_number).in_(sorted(documents)))
+        )).scalars().all())
+    return scope
+
+
+def engines_for(ranges: Dict[str, list]) -> List[str]:
+    wanted = set()
+    if ranges.get("invoices"):
+        wanted.update(INVOICE_ENGINES)
+    if ranges.get("cash_collections"):
+        wanted.update(COLLECTION_ENGINES)
+    if ranges.get("supply_chain_edges"):
+        wanted.update(EDGE_ENGINES)
+    if ranges.get("purchase_orders") or ranges.get("goods_receipts"):
+        wanted.update(DOCUMENT_ENGINES)
+    order = INVOICE_ENGINES[:-1] + COLLECTION_ENGINES + EDGE_ENGINES
+    return [e for e in order if e in wanted]
+
+
+async def process_events(events: List[dict]) -> int:
+    """Run the engines affected by one batch of notifications; returns new flags."""
+    ranges = merge_ranges(events)
+    async with SessionLocal() as db:
+        scope = await resolve_scope(db, ranges)
+        sink = FlagSink(db)
+        for engine_name in engines_for(ranges):
+            await run_engine(db, engine_name, scope, sink)
+        await sink.flush(commit=False)
+        await sink.commit()
+    if sink.total:
+        await bump_data_version()
+    return sink.total
+
+
+async def _consume(queue: asyncio.Queue, conn):
+    """Drain notifications in windows of EVENT_BATCH_SECONDS and process each batch."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            events = [await asyncio.wait_for(queue.get(), timeout=HEALTH_CHECK_SECONDS)]
+        except asyncio.TimeoutError:
+            # A dropped LISTEN connection would otherwise go unnoticed
+            if conn.is_closed():
+                raise ConnectionError("LISTEN connection closed")
+            continue
+        deadline = loop.time() + EVENT_BATCH_SECONDS
+        while len(events) < EVENT_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                events.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        try:
+            raised = await process_events(events)
+            logger.info("event pipeline: %d notifications, %d new flags", len(events), raised)
+        except Exception:
+            logger.exception("event pipeline batch failed")
+
+
+async def event_pipeline():
+    """LISTEN for row events while holding the pipeline lock; retry otherwise."""
+    while True:
+        try:
+            async with try_lock(PIPELINE_LOCK) as held:
+                if held:
+                    await _listen()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("event pipeline stopped; retrying")
+        await asyncio.sleep(LOCK_RETRY_SECONDS)
+
+
+async def _listen():
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_notify(connection, pid, channel, payload):
+        try:
+            queue.put_nowait(json.loads(payload))
+        except ValueError:
+            logger.warning("ignoring malformed notification %r", payload)
+
+    async with engine.connect() as sa_conn:
+        sa_conn = await sa_conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn = (await sa_conn.get_raw_connection()).driver_connection
+        await conn.add_listener(CHANNEL, on_notify)
+        try:
+            await _consume(queue, conn)
+        finally:
+            if not conn.is_closed():
+                await conn.remove_listener(CHANNEL, on_notify)
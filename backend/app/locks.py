@@ -0,0 +1,47 @@
+"""
+Postgres advisory locks for cross-process coordination.
+
+Every uvicorn worker runs its own background tasks, so anything that must
+happen once cluster-wide takes a named advisory lock.  Names are hashed to
+the 64-bit key space Postgres expects.
+"""
+
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import engine
+
+SCAN_LOCK = "intellitrace:scan"  # held while a scan executes
+SCAN_SUBMIT_LOCK = "intellitrace:scan_submit"  # serialises scan submissions
+ANOMALY_REFIT_LOCK = "intellitrace:anomaly_refit"  # held while the anomaly model is refit
+
+
+def lock_key(name: str) -> int:
+    return zlib.crc32(name.encode())
+
+
+async def xact_lock(db: AsyncSession, name: str):
+    """Block until `name` is held; released when the session's transaction ends."""
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": lock_key(name)})
+
+
+@asynccontextmanager
+async def try_lock(name: str) -> AsyncIterator[bool]:
+    """
+    Try to take `name` for the duration of the block without waiting.
+    Yields whether it was acquired.  The lock lives on a dedicated
+    autocommit connection, so it is dropped automatically if the process dies.
+    """
+    key = lock_key(name)
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key})).scalar()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
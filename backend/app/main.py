@@ -4,14 +4,25 @@ Multi-Tier Supply Chain Fraud Detection & Management
 """
 
 import os
+import asyncio
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.database import engine, Base, SessionLocal
-from app.routes import invoices, fraud, analytics, alerts, dashboard
-from app.websocket import ws_router
+from app.routes import invoices, fraud, analytics, alerts, dashboard, erp
+from app.websocket import ws_router, event_subscriber
+from app.scanner import scan_worker
+from app.parallel_scan import shutdown_pool
+from app.flag_store import ensure_fraud_types, ensure_natural_key
+from app.alerting import alert_batcher
+from app.pair_stats import install_pair_stats
+from app.entity_cache import entity_subscriber
+from app.erp import erp_subscriber
+from app.listener import install_triggers, event_pipeline, EVENT_PIPELINE_ENABLED
+from app.scheduler import scheduler_loop, SCHEDULER_ENABLED
+from app.anomaly_model import anomaly_refitter, ANOMALY_REFIT_ENABLED
 
 
 async def _run_sql_file(conn, filepath: Path):
@@ -47,7 +58,37 @@ async def lifespan(app: FastAPI):
         await _run_sql_file(conn, seed_sql)
         # Also let SQLAlchemy create any tables not covered by init.sql
         await conn.run_sync(Base.metadata.create_all)
+
+    # Separate transaction: a failed init.sql statement aborts the one above
+    async with engine.begin() as conn:
+        await ensure_fraud_types(conn)
+    async with engine.begin() as conn:
+        await ensure_natural_key(conn)
+    async with engine.begin() as conn:
+        await install_triggers(conn)
+    async with engine.begin() as conn:
+        await install_pair_stats(conn)
+
+    worker = asyncio.create_task(scan_worker())
+    subscriber = asyncio.create_task(event_subscriber())
+    entity_invalidations = asyncio.create_task(entity_subscriber())
+    document_invalidations = asyncio.create_task(erp_subscriber())
+    pipeline = asyncio.create_task(event_pipeline()) if EVENT_PIPELINE_ENABLED else None
+    scheduler = asyncio.create_task(scheduler_loop()) if SCHEDULER_ENABLED else None
+    refitter = asyncio.create_task(anomaly_refitter()) if ANOMALY_REFIT_ENABLED else None
     yield
+    worker.cancel()
+    await alert_batcher.drain()
+    subscriber.cancel()
+    entity_invalidations.cancel()
+    document_invalidations.cancel()
+    if pipeline:
+        pipeline.cancel()
+    if scheduler:
+        scheduler.cancel()
+    if refitter:
+        refitter.cancel()
+    shutdown_pool()
     await engine.dispose()
 
 
@@ -65,6 +106,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # ── Routes ──────────────────────────────────────────────────────────
@@ -73,6 +115,7 @@ app.include_router(invoices.router, prefix="/api/invoices", tags=["Invoices"])
 app.include_router(fraud.router, prefix="/api/fraud", tags=["Fraud Detection"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["Graph Analytics"])
 app.include_router(alerts.router, prefix="/api/alerts", tags=["Alerts"])
+app.include_router(erp.router, prefix="/api/erp", tags=["ERP Ledger"])
 app.include_router(ws_router, tags=["WebSocket"])
 
 
@@ -2,9 +2,10 @@
 
 from datetime import datetime, date
 from sqlalchemy import (
-    Column, Integer, String, Float, DateTime, Date, Boolean, Text,
-    ForeignKey, Enum as SAEnum, Index, UniqueConstraint,
+    Column, Integer, String, Float, DateTime, Date, Boolean, Text, JSON,
+    ForeignKey, Enum as SAEnum, Index, UniqueConstraint, text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 import enum
 from app.database import Base
@@ -33,6 +34,7 @@ class FraudType(str, enum.Enum):
     dilution = "dilution"
     velocity_anomaly = "velocity_anomaly"
     cascade_fraud = "cascade_fraud"
+    ml_anomaly = "ml_anomaly"
 
 
 class AlertSeverity(str, enum.Enum):
@@ -49,6 +51,13 @@ class AlertStatus(str, enum.Enum):
     dismissed = "dismissed"
 
 
+class ScanJobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
 # ── Entities ────────────────────────────────────────────────────────
 class Entity(Base):
     """Buyer, Supplier, or Lender in the supply chain."""
@@ -75,6 +84,9 @@ class Invoice(Base):
     __table_args__ = (
         Index("ix_invoice_fingerprint", "fingerprint"),
         Index("ix_invoice_supplier_date", "supplier_id", "invoice_date"),
+        Index("ix_invoice_risk_key", text("COALESCE(risk_score, 0)"), "id"),   # keyset order
+        Index("ix_invoice_created_id", "created_at", "id"),
+        Index("ix_invoice_supplier_po", "supplier_id", "po_number"),   # ERP re-match
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -107,6 +119,11 @@ class Invoice(Base):
 class FraudFlag(Base):
     """Fraud detection flag raised by an engine."""
     __tablename__ = "fraud_flags"
+    __table_args__ = (
+        Index("ix_fraud_flag_confidence_id", "confidence", "id"),
+        # natural key – a rescan refreshes the flag instead of adding another
+        Index("uq_fraud_flag_natural_key", "invoice_id", "fraud_type", "engine", "rule", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False)
@@ -115,6 +132,7 @@ class FraudFlag(Base):
     severity = Column(SAEnum(AlertSeverity, name="alert_severity_enum", create_type=False), default=AlertSeverity.medium)
     description = Column(Text)
     engine = Column(String(100))  # which detection engine
+    rule = Column(String(50), nullable=False, default="")  # which check within the engine
     detected_at = Column(DateTime, default=datetime.utcnow)
     resolved = Column(Boolean, default=False)
 
@@ -124,6 +142,9 @@ class FraudFlag(Base):
 class Alert(Base):
     """Real-time alert for pre-disbursement early warning."""
     __tablename__ = "alerts"
+    __table_args__ = (
+        Index("ix_alert_created_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
@@ -141,6 +162,9 @@ class Alert(Base):
 class CashCollection(Base):
     """Cash collection records for dilution monitoring."""
     __tablename__ = "cash_collections"
+    __table_args__ = (
+        Index("ix_collection_created_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False)
@@ -168,3 +192,90 @@ class SupplyChainEdge(Base):
     first_transaction = Column(Date, nullable=True)
     last_transaction = Column(Date, nullable=True)
     risk_score = Column(Float, default=0.0)
+
+
+class PurchaseOrder(Base):
+    """Buyer purchase order loaded from an ERP extract."""
+    __tablename__ = "purchase_orders"
+    __table_args__ = (
+        UniqueConstraint("supplier_id", "po_number", name="uq_purchase_order_number"),
+        Index("ix_purchase_order_buyer", "buyer_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    po_number = Column(String(100), nullable=False)
+    supplier_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    buyer_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    quantity = Column(Float, nullable=False)
+    unit_price = Column(Float, nullable=False)
+    amount = Column(Float, nullable=False)
+    currency = Column(String(10), default="USD")
+    issue_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GoodsReceipt(Base):
+    """Goods received note against a purchase order, from an ERP extract."""
+    __tablename__ = "goods_receipts"
+    __table_args__ = (
+        UniqueConstraint("supplier_id", "grn_number", name="uq_goods_receipt_number"),
+        Index("ix_goods_receipt_po", "supplier_id", "po_number"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    grn_number = Column(String(100), nullable=False)
+    supplier_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    po_number = Column(String(100), nullable=False)
+    quantity = Column(Float, nullable=False)  # received
+    received_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PairAmountStats(Base):
+    """Running amount statistics per supplier-buyer pair (maintained by trigger)."""
+    __tablename__ = "pair_amount_stats"
+
+    supplier_id = Column(Integer, primary_key=True)
+    buyer_id = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0)
+    m2 = Column(Float, nullable=False, default=0)  # sum of squared deviations from the mean
+    sketch = Column(JSONB, nullable=False, default=dict)  # log-bucket index -> count
+
+
+class ScanJob(Base):
+    """Background fraud scan submitted via POST /api/fraud/scan."""
+    __tablename__ = "scan_jobs"
+    __table_args__ = (
+        Index("ix_scan_job_status_created", "status", "created_at"),
+    )
+
+    id = Column(String(36), primary_key=True)  # scan_id
+    status = Column(SAEnum(ScanJobStatus, native_enum=False, length=20), default=ScanJobStatus.queued)
+    mode = Column(String(20), default="auto")  # full / incremental / auto
+    chunked = Column(Boolean, default=False)  # commit flags per chunk
+    parallel = Column(Boolean, default=False)  # partition engines across processes
+    progress = Column(JSON)  # per-engine state while running
+    result = Column(JSON)  # FraudScanResult once completed
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class ScanCheckpoint(Base):
+    """Per-engine high-water marks for incremental scans."""
+    __tablename__ = "scan_checkpoints"
+
+    engine = Column(String(100), primary_key=True)
+    invoice_created_at = Column(DateTime, nullable=True)
+    invoice_id = Column(Integer, nullable=True)
+    collection_created_at = Column(DateTime, nullable=True)
+    collection_id = Column(Integer, nullable=True)
+    last_full_scan_at = Column(DateTime, nullable=True)
+    last_run_at = Column(DateTime, nullable=True)  # by a scan or the scheduler
+    last_duration_ms = Column(Float, nullable=True)
+    last_flags = Column(Integer, nullable=True)
+    cursor_due_date = Column(Date, nullable=True)  # scheduler's validation resume point
+    cursor_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,65 @@
+"""Keyset (cursor) pagination helpers for list endpoints."""
+
+import json
+import base64
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence
+
+from fastapi import HTTPException, Response
+from sqlalchemy import func, literal_column, tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def nulls_as(column, value):
+    """
+    Sort key for a nullable column: NULL would drop rows out of the tuple
+    comparison and break the cursor, so it sorts (and is encoded) as `value`.
+    Inlined rather than bound, so the query matches the expression index.
+    """
+    return func.coalesce(column, literal_column(repr(value)))
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Pack the sort-key values of the last row into an opaque token."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence) -> List[Any]:
+    """Unpack a cursor, coercing each value to its key column's Python type."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(keys):
+            raise ValueError("cursor arity mismatch")
+        out = []
+        for key, value in zip(keys, values):
+            python_type = key.type.python_type
+            if python_type is datetime:
+                out.append(datetime.fromisoformat(value))
+            else:
+                out.append(python_type(value))
+        return out
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query, keys: Sequence, cursor: Optional[str], limit: int):
+    """
+    Order `query` descending on `keys` and resume strictly after `cursor`.
+    Fetches one extra row so the caller can tell whether a next page exists.
+    """
+    if cursor:
+        values = decode_cursor(cursor, keys)
+        query = query.where(tuple_(*keys) < tuple_(*values))
+    return query.order_by(*[k.desc() for k in keys]).limit(limit + 1)
+
+
+def keyset_page(rows: Sequence, limit: int, key_of: Callable[[Any], Sequence[Any]],
+                response: Response) -> Sequence:
+    """Trim the look-ahead row and expose the next cursor as a response header."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key_of(rows[-1]))
+    return rows
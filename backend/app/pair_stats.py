@@ -0,0 +1,275 @@
+"""
+Running amount statistics per supplier-buyer pair.
+
+The over-invoicing rule compares an invoice with its trading pair's history.
+Rather than aggregating every past invoice on each check, `pair_amount_stats`
+keeps one row per pair with the count, mean and sum of squared deviations
+(M2, merged batch-wise with Chan's update of Welford's method) and a
+log-bucket quantile sketch: bucket k counts amounts in (γ^(k-1), γ^k], so
+any quantile is recovered within ±PAIR_SKETCH_ACCURACY relative error.
+
+Statement-level triggers on `invoices` fold each inserted batch into the
+table and take deleted invoices – and the old side of updates that change
+an amount, supplier or buyer – back out, so every writer (POST
+/api/invoices/, bulk ingest, seed data, manual corrections) keeps it current
+without extra round trips.  `rebuild_pair_stats` recomputes the table from
+the ledger; it runs at startup when the table is empty.
+"""
+
+import math
+import json
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.locks import xact_lock
+from app.models import PairAmountStats
+
+PAIR_STATS_DDL_LOCK = "intellitrace:pair_stats_ddl"
+PAIR_SKETCH_ACCURACY = 0.01
+GAMMA = (1 + PAIR_SKETCH_ACCURACY) / (1 - PAIR_SKETCH_ACCURACY)
+
+# Must stay identical to bucket() below so removals hit the same bucket
+BUCKET_SQL = f"CEIL(LN(GREATEST(amount, 0.01)) / LN({GAMMA!r}))::int"
+
+# Per-pair partial aggregates of a set of invoices (`{source}` is a table).
+# M2 is two-pass – squared deviations from the batch's own pair mean – since
+# SUM(x²) - SUM(x)²/n cancels catastrophically at invoice amounts.
+BATCH_SQL = f"""
+SELECT supplier_id, buyer_id, SUM(n)::int AS count,
+       SUM(total) / SUM(n)::float8 AS mean,
+       SUM(dev) AS m2,
+       jsonb_object_agg(bucket, n) AS sketch
+FROM (
+    SELECT supplier_id, buyer_id, {BUCKET_SQL} AS bucket,
+           COUNT(*) AS n, SUM(amount) AS total, SUM((amount - pair_mean) ^ 2) AS dev
+    FROM (
+        SELECT supplier_id, buyer_id, amount,
+               AVG(amount) OVER (PARTITION BY supplier_id, buyer_id) AS pair_mean
+        FROM {{source}}
+    ) r
+    GROUP BY 1, 2, 3
+) b
+GROUP BY supplier_id, buyer_id
+"""
+
+MERGE_SQL = """
+INSERT INTO pair_amount_stats AS p (supplier_id, buyer_id, count, mean, m2, sketch)
+{batch}
+ON CONFLICT (supplier_id, buyer_id) DO UPDATE SET
+    count = p.count + EXCLUDED.count,
+    mean = p.mean + (EXCLUDED.mean - p.mean) * EXCLUDED.count / (p.count + EXCLUDED.count),
+    m2 = p.m2 + EXCLUDED.m2
+         + (EXCLUDED.mean - p.mean) ^ 2 * p.count * EXCLUDED.count / (p.count + EXCLUDED.count),
+    sketch = (
+        SELECT jsonb_object_agg(key, total)
+        FROM (
+            SELECT key, SUM(value::bigint) AS total
+            FROM (SELECT * FROM jsonb_each_text(p.sketch)
+                  UNION ALL SELECT * FROM jsonb_each_text(EXCLUDED.sketch)) kv
+            GROUP BY key
+        ) merged
+    )
+"""
+
+# Chan's update run backwards: takes a batch (deleted invoices, or the old
+# side of updated ones) back out.  Pairs left with no invoices are dropped.
+_REMAINING_MEAN = "(p.mean * p.count - b.mean * b.count) / (p.count - b.count)"
+REMOVE_SQL = f"""
+UPDATE pair_amount_stats AS p SET
+    count = p.count - b.count,
+    mean = CASE WHEN p.count > b.count THEN {_REMAINING_MEAN} ELSE 0 END,
+    m2 = CASE WHEN p.count > b.count THEN GREATEST(
+        p.m2 - b.m2 - (b.mean - {_REMAINING_MEAN}) ^ 2 * (p.count - b.count) * b.count / p.count, 0
+    ) ELSE 0 END,
+    sketch = COALESCE((
+        SELECT jsonb_object_agg(key, total)
+        FROM (
+            SELECT key, SUM(value) AS total
+            FROM (SELECT key, value::bigint AS value FROM jsonb_each_text(p.sketch)
+                  UNION ALL SELECT key, -value::bigint FROM jsonb_each_text(b.sketch)) kv
+            GROUP BY key
+            HAVING SUM(value) > 0
+        ) remaining
+    ), '{{{{}}}}')
+FROM ({{batch}}) b
+WHERE p.supplier_id = b.supplier_id AND p.buyer_id = b.buyer_id;
+DELETE FROM pair_amount_stats p
+USING (SELECT DISTINCT supplier_id, buyer_id FROM {{source}}) b
+WHERE p.supplier_id = b.supplier_id AND p.buyer_id = b.buyer_id AND p.count <= 0
+"""
+
+# Updates only matter when they move an invoice's amount or pair
+_CHANGED = """(
+    SELECT {side}.* FROM old_rows o JOIN new_rows n ON n.id = o.id
+    WHERE (o.amount, o.supplier_id, o.buyer_id) IS DISTINCT FROM (n.amount, n.supplier_id, n.buyer_id)
+) {side}"""
+
+
+def _remove(source: str) -> str:
+    return REMOVE_SQL.format(batch=BATCH_SQL.format(source=source), source=source)
+
+
+def _merge(source: str) -> str:
+    return MERGE_SQL.format(batch=BATCH_SQL.format(source=source))
+
+
+TRIGGER_FUNCTION_DDL = f"""
+CREATE OR REPLACE FUNCTION intellitrace_pair_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_merge("new_rows")};
+    ELSIF TG_OP = 'DELETE' THEN
+        {_remove("old_rows")};
+    ELSE
+        {_remove(_CHANGED.format(side="o"))};
+        {_merge(_CHANGED.format(side="n"))};
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# A trigger with a transition table may only fire on one event
+TRIGGERS = {
+    "intellitrace_pair_stats": "AFTER INSERT ON invoices REFERENCING NEW TABLE AS new_rows",
+    "intellitrace_pair_stats_update":
+        "AFTER UPDATE ON invoices REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "intellitrace_pair_stats_delete": "AFTER DELETE ON invoices REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def bucket(amount: float) -> int:
+    return math.ceil(math.log(max(amount, 0.01)) / math.log(GAMMA))
+
+
+class PairStats(NamedTuple):
+    """One pair's running statistics; `sketch` maps bucket index to count."""
+    count: int
+    mean: float
+    m2: float
+    sketch: Dict[int, int]
+
+    @classmethod
+    def of(cls, amounts: Iterable[float]) -> "PairStats":
+        """Statistics of a batch of amounts (what BATCH_SQL computes per pair)."""
+        amounts = list(amounts)
+        if not amounts:
+            return EMPTY
+        mean = sum(amounts) / len(amounts)
+        sketch: Dict[int, int] = {}
+        for amount in amounts:
+            sketch[bucket(amount)] = sketch.get(bucket(amount), 0) + 1
+        return cls(len(amounts), mean, sum((a - mean) ** 2 for a in amounts), sketch)
+
+    @classmethod
+    def from_row(cls, count, mean, m2, sketch) -> "PairStats":
+        if isinstance(sketch, str):
+            sketch = json.loads(sketch)
+        return cls(count or 0, mean or 0.0, max(m2 or 0.0, 0.0),
+                   {int(k): int(v) for k, v in (sketch or {}).items()})
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Amount at quantile `q` (0-1), from the sketch."""
+        total = sum(self.sketch.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for k in sorted(self.sketch):
+            seen += self.sketch[k]
+            if seen > rank:
+                # Midpoint of (γ^(k-1), γ^k] in relative terms
+                return 2 * GAMMA ** k / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.sketch) / (GAMMA + 1)
+
+    def merge(self, other: "PairStats") -> "PairStats":
+        """Both batches' statistics combined, by the same Chan update as MERGE_SQL."""
+        if not other.count:
+            return self
+        if not self.count:
+            return other
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        sketch = dict(self.sketch)
+        for k, n in other.sketch.items():
+            sketch[k] = sketch.get(k, 0) + n
+        return PairStats(
+            count,
+            self.mean + delta * other.count / count,
+            self.m2 + other.m2 + delta ** 2 * self.count * other.count / count,
+            sketch,
+        )
+
+    def remove(self, other: "PairStats") -> "PairStats":
+        """These statistics with a batch taken back out, as REMOVE_SQL does."""
+        count = self.count - other.count
+        if count <= 0:
+            return EMPTY
+        mean = (self.mean * self.count - other.mean * other.count) / count
+        m2 = self.m2 - other.m2 - (other.mean - mean) ** 2 * count * other.count / self.count
+        sketch = dict(self.sketch)
+        for k, n in other.sketch.items():
+            sketch[k] = sketch.get(k, 0) - n
+        return PairStats(count, mean, max(m2, 0.0), {k: n for k, n in sketch.items() if n > 0})
+
+    def without(self, amount: float) -> "PairStats":
+        """These statistics with one invoice of `amount` taken back out."""
+        if self.count <= 1:
+            return PairStats(0, 0.0, 0.0, {})
+        count = self.count - 1
+        mean = (self.mean * self.count - amount) / count
+        m2 = max(self.m2 - (amount - self.mean) * (amount - mean), 0.0)
+        sketch = dict(self.sketch)
+        k = bucket(amount)
+        if sketch.get(k, 0) > 1:
+            sketch[k] -= 1
+        else:
+            sketch.pop(k, None)
+        return PairStats(count, mean, m2, sketch)
+
+
+EMPTY = PairStats(0, 0.0, 0.0, {})
+
+
+async def install_pair_stats(conn):
+    """(Re)create the maintenance triggers, backfilling the table if it is empty."""
+    await xact_lock(conn, PAIR_STATS_DDL_LOCK)  # concurrent workers starting up
+    await conn.execute(text(TRIGGER_FUNCTION_DDL))
+    # OR REPLACE (PG 14+): no DROP, whose ACCESS EXCLUSIVE lock would block
+    # every invoice read and write on each worker start
+    for name, timing in TRIGGERS.items():
+        await conn.execute(text(
+            f"CREATE OR REPLACE TRIGGER {name} {timing} FOR EACH STATEMENT "
+            f"EXECUTE FUNCTION intellitrace_pair_stats()"
+        ))
+    empty = (await conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM pair_amount_stats)"))).scalar()
+    if empty:
+        await rebuild_pair_stats(conn)
+
+
+async def rebuild_pair_stats(conn):
+    """Recompute every pair's statistics from the invoices, in the caller's transaction."""
+    await conn.execute(text("DELETE FROM pair_amount_stats"))
+    await conn.execute(text(_merge("invoices")))
+
+
+async def load_pair_stats(db: AsyncSession, pairs: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], PairStats]:
+    """Statistics for each (supplier_id, buyer_id); pairs with no history are left out."""
+    pairs = list(set(pairs))
+    if not pairs:
+        return {}
+    rows = (await db.execute(
+        select(PairAmountStats)
+        .where(tuple_(PairAmountStats.supplier_id, PairAmountStats.buyer_id).in_(pairs))
+    )).scalars().all()
+    return {
+        (r.supplier_id, r.buyer_id): PairStats.from_row(r.count, r.mean, r.m2, r.sketch)
+        for r in rows
+    }
@@ -0,0 +1,258 @@
+"""
+Partitioned, multi-process engine execution.
+
+The engines are CPU-bound Python loops, so one event loop only ever uses
+one core.  For a parallel scan the parent splits each engine's work into
+SCAN_PARTITIONS disjoint shards – pending invoices, three-way matches and
+velocity by `supplier_id`, duplicates by fingerprint, cascades by group,
+dilution by collection and carousel detection by connected component of
+the supply chain graph – and hands them to a spawn-context process pool.  Every
+worker runs the ordinary engine over its shard on its own connection and
+returns plain flag dicts; the parent rebuilds them and performs the single
+merged write through the scan's FlagSink.
+"""
+
+import os
+import zlib
+import asyncio
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import networkx as nx
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import (
+    Entity, Invoice, InvoiceStatus, CashCollection, SupplyChainEdge,
+    FraudFlag, FraudType, AlertSeverity,
+)
+from app.engines.invoice_validator import validate_invoice
+from app.engines.three_way_match import detect_three_way_mismatches
+from app.engines.duplicate_detector import detect_duplicates
+from app.engines.feasibility_monitor import detect_infeasible_volume
+from app.engines.velocity_detector import detect_velocity_anomalies
+from app.engines.cascade_detector import detect_cascade_fraud
+from app.engines.dilution_monitor import detect_dilution, DILUTION_THRESHOLD
+from app.engines.anomaly_detector import detect_anomalies
+from app.engines.graph_analytics import detect_carousel_fraud
+
+SCAN_PARTITIONS = int(os.getenv("SCAN_PARTITIONS", str(os.cpu_count() or 1)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _shard(key) -> int:
+    """Stable partition index – `hash()` is salted per process."""
+    if isinstance(key, int):
+        return key % SCAN_PARTITIONS
+    return zlib.crc32(str(key).encode()) % SCAN_PARTITIONS
+
+
+def _split(items, key=lambda item: item) -> List[list]:
+    shards = defaultdict(list)
+    for item in items:
+        shards[_shard(key(item))].append(item)
+    return [shard for shard in shards.values() if shard]
+
+
+# ── Partitioning (parent) ───────────────────────────────────────────
+async def _carousel_partitions(db: AsyncSession, entity_ids) -> List[dict]:
+    """
+    Bin connected components of the trade graph across partitions,
+    largest first onto the lightest bin, so no cycle spans two workers.
+    """
+    edges = (await db.execute(select(SupplyChainEdge.source_id, SupplyChainEdge.target_id))).all()
+    G = nx.Graph()
+    G.add_edges_from(edges)
+
+    targets = set(entity_ids) if entity_ids is not None else None
+    bins = [(0, []) for _ in range(SCAN_PARTITIONS)]
+    for component in sorted(nx.connected_components(G), key=len, reverse=True):
+        members = component if targets is None else component & targets
+        if len(component) < 3 or not members:
+            continue
+        i = min(range(SCAN_PARTITIONS), key=lambda b: bins[b][0])
+        bins[i] = (bins[i][0] + len(component), bins[i][1] + list(members))
+    return [{"entity_ids": ids} for _, ids in bins if ids]
+
+
+async def partitions(db: AsyncSession, engine: str, scope: Optional[dict]) -> List[dict]:
+    """Split one engine's work into disjoint keyword sets for its worker."""
+    if engine == "invoice_validator":
+        query = select(Invoice.id, Invoice.supplier_id).where(Invoice.status == InvoiceStatus.pending)
+        if scope is not None:
+            query = query.where(Invoice.id.in_(scope["invoice_ids"]))
+        rows = (await db.execute(query)).all()
+        return [{"invoice_ids": [r.id for r in shard]}
+                for shard in _split(rows, key=lambda r: r.supplier_id)]
+
+    if engine == "three_way_match":
+        # By supplier, so every invoice billing one PO lands in the same shard
+        query = select(Invoice.id, Invoice.supplier_id).where(
+            Invoice.po_number.isnot(None) | Invoice.grn_number.isnot(None)
+        )
+        if scope is not None:
+            query = query.where(Invoice.id.in_(scope["invoice_ids"]))
+        rows = (await db.execute(query)).all()
+        return [{"invoice_ids": [r.id for r in shard]}
+                for shard in _split(rows, key=lambda r: r.supplier_id)]
+
+    if engine == "duplicate_detector":
+        if scope is not None:
+            fingerprints = scope["fingerprints"]
+        else:
+            fingerprints = (await db.execute(
+                select(Invoice.fingerprint)
+                .group_by(Invoice.fingerprint)
+                .having(func.count(Invoice.id) > 1)
+            )).scalars().all()
+        return [{"fingerprints": shard} for shard in _split(fingerprints)]
+
+    if engine in ("feasibility_monitor", "velocity_detector"):
+        if scope is not None:
+            supplier_ids = scope["supplier_ids"]
+        else:
+            supplier_ids = (await db.execute(
+                select(Entity.id).where(Entity.entity_type == "supplier")
+            )).scalars().all()
+        return [{"supplier_ids": shard} for shard in _split(supplier_ids)]
+
+    if engine == "cascade_detector":
+        if scope is not None:
+            groups = scope["cascade_groups"]
+        else:
+            groups = (await db.execute(
+                select(Invoice.cascade_group).where(Invoice.cascade_group.isnot(None)).distinct()
+            )).scalars().all()
+        return [{"cascade_groups": shard} for shard in _split(groups)]
+
+    if engine == "dilution_monitor":
+        if scope is not None:
+            collection_ids = scope["collection_ids"]
+        else:
+            collection_ids = (await db.execute(
+                select(CashCollection.id).where(CashCollection.dilution_ratio > DILUTION_THRESHOLD)
+            )).scalars().all()
+        return [{"collection_ids": shard} for shard in _split(collection_ids)]
+
+    if engine == "anomaly_detector":
+        # One shard: features are computed over the whole snapshot anyway
+        return [{"invoice_ids": list(scope["invoice_ids"])}] if scope is not None else [{}]
+
+    if engine == "graph_analytics":
+        return await _carousel_partitions(db, scope["entity_ids"] if scope is not None else None)
+
+    raise ValueError(f"Unknown engine {engine!r}")
+
+
+# ── Workers (child processes) ───────────────────────────────────────
+_worker_sessions = None
+
+
+def _init_worker():
+    """Give each worker process its own connection factory."""
+    global _worker_sessions
+    from sqlalchemy.pool import NullPool
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.database import DATABASE_URL
+
+    # NullPool: every task runs on a fresh event loop, so connections cannot be reused
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    _worker_sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def _flag_dict(flag: FraudFlag) -> dict:
+    return {
+        "invoice_id": flag.invoice_id,
+        "fraud_type": flag.fraud_type.value,
+        "confidence": flag.confidence,
+        "severity": flag.severity.value if flag.severity else None,
+        "description": flag.description,
+        "engine": flag.engine,
+        "rule": flag.rule,
+    }
+
+
+async def _detect(engine: str, part: dict) -> Tuple[List[FraudFlag], int]:
+    async with _worker_sessions() as db:
+        if engine == "invoice_validator":
+            result = await db.execute(select(Invoice).where(Invoice.id.in_(part["invoice_ids"])))
+            invoices = result.scalars().all()
+            flags = []
+            for inv in invoices:
+                flags.extend(await validate_invoice(db, inv))
+            return flags, len(invoices)
+        if engine == "three_way_match":
+            return await detect_three_way_mismatches(db, **part), 0
+        if engine == "duplicate_detector":
+            return await detect_duplicates(db, **part), 0
+        if engine == "feasibility_monitor":
+            return await detect_infeasible_volume(db, **part), 0
+        if engine == "velocity_detector":
+            return await detect_velocity_anomalies(db, **part), 0
+        if engine == "cascade_detector":
+            return await detect_cascade_fraud(db, **part), 0
+        if engine == "dilution_monitor":
+            return await detect_dilution(db, **part), 0
+        if engine == "anomaly_detector":
+            return await detect_anomalies(db, **part), 0
+        if engine == "graph_analytics":
+            return await detect_carousel_fraud(db, **part), 0
+    raise ValueError(f"Unknown engine {engine!r}")
+
+
+def run_partition(engine: str, part: dict) -> Tuple[List[dict], int]:
+    """Process-pool entry point: run `engine` over one shard."""
+    flags, validated = asyncio.run(_detect(engine, part))
+    return [_flag_dict(f) for f in flags], validated
+
+
+# ── Executor ────────────────────────────────────────────────────────
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=SCAN_PARTITIONS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_partitioned(db: AsyncSession, engine: str,
+                          scope: Optional[dict]) -> Tuple[List[FraudFlag], int]:
+    """Fan one engine out over the pool and merge the shards' flags."""
+    parts = await partitions(db, engine, scope)
+    if not parts:
+        return [], 0
+
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(pool, run_partition, engine, part) for part in parts
+    ])
+
+    flags: List[FraudFlag] = []
+    validated = 0
+    for shard_flags, shard_validated in results:
+        validated += shard_validated
+        for f in shard_flags:
+            flags.append(FraudFlag(
+                invoice_id=f["invoice_id"],
+                fraud_type=FraudType(f["fraud_type"]),
+                confidence=f["confidence"],
+                severity=AlertSeverity(f["severity"]) if f["severity"] else None,
+                description=f["description"],
+                engine=f["engine"],
+                rule=f["rule"],
+            ))
+    return flags, validated
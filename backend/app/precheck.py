@@ -0,0 +1,132 @@
+"""
+Read-only pre-disbursement check.
+
+Evaluates a candidate invoice with the same rules `POST /api/invoices/`
+applies – document checks, revenue feasibility, pair over-invoicing and
+fingerprint duplicates – without writing anything, so a lender can ask
+before money moves.  To stay within a few milliseconds under load, the
+inputs are served from memory:
+
+- party details (revenue, risk score) come from the shared entity cache,
+  the running supplier/buyer pair statistics from a TTL cache and PO/GRN
+  matches from the ERP document cache;
+- fingerprint matches come from one indexed lookup per candidate
+  (ix_invoice_fingerprint), cached for PRECHECK_FINGERPRINT_TTL_SECONDS.
+
+A warm precheck therefore touches the database at most once, for the
+fingerprint lookup, plus a ledger lookup for a PO or GRN it has not seen.
+"""
+
+import os
+import time
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Invoice, InvoiceStatus
+from app.schemas import InvoiceCreate
+from app.ttl_cache import MISSING, TTLCache
+from app.entity_cache import get_entities
+from app.erp import validate_documents
+from app.pair_stats import EMPTY, PairStats, load_pair_stats
+from app.ingest import StagedInvoice
+from app.engines.invoice_validator import (
+    compute_fingerprint, document_flags, feasibility_flag, over_invoicing_flag,
+)
+from app.engines.duplicate_detector import FingerprintMatch, duplicate_flag
+from app.engines.risk_fusion import fuse_flags, FLAGGED_THRESHOLD
+
+PRECHECK_CACHE_TTL = float(os.getenv("PRECHECK_CACHE_TTL_SECONDS", "30"))
+PRECHECK_CACHE_SIZE = int(os.getenv("PRECHECK_CACHE_SIZE", "50000"))
+PRECHECK_FINGERPRINT_TTL = float(os.getenv("PRECHECK_FINGERPRINT_TTL_SECONDS", "2"))
+
+
+class PrecheckError(ValueError):
+    """The candidate references parties that do not exist."""
+
+
+# ── Cached lookups ──────────────────────────────────────────────────
+pair_stats = TTLCache(PRECHECK_CACHE_SIZE, PRECHECK_CACHE_TTL)   # (supplier, buyer) -> PairStats
+
+
+async def _pair_stats(db: AsyncSession, supplier_id: int, buyer_id: int) -> PairStats:
+    key = (supplier_id, buyer_id)
+    stats = pair_stats.get(key)
+    if stats is MISSING:
+        stats = (await load_pair_stats(db, [key])).get(key, EMPTY)
+        pair_stats.set(key, stats)
+    return stats
+
+
+fingerprint_matches = TTLCache(PRECHECK_CACHE_SIZE, PRECHECK_FINGERPRINT_TTL)  # fingerprint -> matches
+
+
+async def _fingerprint_matches(db: AsyncSession, fingerprint: str) -> List[FingerprintMatch]:
+    matches = fingerprint_matches.get(fingerprint)
+    if matches is MISSING:
+        rows = (await db.execute(
+            select(Invoice.id, Invoice.amount, Invoice.lender_id)
+            .where(Invoice.fingerprint == fingerprint)
+            .order_by(Invoice.id)
+        )).all()
+        matches = [FingerprintMatch(r.id, r.amount, r.lender_id) for r in rows]
+        fingerprint_matches.set(fingerprint, matches)
+    return matches
+
+
+# ── Check ───────────────────────────────────────────────────────────
+async def precheck_invoice(db: AsyncSession, data: InvoiceCreate) -> dict:
+    """Score a candidate invoice as `create_invoice` would, without persisting it."""
+    started = time.perf_counter()
+
+    ids = [data.supplier_id, data.buyer_id] + ([data.lender_id] if data.lender_id else [])
+    found = await get_entities(db, ids)
+    missing = [name for name, entity_id in (
+        ("supplier_id", data.supplier_id), ("buyer_id", data.buyer_id), ("lender_id", data.lender_id),
+    ) if entity_id and found.get(entity_id) is None]
+    if missing:
+        raise PrecheckError(f"unknown entity: {', '.join(missing)}")
+    supplier, buyer = found[data.supplier_id], found[data.buyer_id]
+
+    fingerprint = compute_fingerprint(
+        data.invoice_number, data.supplier_id, data.buyer_id,
+        data.amount, data.invoice_date,
+    )
+    matches = await _fingerprint_matches(db, fingerprint)
+    stats = await _pair_stats(db, data.supplier_id, data.buyer_id)
+    po_validated, grn_validated = await validate_documents(
+        db, data.supplier_id, data.buyer_id, data.po_number, data.grn_number,
+    )
+
+    inv = StagedInvoice(
+        id=0, amount=data.amount, lender_id=data.lender_id,
+        po_number=data.po_number, grn_number=data.grn_number,
+        delivery_confirmed=data.delivery_confirmed,
+        po_validated=po_validated, grn_validated=grn_validated,
+    )
+    flags = document_flags(inv)
+    for flag in (
+        feasibility_flag(inv, supplier.annual_revenue),
+        over_invoicing_flag(inv, stats),
+        duplicate_flag(inv, matches),
+    ):
+        if flag:
+            flags.append(flag)
+
+    risk_score = fuse_flags(flags).get(inv.id, 0.0)
+    status = InvoiceStatus.flagged if risk_score > FLAGGED_THRESHOLD else InvoiceStatus.pending
+    return {
+        "fingerprint": fingerprint,
+        "risk_score": risk_score,
+        "status": status.value,
+        "flags": [
+            {"fraud_type": f.fraud_type.value, "confidence": f.confidence,
+             "severity": f.severity.value, "description": f.description,
+             "engine": f.engine, "rule": f.rule}
+            for f in flags
+        ],
+        "supplier_risk_score": supplier.risk_score,
+        "buyer_risk_score": buyer.risk_score,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
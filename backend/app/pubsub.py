@@ -0,0 +1,113 @@
+"""
+Cross-worker event bus.
+
+Every uvicorn worker holds only its own WebSocket clients, so events are
+published to a Redis channel (or an in-process stand-in when REDIS_URL is
+not set) and each worker runs one subscriber task that fans incoming
+messages out to its local sockets.  Events are numbered from a shared
+counter so clients can resume a stream after reconnecting.
+
+Worker-to-worker messages (cache invalidations) go on a channel of their
+own, INVALIDATION_CHANNEL, so they never reach clients or use up event
+numbers.
+"""
+
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+CHANNEL = "intellitrace:events"
+INVALIDATION_CHANNEL = "intellitrace:invalidations"
+SEQUENCE_KEY = "intellitrace:event_seq"
+RECONNECT_DELAY = 1.0
+
+
+# ── Buses ───────────────────────────────────────────────────────────
+class _MemoryBus:
+    """Process-local fallback used when Redis is not configured (and in tests)."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._sequence = 0
+
+    async def next_sequence(self) -> int:
+        self._sequence += 1
+        return self._sequence
+
+    async def publish(self, message: str, channel: str = CHANNEL):
+        for queue in self._subscribers[channel]:
+            queue.put_nowait(message)
+
+    async def listen(self, channel: str = CHANNEL) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[channel].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].discard(queue)
+
+
+class _RedisBus:
+    """redis.asyncio pub/sub with the same interface."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def next_sequence(self) -> int:
+        return await self._client.incr(SEQUENCE_KEY)
+
+    async def publish(self, message: str, channel: str = CHANNEL):
+        await self._client.publish(channel, message)
+
+    async def listen(self, channel: str = CHANNEL) -> AsyncIterator[str]:
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for item in pubsub.listen():
+                if item["type"] == "message":
+                    yield item["data"]
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.close()
+
+
+bus = _RedisBus(REDIS_URL) if REDIS_URL else _MemoryBus()
+
+
+async def next_sequence() -> Optional[int]:
+    """Cluster-wide, monotonically increasing event number (None if the bus is down)."""
+    try:
+        return await bus.next_sequence()
+    except Exception:
+        logger.exception("event sequence unavailable")
+        return None
+
+
+async def publish(message: str, channel: str = CHANNEL) -> bool:
+    """Publish to every worker; returns False if the bus is unavailable."""
+    try:
+        await bus.publish(message, channel)
+        return True
+    except Exception:
+        logger.exception("event bus publish failed")
+        return False
+
+
+async def run_subscriber(handler: Callable[[str], None], channel: str = CHANNEL):
+    """Feed every message on `channel` to `handler` until cancelled, resubscribing on errors."""
+    while True:
+        try:
+            async for message in bus.listen(channel):
+                handler(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("event bus subscription lost; retrying")
+            await asyncio.sleep(RECONNECT_DELAY)
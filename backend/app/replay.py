@@ -0,0 +1,216 @@
+"""
+What-if threshold replay.
+
+Runs the threshold rules of the engines – dilution ratio, over-invoicing
+multiple of the pair average, single-invoice share of supplier revenue,
+cascade multiplier and same-day follow-up amount – over the columnar scan
+snapshot for a whole grid of threshold settings, without writing any flags.
+
+Each rule is reduced once to a per-invoice score (the dilution ratio, the
+multiple of the pair's other invoices, ...; -inf where the rule cannot
+fire), so a threshold only decides `score > threshold`.  Only invoices
+that some rule flags at its loosest threshold can change the outcome; for
+those, every setting's flagged set is an OR of per-rule hit columns, and
+counts, exposure and labelled hits are matrix products over blocks of
+settings (REPLAY_BLOCK_CELLS bounds the block's invoices × settings).
+
+Precision and recall are measured against analyst dispositions: rejected
+invoices count as fraud; validated or financed invoices and those on
+dismissed alerts count as legitimate; everything else is unlabelled.
+Over-invoicing is replayed in ratio mode whatever OVER_INVOICE_MODE is.
+
+Replays read the last published snapshot generation when it is younger
+than REPLAY_SNAPSHOT_MAX_AGE_SECONDS (scans and the scheduler keep it
+fresh), so a request does not top it up; a worker that has none yet loads
+it under the snapshot lock like a scan would.
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from typing import Dict, List, Sequence
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Alert, AlertStatus, Invoice, InvoiceStatus
+from app.snapshot import Snapshot, get_snapshot, group_bounds
+from app.engines.invoice_validator import OVER_INVOICE_RATIO, REVENUE_SHARE_THRESHOLD
+from app.engines.cascade_detector import CASCADE_MULTIPLIER
+from app.engines.dilution_monitor import DILUTION_THRESHOLD
+from app.engines.velocity_detector import SAME_DAY_MIN_AMOUNT
+
+REPLAY_MAX_SETTINGS = int(os.getenv("REPLAY_MAX_SETTINGS", "10000"))
+REPLAY_SNAPSHOT_MAX_AGE = float(os.getenv("REPLAY_SNAPSHOT_MAX_AGE_SECONDS", "900"))
+REPLAY_BLOCK_CELLS = int(os.getenv("REPLAY_BLOCK_CELLS", "20000000"))
+
+# Replayable parameter -> the value the engines run with
+CURRENT = {
+    "dilution_threshold": DILUTION_THRESHOLD,
+    "over_invoice_ratio": OVER_INVOICE_RATIO,
+    "revenue_share": REVENUE_SHARE_THRESHOLD,
+    "cascade_multiplier": CASCADE_MULTIPLIER,
+    "same_day_amount": SAME_DAY_MIN_AMOUNT,
+}
+
+FRAUD, LEGITIMATE, UNLABELLED = 1, 0, -1
+
+
+class ReplayError(ValueError):
+    """The requested grid is unknown or too large."""
+
+
+# ── Rule scores ─────────────────────────────────────────────────────
+def rule_scores(snap: Snapshot) -> Dict[str, np.ndarray]:
+    """Per-invoice score of every replayable rule, row-aligned with the snapshot."""
+    inv = snap.invoices
+    n = len(inv["id"])
+    amounts = inv["amount"]
+    scores = {name: np.full(n, -np.inf) for name in CURRENT}
+
+    # Dilution: worst collection per invoice
+    col = snap.collections
+    if len(col["id"]):
+        np.maximum.at(scores["dilution_threshold"], snap.invoice_positions(col["invoice_id"]),
+                      col["dilution_ratio"])
+
+    # Over-invoicing: multiple of the mean of the pair's other invoices (3+ needed)
+    pairs = (inv["supplier_id"].astype(np.int64) << 32) | inv["buyer_id"].astype(np.int64)
+    _, pair, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+    totals = np.bincount(pair, weights=amounts)
+    others = counts[pair] - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        others_mean = (totals[pair] - amounts) / others
+    ok = (others >= 3) & (others_mean > 0)
+    scores["over_invoice_ratio"][ok] = amounts[ok] / others_mean[ok]
+
+    # Revenue share of a single invoice
+    revenue = snap.revenue_of(inv["supplier_id"])
+    ok = revenue > 0
+    scores["revenue_share"][ok] = amounts[ok] / revenue[ok]
+
+    # Cascade: every member of a group scores the group's multiplier
+    rows = np.flatnonzero(inv["cascade"] >= 0)
+    if len(rows):
+        groups, tiers = inv["cascade"][rows], inv["tier"][rows]
+        tier_totals = np.zeros((len(snap.cascade_groups), 4))
+        np.add.at(tier_totals, (groups, tiers), amounts[rows])
+        root = np.where(tier_totals > 0, tier_totals, np.inf).min(axis=1)
+        multiplier = tier_totals.sum(axis=1) / root
+        multiplier[np.bincount(groups, minlength=len(root)) < 2] = -np.inf
+        scores["cascade_multiplier"][rows] = multiplier[groups]
+
+    # Same-day follow-ups of suppliers with 3+ invoices score their amount
+    rows = np.flatnonzero(snap.is_supplier(inv["supplier_id"]))
+    order = rows[np.lexsort((inv["id"][rows], inv["day"][rows], inv["supplier_id"][rows]))]
+    suppliers, days = inv["supplier_id"][order], inv["day"][order]
+    _, sizes = group_bounds(suppliers)
+    same_day = np.zeros(len(order), dtype=bool)
+    same_day[1:] = (suppliers[1:] == suppliers[:-1]) & (days[1:] == days[:-1])
+    same_day &= np.repeat(sizes, sizes) >= 3
+    scores["same_day_amount"][order[same_day]] = amounts[order[same_day]]
+
+    return scores
+
+
+async def load_labels(db: AsyncSession, snap: Snapshot) -> np.ndarray:
+    """FRAUD / LEGITIMATE / UNLABELLED per snapshot invoice, from analyst dispositions."""
+    labels = np.full(len(snap.invoices["id"]), UNLABELLED, dtype=np.int8)
+    rows = (await db.execute(
+        select(Invoice.id, Invoice.status).where(Invoice.status.in_([
+            InvoiceStatus.rejected, InvoiceStatus.validated, InvoiceStatus.financed,
+        ]))
+    )).all()
+    dismissed = (await db.execute(
+        select(Alert.related_invoice_ids).where(Alert.status == AlertStatus.dismissed)
+    )).scalars().all()
+
+    legitimate = [r.id for r in rows if r.status != InvoiceStatus.rejected]
+    legitimate += [int(i) for ids in dismissed if ids for i in ids.split(",") if i.strip().isdigit()]
+    fraud = [r.id for r in rows if r.status == InvoiceStatus.rejected]
+    for ids, label in ((legitimate, LEGITIMATE), (fraud, FRAUD)):   # fraud wins
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(snap.invoices["id"], ids)
+        known = pos < len(labels)
+        known[known] &= snap.invoices["id"][pos[known]] == ids[known]
+        labels[pos[known]] = label
+    return labels
+
+
+# ── Grid evaluation ─────────────────────────────────────────────────
+def _ratio(numerator: int, denominator: int):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def evaluate_grid(scores: Dict[str, np.ndarray], amounts: np.ndarray, labels: np.ndarray,
+                  grid: Dict[str, Sequence[float]]) -> List[dict]:
+    """Flag counts, exposure, precision and recall for every setting in the grid."""
+    names = list(CURRENT)
+    values = [np.unique(np.asarray(grid.get(name) or [CURRENT[name]], dtype=np.float64)) for name in names]
+    settings = np.array(list(itertools.product(*[range(len(v)) for v in values])), dtype=np.int64)
+
+    candidates = np.zeros(len(amounts), dtype=bool)
+    for name, v in zip(names, values):
+        candidates |= scores[name] > v[0]
+    rows = np.flatnonzero(candidates)
+    # Per rule and threshold: which candidate rows it flags
+    hits = [scores[name][rows][:, None] > v[None, :] for name, v in zip(names, values)]
+    amount = amounts[rows]
+    fraud = (labels[rows] == FRAUD).astype(np.float64)
+    legitimate = (labels[rows] == LEGITIMATE).astype(np.float64)
+    total_fraud = int((labels == FRAUD).sum())
+
+    results: List[dict] = []
+    block = max(1, REPLAY_BLOCK_CELLS // max(len(rows), 1))
+    for start in range(0, len(settings), block):
+        chunk = settings[start:start + block]
+        flagged = np.zeros((len(rows), len(chunk)), dtype=bool)
+        for p, rule_hits in enumerate(hits):
+            flagged |= rule_hits[:, chunk[:, p]]
+        counts = flagged.sum(axis=0)
+        exposure = amount @ flagged
+        true_pos = fraud @ flagged
+        false_pos = legitimate @ flagged
+        for k, setting in enumerate(chunk):
+            tp, fp = int(true_pos[k]), int(false_pos[k])
+            results.append({
+                "thresholds": {name: float(values[p][i]) for p, (name, i) in enumerate(zip(names, setting))},
+                "flagged_invoices": int(counts[k]),
+                "exposure": round(float(exposure[k]), 2),
+                "rule_flags": {name: int(hits[p][:, i].sum()) for p, (name, i) in enumerate(zip(names, setting))},
+                "true_positives": tp,
+                "false_positives": fp,
+                "precision": _ratio(tp, tp + fp),
+                "recall": _ratio(tp, total_fraud),
+            })
+    return results
+
+
+async def replay_thresholds(db: AsyncSession, grid: Dict[str, List[float]]) -> dict:
+    """Replay every combination of `grid` (parameter -> values) over the snapshot."""
+    started = time.perf_counter()
+    unknown = sorted(set(grid) - set(CURRENT))
+    if unknown:
+        raise ReplayError(f"unknown parameter: {', '.join(unknown)}")
+    size = 1
+    for name in CURRENT:
+        size *= len(set(grid.get(name) or [0]))
+    if size > REPLAY_MAX_SETTINGS:
+        raise ReplayError(f"grid has {size} settings; the limit is {REPLAY_MAX_SETTINGS}")
+
+    snap = await get_snapshot(db, max_age=REPLAY_SNAPSHOT_MAX_AGE)
+    labels = await load_labels(db, snap)
+    loop = asyncio.get_running_loop()
+    settings = await loop.run_in_executor(
+        None, lambda: evaluate_grid(rule_scores(snap), snap.invoices["amount"], labels, grid),
+    )
+    return {
+        "invoices": len(labels),
+        "labelled_fraud": int((labels == FRAUD).sum()),
+        "labelled_legitimate": int((labels == LEGITIMATE).sum()),
+        "current": CURRENT,
+        "settings": settings,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
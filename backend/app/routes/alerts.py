@@ -1,34 +1,43 @@
 """Alert management routes."""
 
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.cache import cached_response, bump_data_version
 from app.database import get_db
 from app.models import Alert, AlertSeverity, AlertStatus
 from app.schemas import AlertOut
+from app.pagination import keyset_query, keyset_page
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[AlertOut])
 async def list_alerts(
+    response: Response,
     severity: Optional[str] = None,
     status: Optional[str] = None,
-    limit: int = 50,
+    limit: int = Query(50, le=500),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
-    """List alerts with optional filters."""
-    query = select(Alert).order_by(Alert.created_at.desc())
+    """
+    List alerts with optional filters, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
+    """
+    query = select(Alert)
 
     if severity:
         query = query.where(Alert.severity == severity)
     if status:
         query = query.where(Alert.status == status)
 
-    result = await db.execute(query.limit(limit))
-    return [AlertOut.model_validate(a) for a in result.scalars().all()]
+    query = keyset_query(query, (Alert.created_at, Alert.id), cursor, limit)
+    result = await db.execute(query)
+    alerts = keyset_page(result.scalars().all(), limit, lambda a: (a.created_at, a.id), response)
+    return [AlertOut.model_validate(a) for a in alerts]
 
 
 @router.get("/{alert_id}", response_model=AlertOut)
@@ -53,12 +62,18 @@ async def update_alert_status(
 
     alert.status = new_status
     await db.commit()
+    await bump_data_version()
     return {"id": alert_id, "status": new_status}
 
 
 @router.get("/stats/summary")
-async def alert_summary(db: AsyncSession = Depends(get_db)):
-    """Alert summary statistics."""
+async def alert_summary(request: Request):
+    """Alert summary statistics (cached)."""
+    return await cached_response(request, "alerts:summary", _compute_alert_summary)
+
+
+async def _compute_alert_summary(db: AsyncSession) -> dict:
+    """Build the alert summary from the database."""
     total = await db.execute(select(func.count(Alert.id)))
     open_count = await db.execute(
         select(func.count(Alert.id)).where(Alert.status == 'open')
@@ -1,22 +1,31 @@
 """Graph analytics routes."""
 
 from typing import List
-from fastapi import APIRouter, Depends
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.cache import cached_response, bump_data_version
 from app.database import get_db
+from app.entity_cache import invalidate_entities
 from app.models import Entity
 from app.schemas import NetworkGraph, EntityOut
 from app.engines.graph_analytics import get_network_data, compute_risk_scores
 
 router = APIRouter()
 
+UPDATE_RISK_SQL = text("""
+UPDATE entities
+SET risk_score = v.score
+FROM unnest(CAST(:ids AS INTEGER[]), CAST(:scores AS DOUBLE PRECISION[])) AS v(id, score)
+WHERE entities.id = v.id
+""")
+
 
 @router.get("/network", response_model=NetworkGraph)
-async def get_network(db: AsyncSession = Depends(get_db)):
-    """Get the full supply chain network for visualization."""
-    return await get_network_data(db)
+async def get_network(request: Request):
+    """Get the full supply chain network for visualization (cached)."""
+    return await cached_response(request, "analytics:network", get_network_data)
 
 
 @router.get("/entities", response_model=List[EntityOut])
@@ -33,11 +42,10 @@ async def update_risk_scores(db: AsyncSession = Depends(get_db)):
     """Recompute entity risk scores using graph analytics."""
     scores = await compute_risk_scores(db)
 
-    for entity_id, score in scores.items():
-        entity = await db.get(Entity, entity_id)
-        if entity:
-            entity.risk_score = score
-
+    if scores:
+        await db.execute(UPDATE_RISK_SQL, {"ids": list(scores), "scores": list(scores.values())})
     await db.commit()
+    await invalidate_entities(scores)
+    await bump_data_version()
 
     return {"updated": len(scores), "scores": scores}
@@ -1,10 +1,10 @@
 """Dashboard API – aggregated stats and metrics."""
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Request
 from sqlalchemy import select, func, case, and_, literal_column
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.cache import cached_response
 from app.models import Invoice, FraudFlag, Alert, Entity, InvoiceStatus, FraudType, AlertSeverity
 from app.schemas import DashboardStats, AlertOut
 
@@ -12,8 +12,13 @@ router = APIRouter()
 
 
 @router.get("/stats", response_model=DashboardStats)
-async def get_dashboard_stats(db: AsyncSession = Depends(get_db)):
-    """Get comprehensive dashboard statistics."""
+async def get_dashboard_stats(request: Request):
+    """Get comprehensive dashboard statistics (cached)."""
+    return await cached_response(request, "dashboard:stats", _compute_dashboard_stats)
+
+
+async def _compute_dashboard_stats(db: AsyncSession) -> DashboardStats:
+    """Build the dashboard payload from the database."""
 
     # Total invoices and amount
     inv_result = await db.execute(
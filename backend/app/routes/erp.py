@@ -0,0 +1,41 @@
+"""ERP ledger loading routes."""
+
+from typing import Optional
+from fastapi import APIRouter, Query, Request
+
+from app.erp import PURCHASE_ORDERS, GOODS_RECEIPTS, Ledger, load_documents
+from app.schemas import ErpLoadResult
+
+router = APIRouter()
+
+
+async def _load(request: Request, ledger: Ledger, fmt: Optional[str], report: str) -> dict:
+    fmt = fmt or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    return await load_documents(request.stream(), fmt, ledger, report)
+
+
+@router.post("/purchase-orders", response_model=ErpLoadResult)
+async def load_purchase_orders(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    report: str = Query("errors", pattern="^(errors|none)$"),
+):
+    """
+    Stream an NDJSON or CSV purchase-order extract into the ledger.
+    Rows upsert on (supplier_id, po_number); `report` limits per-row results
+    to failed rows or none.
+    """
+    return await _load(request, PURCHASE_ORDERS, format, report)
+
+
+@router.post("/goods-receipts", response_model=ErpLoadResult)
+async def load_goods_receipts(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    report: str = Query("errors", pattern="^(errors|none)$"),
+):
+    """
+    Stream an NDJSON or CSV goods-receipt extract into the ledger.
+    Rows upsert on (supplier_id, grn_number).
+    """
+    return await _load(request, GOODS_RECEIPTS, format, report)
@@ -1,114 +1,126 @@
 """Fraud detection scanning routes."""
 
-import uuid
-from datetime import datetime
-from typing import List
-from fastapi import APIRouter, Depends
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
+from app.cache import cached_response, bump_data_version
 from app.database import get_db
-from app.models import Invoice, FraudFlag, InvoiceStatus
-from app.schemas import FraudScanResult, FraudFlagOut
-from app.engines.invoice_validator import validate_invoice
-from app.engines.duplicate_detector import detect_duplicates
-from app.engines.velocity_detector import detect_velocity_anomalies
-from app.engines.cascade_detector import detect_cascade_fraud
-from app.engines.dilution_monitor import detect_dilution
-from app.engines.graph_analytics import detect_carousel_fraud
+from app.models import Invoice, FraudFlag, ScanJob
+from app.schemas import FraudFlagOut, ScanJobOut, ReplayRequest, ReplayResult
+from app.pagination import keyset_query, keyset_page
+from app.scanner import submit_scan
+from app.flag_store import compact_flags
+from app.scheduler import schedule_status
+from app.replay import ReplayError, replay_thresholds
 
 router = APIRouter()
 
 
-@router.post("/scan", response_model=FraudScanResult)
-async def run_fraud_scan(db: AsyncSession = Depends(get_db)):
-    """Run all fraud detection engines across all pending invoices."""
-    scan_id = str(uuid.uuid4())[:8]
-    all_flags: List[FraudFlag] = []
-
-    # 1. Invoice validation on all pending invoices
+@router.post("/scan", response_model=ScanJobOut, status_code=202)
+async def run_fraud_scan(
+    mode: str = Query("auto", pattern="^(full|incremental|auto)$"),
+    chunked: bool = False,
+    parallel: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Queue a scan of all fraud detection engines.
+    `incremental` only examines rows added since each engine's checkpoint;
+    `auto` (default) does the same but periodically falls back to `full`.
+    `chunked` streams pending invoices and commits flags in bounded chunks.
+    `parallel` shards every engine across a pool of worker processes.
+    Returns immediately; poll GET /scans/{scan_id} or listen on /ws/alerts.
+    While a queued or running scan covers the same options (a full scan
+    covers `auto` and `incremental`), that job is returned instead of a new one.
+    """
+    job = await submit_scan(db, mode, chunked, parallel)
+    return ScanJobOut.model_validate(job)
+
+
+@router.get("/scans", response_model=List[ScanJobOut])
+async def list_scans(limit: int = Query(20, le=100), db: AsyncSession = Depends(get_db)):
+    """Most recent scan jobs, newest first."""
     result = await db.execute(
-        select(Invoice).where(Invoice.status == InvoiceStatus.pending)
+        select(ScanJob).order_by(ScanJob.created_at.desc()).limit(limit)
     )
-    pending = result.scalars().all()
-
-    for inv in pending:
-        flags = await validate_invoice(db, inv)
-        all_flags.extend(flags)
-
-    # 2. Duplicate detection (full scan)
-    dup_flags = await detect_duplicates(db)
-    all_flags.extend(dup_flags)
-
-    # 3. Velocity anomalies
-    vel_flags = await detect_velocity_anomalies(db)
-    all_flags.extend(vel_flags)
-
-    # 4. Cascade fraud
-    cas_flags = await detect_cascade_fraud(db)
-    all_flags.extend(cas_flags)
+    return [ScanJobOut.model_validate(j) for j in result.scalars().all()]
 
-    # 5. Dilution monitoring
-    dil_flags = await detect_dilution(db)
-    all_flags.extend(dil_flags)
 
-    # 6. Carousel detection
-    car_flags = await detect_carousel_fraud(db)
-    all_flags.extend(car_flags)
+@router.get("/scans/{scan_id}", response_model=ScanJobOut)
+async def get_scan(scan_id: str, db: AsyncSession = Depends(get_db)):
+    """Status, per-engine progress and (once completed) the result of a scan."""
+    job = await db.get(ScanJob, scan_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return ScanJobOut.model_validate(job)
 
-    # Save new flags
-    for flag in all_flags:
-        db.add(flag)
 
-    # Update invoice risk scores
-    for inv in pending:
-        inv_flags = [f for f in all_flags if f.invoice_id == inv.id]
-        if inv_flags:
-            max_conf = max(f.confidence for f in inv_flags)
-            inv.risk_score = max(inv.risk_score, round(max_conf * 100, 1))
-            if inv.risk_score > 50:
-                inv.status = InvoiceStatus.flagged
+@router.get("/schedule")
+async def get_schedule(db: AsyncSession = Depends(get_db)):
+    """Per-engine cadence, last run and next due time of the background scheduler."""
+    return await schedule_status(db)
 
-    await db.commit()
 
-    # Summary
-    type_counts = {}
-    for f in all_flags:
-        key = f.fraud_type.value if hasattr(f.fraud_type, 'value') else str(f.fraud_type)
-        type_counts[key] = type_counts.get(key, 0) + 1
-
-    return FraudScanResult(
-        scan_id=scan_id,
-        timestamp=datetime.utcnow(),
-        invoices_scanned=len(pending),
-        flags_raised=len(all_flags),
-        flags=[FraudFlagOut.model_validate(f) for f in all_flags[:50]],
-        summary=type_counts,
-    )
+@router.post("/replay", response_model=ReplayResult)
+async def replay(data: ReplayRequest, db: AsyncSession = Depends(get_db)):
+    """
+    What-if replay of engine thresholds over the current data.
+    Every combination of the `grid` values is evaluated in one vectorized
+    pass and reported with flag counts, exposure, precision and recall
+    against analyst dispositions; no flags are written.
+    """
+    try:
+        return await replay_thresholds(db, data.grid)
+    except ReplayError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
 
 
 @router.get("/flags", response_model=List[FraudFlagOut])
 async def list_fraud_flags(
+    response: Response,
     fraud_type: str = None,
     min_confidence: float = None,
+    limit: int = Query(200, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
-    """List all fraud flags with optional filters."""
-    query = select(FraudFlag).order_by(FraudFlag.confidence.desc())
+    """
+    List fraud flags with optional filters, most confident first.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
+    """
+    query = select(FraudFlag)
 
     if fraud_type:
         query = query.where(FraudFlag.fraud_type == fraud_type)
     if min_confidence:
         query = query.where(FraudFlag.confidence >= min_confidence)
 
-    result = await db.execute(query.limit(200))
-    return [FraudFlagOut.model_validate(f) for f in result.scalars().all()]
+    query = keyset_query(query, (FraudFlag.confidence, FraudFlag.id), cursor, limit)
+    result = await db.execute(query)
+    flags = keyset_page(result.scalars().all(), limit, lambda f: (f.confidence, f.id), response)
+    return [FraudFlagOut.model_validate(f) for f in flags]
+
+
+@router.post("/flags/compact")
+async def compact_fraud_flags(db: AsyncSession = Depends(get_db)):
+    """Remove duplicate flags sharing a natural key, keeping the earliest of each."""
+    removed = await compact_flags(db)
+    await db.commit()
+    if removed:
+        await bump_data_version()
+    return {"removed": removed}
 
 
 @router.get("/exposure")
-async def total_exposure(db: AsyncSession = Depends(get_db)):
-    """Calculate total fraud exposure by type."""
+async def total_exposure(request: Request):
+    """Calculate total fraud exposure by type (cached)."""
+    return await cached_response(request, "fraud:exposure", _compute_exposure)
+
+
+async def _compute_exposure(db: AsyncSession) -> dict:
+    """Aggregate flagged invoice amounts per fraud type."""
     from sqlalchemy import func, distinct
 
     result = await db.execute(
@@ -3,32 +3,65 @@
 import hashlib
 from datetime import datetime
 from typing import Optional, List
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from app.cache import bump_data_version
 from app.database import get_db
-from app.models import Invoice, Entity, FraudFlag, InvoiceStatus
-from app.schemas import InvoiceCreate, InvoiceOut, FraudFlagOut
+from app.models import Invoice, FraudFlag, InvoiceStatus
+from app.entity_cache import get_entities, entity_name
+from app.schemas import InvoiceCreate, InvoiceOut, IngestResult, PrecheckResult
+from app.ingest import ingest_invoices
+from app.precheck import PrecheckError, pair_stats, precheck_invoice
+from app.erp import validate_documents
+from app.flag_store import persist_flags
+from app.alerting import alert_batcher
+from app.pagination import keyset_query, keyset_page, nulls_as
 from app.engines.invoice_validator import validate_invoice, compute_fingerprint
 from app.engines.duplicate_detector import detect_duplicates
+from app.engines.risk_fusion import fuse_flags, FLAGGED_THRESHOLD
 
 router = APIRouter()
 
 
+def _invoice_query():
+    """Invoices with flags eagerly loaded; party names come from the entity cache."""
+    return select(Invoice).options(selectinload(Invoice.fraud_flags))
+
+
+async def _invoices_out(db: AsyncSession, invoices: List[Invoice]) -> List[InvoiceOut]:
+    """Serialize invoice rows, resolving every party name in one cache lookup."""
+    entities = await get_entities(db, {i for inv in invoices for i in (inv.supplier_id, inv.buyer_id)})
+    out = []
+    for invoice in invoices:
+        inv_out = InvoiceOut.model_validate(invoice)
+        inv_out.supplier_name = entity_name(entities, invoice.supplier_id)
+        inv_out.buyer_name = entity_name(entities, invoice.buyer_id)
+        out.append(inv_out)
+    return out
+
+
 @router.get("/", response_model=List[InvoiceOut])
 async def list_invoices(
+    response: Response,
     status: Optional[str] = None,
     tier: Optional[str] = None,
     min_risk: Optional[float] = None,
     supplier_id: Optional[int] = None,
     limit: int = Query(100, le=500),
     offset: int = 0,
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
-    """List invoices with optional filters."""
-    query = select(Invoice).options(selectinload(Invoice.fraud_flags))
+    """
+    List invoices with optional filters, highest risk first.
+    Pass the X-Next-Cursor response header back as `cursor` to page
+    through results; `offset` is kept for existing clients and ignored
+    once a cursor is given.
+    """
+    query = _invoice_query()
 
     if status:
         query = query.where(Invoice.status == status)
@@ -39,47 +72,24 @@ async def list_invoices(
     if supplier_id:
         query = query.where(Invoice.supplier_id == supplier_id)
 
-    query = query.order_by(Invoice.risk_score.desc()).offset(offset).limit(limit)
+    query = keyset_query(query, (nulls_as(Invoice.risk_score, 0), Invoice.id), cursor, limit)
+    if cursor is None:
+        query = query.offset(offset)
 
     result = await db.execute(query)
-    invoices = result.scalars().all()
-
-    # Enrich with entity names
-    out = []
-    for inv in invoices:
-        inv_dict = InvoiceOut.model_validate(inv)
-
-        supplier = await db.get(Entity, inv.supplier_id)
-        buyer = await db.get(Entity, inv.buyer_id)
-        inv_dict.supplier_name = supplier.name if supplier else None
-        inv_dict.buyer_name = buyer.name if buyer else None
-        inv_dict.fraud_flags = [FraudFlagOut.model_validate(f) for f in inv.fraud_flags]
-
-        out.append(inv_dict)
-
-    return out
+    invoices = keyset_page(result.scalars().all(), limit, lambda inv: (inv.risk_score or 0.0, inv.id), response)
+    return await _invoices_out(db, invoices)
 
 
 @router.get("/{invoice_id}", response_model=InvoiceOut)
 async def get_invoice(invoice_id: int, db: AsyncSession = Depends(get_db)):
     """Get a single invoice with fraud flags."""
-    result = await db.execute(
-        select(Invoice)
-        .options(selectinload(Invoice.fraud_flags))
-        .where(Invoice.id == invoice_id)
-    )
+    result = await db.execute(_invoice_query().where(Invoice.id == invoice_id))
     invoice = result.scalar_one_or_none()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
 
-    inv_out = InvoiceOut.model_validate(invoice)
-    supplier = await db.get(Entity, invoice.supplier_id)
-    buyer = await db.get(Entity, invoice.buyer_id)
-    inv_out.supplier_name = supplier.name if supplier else None
-    inv_out.buyer_name = buyer.name if buyer else None
-    inv_out.fraud_flags = [FraudFlagOut.model_validate(f) for f in invoice.fraud_flags]
-
-    return inv_out
+    return (await _invoices_out(db, [invoice]))[0]
 
 
 @router.post("/", response_model=InvoiceOut)
@@ -89,6 +99,9 @@ async def create_invoice(data: InvoiceCreate, db: AsyncSession = Depends(get_db)
         data.invoice_number, data.supplier_id, data.buyer_id,
         data.amount, data.invoice_date,
     )
+    po_validated, grn_validated = await validate_documents(
+        db, data.supplier_id, data.buyer_id, data.po_number, data.grn_number,
+    )
 
     invoice = Invoice(
         invoice_number=data.invoice_number,
@@ -104,8 +117,8 @@ async def create_invoice(data: InvoiceCreate, db: AsyncSession = Depends(get_db)
         po_number=data.po_number,
         grn_number=data.grn_number,
         delivery_confirmed=data.delivery_confirmed,
-        po_validated=bool(data.po_number),
-        grn_validated=bool(data.grn_number),
+        po_validated=po_validated,
+        grn_validated=grn_validated,
         status=InvoiceStatus.pending,
     )
     db.add(invoice)
@@ -118,25 +131,53 @@ async def create_invoice(data: InvoiceCreate, db: AsyncSession = Depends(get_db)
 
     # Calculate risk score
     if flags:
-        max_confidence = max(f.confidence for f in flags)
-        invoice.risk_score = round(max_confidence * 100, 1)
-        if invoice.risk_score > 50:
+        invoice.risk_score = fuse_flags(flags)[invoice.id]
+        if invoice.risk_score > FLAGGED_THRESHOLD:
             invoice.status = InvoiceStatus.flagged
 
-    for flag in flags:
-        db.add(flag)
-
+    stored = await persist_flags(db, flags)
     await db.commit()
-    await db.refresh(invoice)
-
-    inv_out = InvoiceOut.model_validate(invoice)
-    supplier = await db.get(Entity, invoice.supplier_id)
-    buyer = await db.get(Entity, invoice.buyer_id)
-    inv_out.supplier_name = supplier.name if supplier else None
-    inv_out.buyer_name = buyer.name if buyer else None
-    inv_out.fraud_flags = [FraudFlagOut.model_validate(f) for f in flags]
+    pair_stats.invalidate([(invoice.supplier_id, invoice.buyer_id)])
+    alert_batcher.submit(row for row in stored if row.inserted)
+    await bump_data_version()
 
-    return inv_out
+    # Re-read with flags (names come from the entity cache)
+    result = await db.execute(
+        _invoice_query()
+        .where(Invoice.id == invoice.id)
+        .execution_options(populate_existing=True)
+    )
+    return (await _invoices_out(db, [result.scalar_one()]))[0]
+
+
+@router.post("/precheck", response_model=PrecheckResult)
+async def precheck(data: InvoiceCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Score a candidate invoice before disbursement without storing it.
+    Same rules and fusion as POST /, served from cached statistics.
+    """
+    try:
+        return await precheck_invoice(db, data)
+    except PrecheckError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+@router.post("/bulk", response_model=IngestResult)
+async def bulk_ingest_invoices(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    report: str = Query("all", pattern="^(all|errors|none)$"),
+):
+    """
+    Stream NDJSON or CSV invoices (one per line, same fields as POST /) into
+    the ledger with batched validation and duplicate checks.
+    The format defaults from Content-Type; `report` limits per-row results.
+    """
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    result = await ingest_invoices(request.stream(), fmt, report)
+    if result["accepted"]:
+        await bump_data_version()
+    return result
 
 
 @router.get("/stats/summary")
@@ -0,0 +1,534 @@
+"""
+Fraud scan pipeline and background job worker.
+
+`POST /api/fraud/scan` only records a `ScanJob`; a worker task started in
+the FastAPI lifespan claims queued jobs (FOR UPDATE SKIP LOCKED, so several
+uvicorn workers can share the queue), runs every engine with per-engine
+progress persisted on the job and pushed over `/ws/alerts`, and stores the
+final result for polling via `GET /api/fraud/scans/{scan_id}`.
+
+Incremental scans keep a `(created_at, id)` checkpoint per engine and only
+hand each engine the rows that arrived since, plus the fingerprints,
+suppliers, cascade groups and trading parties those rows touch.
+
+Only one scan executes at a time across all processes: submissions are
+serialised on an advisory lock and attach to an already queued or running
+job, and the worker only claims a job while holding the scan lock.
+
+Parallel scans fan each engine out over a process pool (see
+`app.parallel_scan`) and merge the shards' flags back into one write.
+
+Full, in-process passes of the array-friendly engines run their columnar
+kernels over the scan snapshot (see `app.snapshot`), which is brought up to
+date once per scan.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, update, tuple_, and_, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.alerting import alert_batcher
+from app.cache import bump_data_version
+from app.database import SessionLocal
+from app.flag_store import persist_flags
+from app.locks import SCAN_LOCK, SCAN_SUBMIT_LOCK, xact_lock, try_lock
+from app.models import (
+    Invoice, FraudFlag, InvoiceStatus, CashCollection,
+    ScanJob, ScanJobStatus, ScanCheckpoint,
+)
+from app.schemas import FraudScanResult, FraudFlagOut
+from app.websocket import broadcast_event
+from app.engines.invoice_validator import validate_invoice
+from app.engines.three_way_match import detect_three_way_mismatches
+from app.engines.duplicate_detector import detect_duplicates, detect_duplicates_columnar
+from app.engines.feasibility_monitor import detect_infeasible_volume, detect_infeasible_volume_columnar
+from app.engines.velocity_detector import detect_velocity_anomalies, detect_velocity_anomalies_columnar
+from app.engines.cascade_detector import detect_cascade_fraud, detect_cascade_fraud_columnar
+from app.engines.dilution_monitor import detect_dilution, detect_dilution_columnar
+from app.engines.anomaly_detector import detect_anomalies, detect_anomalies_columnar
+from app.engines.graph_analytics import detect_carousel_fraud
+from app.engines.risk_fusion import apply_risk_scores
+from app.parallel_scan import run_partitioned
+from app.snapshot import SCAN_SNAPSHOT, Snapshot, get_snapshot
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv("SCAN_POLL_SECONDS", "5"))
+FULL_SCAN_INTERVAL = timedelta(seconds=float(os.getenv("FULL_SCAN_INTERVAL_SECONDS", "86400")))
+SCAN_CHUNK_SIZE = int(os.getenv("SCAN_CHUNK_SIZE", "1000"))
+# created_at is stamped when a row is written, not when its transaction
+# commits, so a row can land behind a checkpoint taken while it was still
+# uncommitted.  Incremental scopes re-read this much before the checkpoint
+# (longer than any ingest transaction); re-found flags dedupe on their
+# natural key.
+SCAN_OVERLAP = timedelta(seconds=float(os.getenv("SCAN_OVERLAP_SECONDS", "600")))
+
+# Order matters: validation first, the expensive graph search last
+ENGINES = [
+    "invoice_validator",
+    "three_way_match",
+    "duplicate_detector",
+    "feasibility_monitor",
+    "velocity_detector",
+    "cascade_detector",
+    "dilution_monitor",
+    "anomaly_detector",
+    "graph_analytics",
+]
+
+# Full-pass kernels over the columnar snapshot
+COLUMNAR = {
+    "duplicate_detector": detect_duplicates_columnar,
+    "feasibility_monitor": detect_infeasible_volume_columnar,
+    "velocity_detector": detect_velocity_anomalies_columnar,
+    "cascade_detector": detect_cascade_fraud_columnar,
+    "dilution_monitor": detect_dilution_columnar,
+    "anomaly_detector": detect_anomalies_columnar,
+}
+
+Progress = Callable[[dict], Awaitable[None]]
+
+
+# ── Watermarks ──────────────────────────────────────────────────────
+class Marks(NamedTuple):
+    """(created_at, id) high-water marks for invoices and collections."""
+    invoice_created_at: Optional[datetime]
+    invoice_id: Optional[int]
+    collection_created_at: Optional[datetime]
+    collection_id: Optional[int]
+
+
+async def current_marks(db: AsyncSession) -> Marks:
+    """Newest invoice and collection at the start of a scan."""
+    inv = (await db.execute(
+        select(Invoice.created_at, Invoice.id)
+        .order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(1)
+    )).first()
+    col = (await db.execute(
+        select(CashCollection.created_at, CashCollection.id)
+        .order_by(CashCollection.created_at.desc(), CashCollection.id.desc()).limit(1)
+    )).first()
+    return Marks(*(inv or (None, None)), *(col or (None, None)))
+
+
+def _window(created_col, id_col, since_ts, until_ts, until_id):
+    """Rows from SCAN_OVERLAP before the checkpoint up to the scan's high-water mark."""
+    conditions = []
+    if since_ts is not None:
+        conditions.append(created_col > since_ts - SCAN_OVERLAP)
+    if until_ts is not None:
+        conditions.append(tuple_(created_col, id_col) <= tuple_(until_ts, until_id))
+    return and_(true(), *conditions)
+
+
+async def load_checkpoints(db: AsyncSession) -> Dict[str, ScanCheckpoint]:
+    result = await db.execute(select(ScanCheckpoint))
+    return {cp.engine: cp for cp in result.scalars().all()}
+
+
+async def save_checkpoints(db: AsyncSession, marks: Marks, engine_modes: Dict[str, str]):
+    """Advance each engine's checkpoint to `marks` (within the caller's transaction)."""
+    now = datetime.utcnow()
+    for engine, mode in engine_modes.items():
+        values = dict(
+            engine=engine,
+            invoice_created_at=marks.invoice_created_at,
+            invoice_id=marks.invoice_id,
+            collection_created_at=marks.collection_created_at,
+            collection_id=marks.collection_id,
+            updated_at=now,
+        )
+        if mode == "full":
+            values["last_full_scan_at"] = now
+        stmt = pg_insert(ScanCheckpoint).values(**values)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[ScanCheckpoint.engine],
+            set_={k: v for k, v in values.items() if k != "engine"},
+        ))
+
+
+async def record_run(db: AsyncSession, engine: str, duration_ms: float, flags: int):
+    """Note when an engine last ran, how long it took and what it raised."""
+    now = datetime.utcnow()
+    values = dict(last_run_at=now, last_duration_ms=round(duration_ms, 1), last_flags=flags, updated_at=now)
+    stmt = pg_insert(ScanCheckpoint).values(engine=engine, **values)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[ScanCheckpoint.engine], set_=values))
+
+
+def needs_full_scan(mode: str, checkpoint: Optional[ScanCheckpoint]) -> bool:
+    """Full scans are forced without a checkpoint and once the full-scan interval lapses."""
+    if mode == "full" or checkpoint is None or checkpoint.invoice_created_at is None:
+        return True
+    if mode == "incremental":
+        return False
+    last_full = checkpoint.last_full_scan_at
+    return last_full is None or datetime.utcnow() - last_full > FULL_SCAN_INTERVAL
+
+
+async def engine_scope(db: AsyncSession, checkpoint: ScanCheckpoint, marks: Marks) -> dict:
+    """
+    Rows that arrived since `checkpoint`, plus the neighbours they affect:
+    their fingerprints, suppliers, cascade groups and trading parties.
+    """
+    invoices = (await db.execute(
+        select(Invoice.id, Invoice.supplier_id, Invoice.buyer_id,
+               Invoice.fingerprint, Invoice.cascade_group)
+        .where(_window(Invoice.created_at, Invoice.id,
+                       checkpoint.invoice_created_at,
+                       marks.invoice_created_at, marks.invoice_id))
+    )).all()
+    collections = (await db.execute(
+        select(CashCollection.id)
+        .where(_window(CashCollection.created_at, CashCollection.id,
+                       checkpoint.collection_created_at,
+                       marks.collection_created_at, marks.collection_id))
+    )).scalars().all()
+
+    return {
+        "invoice_ids": {r.id for r in invoices},
+        "fingerprints": {r.fingerprint for r in invoices},
+        "supplier_ids": {r.supplier_id for r in invoices},
+        "cascade_groups": {r.cascade_group for r in invoices if r.cascade_group},
+        "entity_ids": {r.supplier_id for r in invoices} | {r.buyer_id for r in invoices},
+        "collection_ids": set(collections),
+    }
+
+
+# ── Scan pipeline ───────────────────────────────────────────────────
+class FlagSink:
+    """
+    Collects flags from the engines, upserts them on their natural key and
+    re-fuses the risk scores of the invoices they touch; only newly inserted
+    flags count towards the scan's totals.  With a chunk size, every full
+    chunk is committed and the session's identity map cleared, so memory
+    stays bounded by the chunk rather than the backlog; without one
+    everything lands in one transaction.  New flags go to alerting once
+    their transaction commits.
+    """
+
+    def __init__(self, db: AsyncSession, chunk_size: int = 0, sample_size: int = 50):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        self.pending: List[FraudFlag] = []
+        self.total = 0
+        self.summary: Dict[str, int] = {}
+        self.sample: List[FraudFlagOut] = []
+        self.uncommitted: List = []
+
+    async def add(self, flags: List[FraudFlag]):
+        self.pending.extend(flags)
+        if self.chunk_size and len(self.pending) >= self.chunk_size:
+            await self.flush(commit=True)
+
+    async def flush(self, commit: bool):
+        flags, self.pending = self.pending, []
+        if flags:
+            stored = await persist_flags(self.db, flags)
+            # Only invoices whose flags were written can have a new score
+            await apply_risk_scores(self.db, {row.invoice_id for row in stored})
+            inserted = [row for row in stored if row.inserted]
+            for f in inserted:
+                key = f.fraud_type.value if hasattr(f.fraud_type, 'value') else str(f.fraud_type)
+                self.summary[key] = self.summary.get(key, 0) + 1
+            room = self.sample_size - len(self.sample)
+            self.sample.extend(FraudFlagOut.model_validate(f) for f in inserted[:max(room, 0)])
+            self.total += len(inserted)
+            self.uncommitted.extend(inserted)
+        if commit:
+            await self.commit()
+
+    async def commit(self):
+        await self.db.commit()
+        self.db.expunge_all()
+        alert_batcher.submit(self.uncommitted)
+        self.uncommitted = []
+
+
+async def _validate_pending(db: AsyncSession, scope: Optional[dict], sink: FlagSink) -> int:
+    """
+    Validate pending invoices.  In chunked mode they are streamed from a
+    server-side cursor on a separate read session, `chunk_size` at a time.
+    """
+    query = select(Invoice).where(Invoice.status == InvoiceStatus.pending)
+    if scope is not None:
+        query = query.where(Invoice.id.in_(scope["invoice_ids"]))
+
+    if not sink.chunk_size:
+        pending = (await db.execute(query)).scalars().all()
+        for inv in pending:
+            await sink.add(await validate_invoice(db, inv))
+        return len(pending)
+
+    validated = 0
+    async with SessionLocal() as reader:
+        result = await reader.stream(
+            query.order_by(Invoice.id).execution_options(yield_per=sink.chunk_size)
+        )
+        async for chunk in result.scalars().partitions():
+            for inv in chunk:
+                await sink.add(await validate_invoice(db, inv))
+                reader.expunge(inv)
+            validated += len(chunk)
+    return validated
+
+
+def uses_snapshot(engine: str, scope: Optional[dict], parallel: bool = False) -> bool:
+    """Whether this run goes through the engine's columnar kernel."""
+    return SCAN_SNAPSHOT and scope is None and not parallel and engine in COLUMNAR
+
+
+async def run_engine(db: AsyncSession, engine: str, scope: Optional[dict], sink: FlagSink,
+                     parallel: bool = False, snapshot: Optional[Snapshot] = None) -> int:
+    """
+    Run one engine, over everything (scope=None) or only an incremental
+    scope, feeding its flags into `sink`.  Full runs use the engine's
+    columnar kernel when a `snapshot` is given.  Returns how many invoices
+    were validated.
+    """
+    if parallel:
+        flags, validated = await run_partitioned(db, engine, scope)
+        await sink.add(flags)
+        return validated
+
+    if engine == "invoice_validator":
+        return await _validate_pending(db, scope, sink)
+
+    if scope is None and snapshot is not None and engine in COLUMNAR:
+        await sink.add(await COLUMNAR[engine](db, snapshot))
+        return 0
+
+    if scope is None:
+        scope = {}
+    if engine == "three_way_match":
+        flags = await detect_three_way_mismatches(db, invoice_ids=scope.get("invoice_ids"))
+    elif engine == "duplicate_detector":
+        flags = await detect_duplicates(db, fingerprints=scope.get("fingerprints"))
+    elif engine == "feasibility_monitor":
+        flags = await detect_infeasible_volume(db, supplier_ids=scope.get("supplier_ids"))
+    elif engine == "velocity_detector":
+        flags = await detect_velocity_anomalies(db, supplier_ids=scope.get("supplier_ids"))
+    elif engine == "cascade_detector":
+        flags = await detect_cascade_fraud(db, cascade_groups=scope.get("cascade_groups"))
+    elif engine == "dilution_monitor":
+        flags = await detect_dilution(db, collection_ids=scope.get("collection_ids"))
+    elif engine == "anomaly_detector":
+        flags = await detect_anomalies(db, invoice_ids=scope.get("invoice_ids"))
+    elif engine == "graph_analytics":
+        flags = await detect_carousel_fraud(db, entity_ids=scope.get("entity_ids"))
+    else:
+        raise ValueError(f"Unknown engine {engine!r}")
+    await sink.add(flags)
+    return 0
+
+
+async def execute_scan(db: AsyncSession, scan_id: str, mode: str = "full",
+                       progress: Optional[Progress] = None, chunk_size: int = 0,
+                       parallel: bool = False) -> FraudScanResult:
+    """
+    Run all fraud detection engines.
+    In `incremental`/`auto` mode each engine only examines rows past its
+    checkpoint; `auto` falls back to a full pass once FULL_SCAN_INTERVAL lapses.
+    A non-zero `chunk_size` commits flags chunk by chunk instead of once at the end;
+    `parallel` partitions each engine across the scan process pool.
+    """
+    sink = FlagSink(db, chunk_size)
+    invoices_scanned = 0
+    engine_modes: Dict[str, str] = {}
+
+    async def report(index: int, engine: str, state: str, flags: int = 0):
+        if progress:
+            await progress({
+                "engine": engine, "state": state, "flags": flags,
+                "mode": engine_modes[engine],
+                "step": index + 1, "total": len(ENGINES),
+            })
+
+    marks = await current_marks(db)
+    checkpoints = await load_checkpoints(db)
+    scopes: Dict[tuple, dict] = {}
+    runs: Dict[str, Tuple[float, int]] = {}
+    snapshot: Optional[Snapshot] = None
+
+    for index, engine in enumerate(ENGINES):
+        checkpoint = checkpoints.get(engine)
+        scope = None
+        if not needs_full_scan(mode, checkpoint):
+            key = (checkpoint.invoice_created_at, checkpoint.invoice_id,
+                   checkpoint.collection_created_at, checkpoint.collection_id)
+            if key not in scopes:
+                scopes[key] = await engine_scope(db, checkpoint, marks)
+            scope = scopes[key]
+        engine_modes[engine] = "full" if scope is None else "incremental"
+
+        await report(index, engine, "running")
+        before = sink.total + len(sink.pending)
+        started = time.perf_counter()
+        if snapshot is None and uses_snapshot(engine, scope, parallel):
+            snapshot = await get_snapshot(db)
+        invoices_scanned += await run_engine(db, engine, scope, sink, parallel, snapshot)
+        if chunk_size:
+            await sink.flush(commit=True)
+        raised = sink.total + len(sink.pending) - before
+        runs[engine] = ((time.perf_counter() - started) * 1000, raised)
+        await report(index, engine, "done", raised)
+
+    # Checkpoints advance with the last batch of flags
+    await sink.flush(commit=False)
+    await save_checkpoints(db, marks, engine_modes)
+    for engine, (duration_ms, raised) in runs.items():
+        await record_run(db, engine, duration_ms, raised)
+    await sink.commit()
+    await bump_data_version()
+
+    return FraudScanResult(
+        scan_id=scan_id,
+        timestamp=datetime.utcnow(),
+        invoices_scanned=invoices_scanned,
+        flags_raised=sink.total,
+        flags=sink.sample,
+        summary=sink.summary,
+        mode=mode,
+        engine_modes=engine_modes,
+    )
+
+
+# ── Jobs ────────────────────────────────────────────────────────────
+_wakeup = asyncio.Event()
+
+# Modes whose scan also covers the requested one
+COVERING_MODES = {
+    "full": {"full"},
+    "auto": {"full", "auto"},
+    "incremental": {"full", "auto", "incremental"},
+}
+
+
+async def submit_scan(db: AsyncSession, mode: str = "auto", chunked: bool = False,
+                      parallel: bool = False) -> ScanJob:
+    """
+    Queue a scan job and wake the local worker.
+    If a queued or running scan already covers the request – same `chunked`
+    and `parallel`, and a mode at least as thorough – that job is returned
+    instead so concurrent callers share one scan and its result; otherwise
+    a new job is queued behind it.
+    """
+    await xact_lock(db, SCAN_SUBMIT_LOCK)
+    active = (await db.execute(
+        select(ScanJob)
+        .where(ScanJob.status.in_([ScanJobStatus.queued, ScanJobStatus.running]))
+        .where(ScanJob.mode.in_(COVERING_MODES[mode]))
+        .where(ScanJob.chunked == chunked, ScanJob.parallel == parallel)
+        .order_by(ScanJob.created_at)
+        .limit(1)
+    )).scalar_one_or_none()
+    if active:
+        await db.commit()
+        return active
+
+    job = ScanJob(
+        id=str(uuid.uuid4())[:8],
+        status=ScanJobStatus.queued,
+        mode=mode,
+        chunked=chunked,
+        parallel=parallel,
+        progress={"engines": {}, "step": 0, "total": len(ENGINES)},
+    )
+    db.add(job)
+    await db.commit()
+    _wakeup.set()
+    return job
+
+
+async def _claim_job() -> Optional[Tuple[str, str, bool, bool]]:
+    """Atomically move the oldest queued job to running (caller holds the scan lock)."""
+    async with SessionLocal() as db:
+        # Holding the scan lock means nothing else is executing, so any job
+        # still marked running was orphaned by a crashed worker
+        await db.execute(
+            update(ScanJob)
+            .where(ScanJob.status == ScanJobStatus.running)
+            .values(status=ScanJobStatus.failed, error="Scan worker exited", finished_at=datetime.utcnow())
+        )
+        result = await db.execute(
+            select(ScanJob)
+            .where(ScanJob.status == ScanJobStatus.queued)
+            .order_by(ScanJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = result.scalar_one_or_none()
+        if job:
+            job.status = ScanJobStatus.running
+            job.started_at = datetime.utcnow()
+        await db.commit()
+        return (job.id, job.mode or "auto", bool(job.chunked), bool(job.parallel)) if job else None
+
+
+async def _update_job(scan_id: str, **values):
+    async with SessionLocal() as db:
+        await db.execute(update(ScanJob).where(ScanJob.id == scan_id).values(**values))
+        await db.commit()
+
+
+async def run_job(scan_id: str, mode: str = "auto", chunked: bool = False, parallel: bool = False):
+    """Execute a claimed job, persisting progress and the final result."""
+    state = {"engines": {}, "step": 0, "total": len(ENGINES)}
+
+    async def progress(event: dict):
+        state["engines"][event["engine"]] = {"state": event["state"], "flags": event["flags"]}
+        state["step"] = event["step"] if event["state"] == "done" else event["step"] - 1
+        await _update_job(scan_id, progress=dict(state))
+        await broadcast_event("scan_progress", {"scan_id": scan_id, **event})
+
+    await broadcast_event("scan_progress", {"scan_id": scan_id, "state": "running"})
+    try:
+        async with SessionLocal() as db:
+            result = await execute_scan(db, scan_id, mode, progress,
+                                        chunk_size=SCAN_CHUNK_SIZE if chunked else 0,
+                                        parallel=parallel)
+    except Exception as exc:
+        logger.exception("scan %s failed", scan_id)
+        await _update_job(scan_id, status=ScanJobStatus.failed, error=str(exc),
+                          finished_at=datetime.utcnow())
+        await broadcast_event("scan_progress", {"scan_id": scan_id, "state": "failed", "error": str(exc)})
+        return
+
+    await _update_job(scan_id, status=ScanJobStatus.completed, result=jsonable_encoder(result),
+                      finished_at=datetime.utcnow())
+    await broadcast_event("scan_progress", {
+        "scan_id": scan_id, "state": "completed",
+        "flags_raised": result.flags_raised, "summary": result.summary,
+    })
+
+
+async def scan_worker():
+    """Claim and run queued scans until cancelled, one at a time cluster-wide."""
+    while True:
+        claimed = None
+        try:
+            async with try_lock(SCAN_LOCK) as held:
+                if held:
+                    claimed = await _claim_job()
+                    if claimed:
+                        await run_job(*claimed)
+        except Exception:
+            logger.exception("scan worker could not claim a job")
+
+        if claimed:
+            continue
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
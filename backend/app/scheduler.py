@@ -0,0 +1,220 @@
+"""
+Tiered engine scheduler.
+
+Instead of running every engine whenever a scan is requested, a task in the
+FastAPI lifespan wakes every SCHEDULER_TICK_SECONDS and runs the engines
+whose cadence has elapsed – cheap checks often, the graph search rarely –
+most overdue first, within SCHEDULER_BUDGET_SECONDS of wall time per cycle:
+
+- an engine whose last run took longer than the remaining budget waits for
+  a later cycle, unless it is more than twice overdue (so it cannot starve);
+- validation walks pending invoices nearest disbursement first – upcoming
+  due dates, then overdue ones most recent first – and stops at the budget;
+  the next cycle resumes after the last invoice validated, wrapping round
+  at the end, so the whole queue is covered rather than its head;
+- the other engines reuse the incremental scan checkpoints, so a scheduled
+  run only looks at rows that arrived since the engine last ran.
+
+Cycles run under the scan lock, so they never overlap a queued scan or
+another worker's scheduler.  GET /api/fraud/schedule reports the cadence,
+last run and next due time of every engine.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import bump_data_version
+from app.database import SessionLocal
+from app.locks import SCAN_LOCK, try_lock
+from app.models import Invoice, InvoiceStatus, ScanCheckpoint
+from app.engines.invoice_validator import validate_invoice
+from app.snapshot import get_snapshot
+from app.scanner import (
+    ENGINES, FlagSink, current_marks, engine_scope, load_checkpoints,
+    needs_full_scan, record_run, run_engine, save_checkpoints, uses_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK_SECONDS", "15"))
+SCHEDULER_BUDGET = float(os.getenv("SCHEDULER_BUDGET_SECONDS", "30"))
+VALIDATION_BATCH = int(os.getenv("SCHEDULER_VALIDATION_BATCH", "200"))
+OVERDUE_RANK = 100000      # due_rank offset placing overdue invoices after upcoming ones
+
+# Seconds between runs; cheap engines often, expensive ones rarely
+DEFAULT_CADENCES = {
+    "invoice_validator": 60,
+    "three_way_match": 300,
+    "duplicate_detector": 60,
+    "feasibility_monitor": 300,
+    "velocity_detector": 300,
+    "cascade_detector": 300,
+    "dilution_monitor": 600,
+    "anomaly_detector": 900,
+    "graph_analytics": 3600,
+}
+CADENCES: Dict[str, float] = {**DEFAULT_CADENCES, **json.loads(os.getenv("SCHEDULER_CADENCES", "{}"))}
+
+
+def overdue(checkpoint: Optional[ScanCheckpoint], engine: str, now: datetime) -> float:
+    """Elapsed time since the last run as a multiple of the cadence (inf if never run)."""
+    if checkpoint is None or checkpoint.last_run_at is None:
+        return float("inf")
+    return (now - checkpoint.last_run_at).total_seconds() / CADENCES[engine]
+
+
+def due_rank(due_date, today: date):
+    """
+    Validation order key: days until an upcoming due date, or OVERDUE_RANK
+    plus days past due, so upcoming invoices come first and the longest
+    overdue last.  Works on a column or a plain date.
+    """
+    if isinstance(due_date, date):
+        days = (due_date - today).days
+        return days if days >= 0 else OVERDUE_RANK - days
+    return case((due_date >= today, due_date - today), else_=OVERDUE_RANK + (today - due_date))
+
+
+async def validate_by_due_date(db: AsyncSession, sink: FlagSink, deadline: float) -> int:
+    """
+    Validate pending invoices in `due_rank` order until `deadline`, resuming
+    from the cursor saved on the validator's checkpoint.  Each invoice is
+    validated at most once per cycle.
+    """
+    today = date.today()
+    rank = due_rank(Invoice.due_date, today)
+    cp = await db.get(ScanCheckpoint, "invoice_validator")
+    start = None
+    if cp is not None and cp.cursor_due_date is not None:
+        start = (due_rank(cp.cursor_due_date, today), cp.cursor_id)
+    # After the cursor, then wrap round from the top back up to it
+    laps = [(start, None)] + ([(None, start)] if start is not None else [])
+    cursor = None
+    validated = 0
+
+    for after, until in laps:
+        while time.monotonic() < deadline:
+            query = select(Invoice).where(Invoice.status == InvoiceStatus.pending)
+            if after is not None:
+                query = query.where(tuple_(rank, Invoice.id) > tuple_(*after))
+            if until is not None:
+                query = query.where(tuple_(rank, Invoice.id) <= tuple_(*until))
+            batch = (await db.execute(
+                query.order_by(rank, Invoice.id).limit(VALIDATION_BATCH)
+            )).scalars().all()
+            if not batch:
+                break
+            for inv in batch:
+                await sink.add(await validate_invoice(db, inv))
+                validated += 1
+                cursor = (inv.due_date, inv.id)
+                if time.monotonic() >= deadline:
+                    break
+            after = (due_rank(inv.due_date, today), inv.id)
+
+    if cursor is not None:
+        values = dict(cursor_due_date=cursor[0], cursor_id=cursor[1])
+        await db.execute(pg_insert(ScanCheckpoint).values(engine="invoice_validator", **values)
+                         .on_conflict_do_update(index_elements=[ScanCheckpoint.engine], set_=values))
+    return validated
+
+
+async def run_cycle() -> List[dict]:
+    """Run the engines that are due within one budget; returns what ran."""
+    ran: List[dict] = []
+    started = time.monotonic()
+    deadline = started + SCHEDULER_BUDGET
+
+    async with try_lock(SCAN_LOCK) as held:
+        if not held:
+            return ran
+        async with SessionLocal() as db:
+            now = datetime.utcnow()
+            checkpoints = await load_checkpoints(db)
+            due = sorted(
+                (e for e in ENGINES if overdue(checkpoints.get(e), e, now) >= 1),
+                key=lambda e: overdue(checkpoints.get(e), e, now),
+                reverse=True,
+            )
+            if not due:
+                return ran
+            marks = await current_marks(db)
+            snapshot = None
+
+            for engine in due:
+                remaining = deadline - time.monotonic()
+                checkpoint = checkpoints.get(engine)
+                expected = (checkpoint.last_duration_ms or 0) / 1000 if checkpoint else 0
+                if remaining <= 0 or (expected > remaining and overdue(checkpoint, engine, now) < 2):
+                    continue
+
+                sink = FlagSink(db)
+                t0 = time.perf_counter()
+                if engine == "invoice_validator":
+                    mode = "priority"
+                    await validate_by_due_date(db, sink, deadline)
+                else:
+                    scope = None
+                    if not needs_full_scan("auto", checkpoint):
+                        scope = await engine_scope(db, checkpoint, marks)
+                    mode = "full" if scope is None else "incremental"
+                    if snapshot is None and uses_snapshot(engine, scope):
+                        snapshot = await get_snapshot(db)
+                    await run_engine(db, engine, scope, sink, snapshot=snapshot)
+                    await save_checkpoints(db, marks, {engine: mode})
+                await sink.flush(commit=False)
+                duration_ms = (time.perf_counter() - t0) * 1000
+                await record_run(db, engine, duration_ms, sink.total)
+                await sink.commit()
+                ran.append({"engine": engine, "mode": mode, "flags": sink.total,
+                            "duration_ms": round(duration_ms, 1)})
+
+    if any(r["flags"] for r in ran):
+        await bump_data_version()
+    return ran
+
+
+async def scheduler_loop():
+    """Run scheduler cycles until cancelled."""
+    while True:
+        try:
+            ran = await run_cycle()
+            if ran:
+                logger.info("scheduler ran %s", ", ".join(f"{r['engine']}({r['mode']})" for r in ran))
+        except Exception:
+            logger.exception("scheduler cycle failed")
+        await asyncio.sleep(SCHEDULER_TICK)
+
+
+async def schedule_status(db: AsyncSession) -> dict:
+    """Cadence, last run and next due time per engine."""
+    checkpoints = await load_checkpoints(db)
+    engines = []
+    for engine in ENGINES:
+        cp = checkpoints.get(engine)
+        last_run = cp.last_run_at if cp else None
+        engines.append({
+            "engine": engine,
+            "cadence_seconds": CADENCES[engine],
+            "last_run_at": last_run,
+            "last_duration_ms": cp.last_duration_ms if cp else None,
+            "last_flags": cp.last_flags if cp else None,
+            "last_full_scan_at": cp.last_full_scan_at if cp else None,
+            "next_run_at": last_run + timedelta(seconds=CADENCES[engine]) if last_run else None,
+        })
+    return {
+        "enabled": SCHEDULER_ENABLED,
+        "tick_seconds": SCHEDULER_TICK,
+        "budget_seconds": SCHEDULER_BUDGET,
+        "engines": engines,
+    }
@@ -2,7 +2,7 @@
 
 from pydantic import BaseModel, Field
 from datetime import datetime, date
-from typing import Optional, List
+from typing import Dict, Optional, List
 from enum import Enum
 
 
@@ -29,6 +29,7 @@ class FraudTypeEnum(str, Enum):
     DILUTION = "dilution"
     VELOCITY_ANOMALY = "velocity_anomaly"
     CASCADE_FRAUD = "cascade_fraud"
+    ML_ANOMALY = "ml_anomaly"
 
 
 class SeverityEnum(str, Enum):
@@ -98,6 +99,81 @@ class InvoiceOut(BaseModel):
         from_attributes = True
 
 
+class IngestRowResult(BaseModel):
+    row: int
+    status: str  # accepted / rejected / error
+    invoice_id: Optional[int] = None
+    risk_score: Optional[float] = None
+    flags: List[str] = []
+    error: Optional[str] = None
+
+
+class IngestResult(BaseModel):
+    rows: int
+    accepted: int
+    rejected: int
+    errors: int
+    flagged: int
+    elapsed_ms: float
+    rows_per_second: float
+    results: List[IngestRowResult] = []
+
+
+# ── ERP ledger ──────────────────────────────────────────────────────
+class PurchaseOrderIn(BaseModel):
+    po_number: str
+    supplier_id: int
+    buyer_id: int
+    quantity: float = Field(gt=0)
+    unit_price: float = Field(gt=0)
+    amount: Optional[float] = Field(None, gt=0)  # defaults to quantity * unit_price
+    currency: str = "USD"
+    issue_date: date
+
+
+class GoodsReceiptIn(BaseModel):
+    grn_number: str
+    supplier_id: int
+    po_number: str
+    quantity: float = Field(ge=0)
+    received_date: date
+
+
+class ErpLoadRowResult(BaseModel):
+    row: int
+    status: str  # rejected / error
+    error: Optional[str] = None
+
+
+class ErpLoadResult(BaseModel):
+    rows: int
+    loaded: int
+    rejected: int
+    errors: int
+    elapsed_ms: float
+    rows_per_second: float
+    results: List[ErpLoadRowResult] = []
+
+
+class PrecheckFlag(BaseModel):
+    fraud_type: str
+    confidence: float
+    severity: str
+    description: Optional[str] = None
+    engine: Optional[str] = None
+    rule: str = ""
+
+
+class PrecheckResult(BaseModel):
+    fingerprint: str
+    risk_score: float
+    status: str  # flagged / pending – what create would decide
+    flags: List[PrecheckFlag] = []
+    supplier_risk_score: float = 0
+    buyer_risk_score: float = 0
+    elapsed_ms: float
+
+
 # ── Fraud Flag ──────────────────────────────────────────────────────
 class FraudFlagOut(BaseModel):
     id: int
@@ -107,6 +183,7 @@ class FraudFlagOut(BaseModel):
     severity: str
     description: Optional[str] = None
     engine: Optional[str] = None
+    rule: str = ""
     detected_at: datetime
 
     class Config:
@@ -179,3 +256,47 @@ class FraudScanResult(BaseModel):
     flags_raised: int
     flags: List[FraudFlagOut]
     summary: dict
+    mode: str = "full"
+    engine_modes: dict = {}  # engine -> full / incremental
+
+
+class ReplayRequest(BaseModel):
+    # parameter -> thresholds to try; omitted parameters keep their current value
+    grid: Dict[str, List[float]] = {}
+
+
+class ReplaySetting(BaseModel):
+    thresholds: Dict[str, float]
+    flagged_invoices: int
+    exposure: float
+    rule_flags: Dict[str, int]
+    true_positives: int
+    false_positives: int
+    precision: Optional[float] = None
+    recall: Optional[float] = None
+
+
+class ReplayResult(BaseModel):
+    invoices: int
+    labelled_fraud: int
+    labelled_legitimate: int
+    current: Dict[str, float]
+    settings: List[ReplaySetting]
+    elapsed_ms: float
+
+
+class ScanJobOut(BaseModel):
+    scan_id: str = Field(validation_alias="id")
+    status: str
+    mode: Optional[str] = None
+    chunked: bool = False
+    parallel: bool = False
+    progress: Optional[dict] = None
+    result: Optional[FraudScanResult] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
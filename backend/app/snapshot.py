@@ -0,0 +1,342 @@
+"""
+Columnar scan snapshot.
+
+Full scans used to materialise every invoice as an ORM object and walk them
+in Python.  Instead, the columns the engines need are held as NumPy arrays –
+one per column, row-aligned and sorted by id – and the engines' columnar
+kernels screen all rows with vectorized operations, only building objects
+for the few rows that are actually flagged.
+
+Invoices and cash collections are append-only, so a snapshot is topped up
+with rows past its highest id instead of being reloaded; a row count check
+catches ids that committed out of order (or a reset database) and forces a
+full reload.  Entities are small and mutable and are re-read on every
+refresh.  With SNAPSHOT_DIR set, the arrays are also saved there as .npy
+files and memory-mapped on the next start, so a restarted worker only
+fetches what arrived since.
+
+A published snapshot is never modified: `get_snapshot` refreshes a shallow
+copy under a lock and swaps it in, so a scan, the scheduler or a replay
+holding the previous generation – possibly in an executor thread – keeps
+a consistent set of columns.  Each saved generation goes to its own
+directory and `manifest.json`, naming it, is replaced last, so workers
+sharing SNAPSHOT_DIR never read columns from two generations.
+
+Columns are fetched with array_agg in batches of SNAPSHOT_BATCH rows, which
+asyncpg decodes straight into lists without per-row records.  Fingerprints
+are stored as the integer value of their first 15 hex digits (60 bits),
+enough to group duplicates without shipping the 64-character strings.
+"""
+
+import os
+import json
+import uuid
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Invoice
+
+logger = logging.getLogger(__name__)
+
+SCAN_SNAPSHOT = os.getenv("SCAN_SNAPSHOT", "1") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_BATCH = int(os.getenv("SNAPSHOT_BATCH", "1000000"))
+
+TIERS = {"tier_1": 1, "tier_2": 2, "tier_3": 3}
+TIER_NAMES = {code: name for name, code in TIERS.items()}
+
+INVOICE_COLUMNS = {
+    "id": np.int64,
+    "supplier_id": np.int64,
+    "buyer_id": np.int64,
+    "lender_id": np.int64,     # 0 when none
+    "amount": np.float64,
+    "day": np.int32,           # invoice_date as days since 1970-01-01
+    "tier": np.int8,           # TIERS code
+    "fingerprint": np.int64,   # fingerprint_code()
+    "cascade": np.int32,       # index into cascade_groups, -1 when none
+}
+COLLECTION_COLUMNS = {
+    "id": np.int64,
+    "invoice_id": np.int64,
+    "expected_amount": np.float64,
+    "collected_amount": np.float64,
+    "dilution_ratio": np.float64,
+}
+
+INVOICE_BATCH_SQL = text("""
+SELECT array_agg(id), array_agg(supplier_id), array_agg(buyer_id), array_agg(lender_id),
+       array_agg(amount), array_agg(day), array_agg(tier), array_agg(fingerprint),
+       array_agg(cascade_group)
+FROM (
+    SELECT id, supplier_id, buyer_id, COALESCE(lender_id, 0) AS lender_id, amount,
+           invoice_date - DATE '1970-01-01' AS day,
+           CASE tier WHEN 'tier_1' THEN 1 WHEN 'tier_2' THEN 2 WHEN 'tier_3' THEN 3 ELSE 0 END AS tier,
+           ('x' || substr(fingerprint, 1, 15))::bit(60)::bigint AS fingerprint,
+           cascade_group
+    FROM invoices
+    WHERE id > :after
+    ORDER BY id
+    LIMIT :batch
+) rows
+""")
+
+COLLECTION_BATCH_SQL = text("""
+SELECT array_agg(id), array_agg(invoice_id), array_agg(expected_amount),
+       array_agg(collected_amount), array_agg(dilution_ratio)
+FROM (
+    SELECT id, invoice_id, expected_amount, COALESCE(collected_amount, 0) AS collected_amount,
+           COALESCE(dilution_ratio, 0) AS dilution_ratio
+    FROM cash_collections
+    WHERE id > :after
+    ORDER BY id
+    LIMIT :batch
+) rows
+""")
+
+COUNT_SQL = text("""
+SELECT (SELECT count(*) FROM invoices WHERE id <= :invoice_max),
+       (SELECT count(*) FROM cash_collections WHERE id <= :collection_max)
+""")
+
+ENTITY_SQL = text("""
+SELECT id, name, entity_type, COALESCE(annual_revenue, 0), COALESCE(risk_score, 0)
+FROM entities ORDER BY id
+""")
+
+
+def fingerprint_code(fingerprint: str) -> int:
+    """Integer code stored for a fingerprint (matches INVOICE_BATCH_SQL)."""
+    return int(fingerprint[:15], 16)
+
+
+def group_bounds(sorted_codes: np.ndarray):
+    """Start index and length of every run of equal values in a sorted array."""
+    if not len(sorted_codes):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    return starts, np.diff(np.r_[starts, len(sorted_codes)])
+
+
+def _empty(columns: Dict[str, type]) -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in columns.items()}
+
+
+class Snapshot:
+    """Row-aligned column arrays for invoices, collections and entities."""
+
+    def __init__(self):
+        self._reset()
+        self.generation = 0     # bumped by every refresh
+        self.refreshed_at = 0.0
+
+    def copy(self) -> "Snapshot":
+        """A copy that can be refreshed without touching this one (arrays are shared)."""
+        snap = Snapshot.__new__(Snapshot)
+        snap.__dict__.update(self.__dict__)
+        snap.invoices = dict(self.invoices)
+        snap.collections = dict(self.collections)
+        snap.cascade_groups = list(self.cascade_groups)
+        snap._cascade_index = dict(self._cascade_index)
+        return snap
+
+    def _reset(self):
+        self.invoices = _empty(INVOICE_COLUMNS)
+        self.collections = _empty(COLLECTION_COLUMNS)
+        self.cascade_groups: List[str] = []
+        self._cascade_index: Dict[str, int] = {}
+        self.entity_ids = np.empty(0, dtype=np.int64)
+        self.entity_revenue = np.empty(0, dtype=np.float64)
+        self.entity_risk = np.empty(0, dtype=np.float64)
+        self.entity_is_supplier = np.empty(0, dtype=bool)
+        self.entity_names: Dict[int, str] = {}
+
+    # ── Lookups ──
+    @property
+    def invoice_max(self) -> int:
+        return int(self.invoices["id"][-1]) if len(self.invoices["id"]) else 0
+
+    @property
+    def collection_max(self) -> int:
+        return int(self.collections["id"][-1]) if len(self.collections["id"]) else 0
+
+    def invoice_positions(self, ids: np.ndarray) -> np.ndarray:
+        """Row index of each invoice id (ids must be present)."""
+        return np.searchsorted(self.invoices["id"], ids)
+
+    def _entity_values(self, values: np.ndarray, entity_ids: np.ndarray) -> np.ndarray:
+        if not len(self.entity_ids):
+            return np.zeros(len(entity_ids))
+        pos = np.clip(np.searchsorted(self.entity_ids, entity_ids), 0, len(self.entity_ids) - 1)
+        return np.where(self.entity_ids[pos] == entity_ids, values[pos], 0.0)
+
+    def revenue_of(self, entity_ids: np.ndarray) -> np.ndarray:
+        """Annual revenue per entity id, 0 for unknown ids."""
+        return self._entity_values(self.entity_revenue, entity_ids)
+
+    def risk_of(self, entity_ids: np.ndarray) -> np.ndarray:
+        """Graph risk score (0-100) per entity id, 0 for unknown ids."""
+        return self._entity_values(self.entity_risk, entity_ids)
+
+    def is_supplier(self, entity_ids: np.ndarray) -> np.ndarray:
+        if not len(self.entity_ids):
+            return np.zeros(len(entity_ids), dtype=bool)
+        pos = np.clip(np.searchsorted(self.entity_ids, entity_ids), 0, len(self.entity_ids) - 1)
+        return (self.entity_ids[pos] == entity_ids) & self.entity_is_supplier[pos]
+
+    # ── Loading ──
+    async def refresh(self, db: AsyncSession) -> bool:
+        """Top up from the database; returns whether anything changed."""
+        counts = (await db.execute(COUNT_SQL, {
+            "invoice_max": self.invoice_max, "collection_max": self.collection_max,
+        })).one()
+        if counts[0] != len(self.invoices["id"]) or counts[1] != len(self.collections["id"]):
+            if self.invoice_max or self.collection_max:
+                logger.info("scan snapshot out of step with the database; reloading")
+            self._reset()
+
+        # Collections before invoices, so every collection's invoice is loaded
+        changed = await self._append(db, COLLECTION_BATCH_SQL, self.collections, COLLECTION_COLUMNS)
+        changed |= await self._append(db, INVOICE_BATCH_SQL, self.invoices, INVOICE_COLUMNS)
+
+        rows = (await db.execute(ENTITY_SQL)).all()
+        self.entity_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.entity_revenue = np.array([r[3] for r in rows], dtype=np.float64)
+        self.entity_risk = np.array([r[4] for r in rows], dtype=np.float64)
+        self.entity_is_supplier = np.array([r[2] == "supplier" for r in rows], dtype=bool)
+        self.entity_names = {r[0]: r[1] for r in rows}
+        self.generation += 1
+        self.refreshed_at = time.monotonic()
+        return changed
+
+    async def _append(self, db: AsyncSession, sql, target: Dict[str, np.ndarray],
+                      columns: Dict[str, type]) -> bool:
+        parts: Dict[str, list] = {name: [target[name]] for name in columns}
+        after = int(target["id"][-1]) if len(target["id"]) else 0
+        while True:
+            row = (await db.execute(sql, {"after": after, "batch": SNAPSHOT_BATCH})).one()
+            if row[0] is None:
+                break
+            for name, values in zip(columns, row):
+                if name == "cascade":
+                    values = [self._cascade_code(g) for g in values]
+                parts[name].append(np.array(values, dtype=columns[name]))
+            after = row[0][-1]
+            if len(row[0]) < SNAPSHOT_BATCH:
+                break
+        if all(len(p) == 1 for p in parts.values()):
+            return False
+        for name in columns:
+            target[name] = np.concatenate(parts[name])
+        return True
+
+    def _cascade_code(self, group: Optional[str]) -> int:
+        if group is None:
+            return -1
+        code = self._cascade_index.get(group)
+        if code is None:
+            code = self._cascade_index[group] = len(self.cascade_groups)
+            self.cascade_groups.append(group)
+        return code
+
+    # ── Persistence ──
+    def save(self, directory: str) -> str:
+        """
+        Write every column as .npy into a new generation directory, then
+        point the manifest at it.  Returns the generation's directory name.
+        """
+        os.makedirs(directory, exist_ok=True)
+        generation = f"gen-{uuid.uuid4().hex[:12]}"
+        target = os.path.join(directory, generation)
+        os.makedirs(target)
+        for prefix, arrays in (("invoices", self.invoices), ("collections", self.collections)):
+            for name, array in arrays.items():
+                np.save(os.path.join(target, f"{prefix}.{name}.npy"), np.ascontiguousarray(array))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix="manifest.", suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump({
+                "generation": generation,
+                "invoices": len(self.invoices["id"]),
+                "collections": len(self.collections["id"]),
+                "cascade_groups": self.cascade_groups,
+            }, fh)
+        os.replace(tmp, os.path.join(directory, "manifest.json"))
+        return generation
+
+    @classmethod
+    def load(cls, directory: str) -> "Snapshot":
+        """Memory-map a saved snapshot; an incomplete one yields an empty snapshot."""
+        snap = cls()
+        try:
+            with open(os.path.join(directory, "manifest.json")) as fh:
+                manifest = json.load(fh)
+            source = os.path.join(directory, manifest["generation"])
+            invoices = {name: np.load(os.path.join(source, f"invoices.{name}.npy"), mmap_mode="r")
+                        for name in INVOICE_COLUMNS}
+            collections = {name: np.load(os.path.join(source, f"collections.{name}.npy"), mmap_mode="r")
+                           for name in COLLECTION_COLUMNS}
+        except (OSError, ValueError, KeyError):
+            return snap
+        if any(len(a) != manifest["invoices"] for a in invoices.values()) or \
+                any(len(a) != manifest["collections"] for a in collections.values()):
+            return snap
+        snap.invoices, snap.collections = invoices, collections
+        snap.cascade_groups = list(manifest["cascade_groups"])
+        snap._cascade_index = {g: i for i, g in enumerate(snap.cascade_groups)}
+        return snap
+
+
+_snapshot: Optional[Snapshot] = None
+_snapshot_lock = asyncio.Lock()
+_saved_generation: Optional[str] = None   # this process's last saved directory
+
+
+def _save(snap: Snapshot):
+    """Save `snap` and drop the generation this process saved before it."""
+    global _saved_generation
+    generation = snap.save(SNAPSHOT_DIR)
+    if _saved_generation:
+        # Workers that mapped it keep their mappings; a worker loading it
+        # right now falls back to a full reload
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, _saved_generation), ignore_errors=True)
+    _saved_generation = generation
+
+
+async def get_snapshot(db: AsyncSession, max_age: Optional[float] = None) -> Snapshot:
+    """
+    This process's snapshot, brought up to date (and saved if SNAPSHOT_DIR
+    is set).  The returned generation is never modified afterwards.  With
+    `max_age`, a generation refreshed at most that many seconds ago is
+    returned as it is.
+    """
+    global _snapshot
+    async with _snapshot_lock:
+        current = _snapshot
+        if current is not None and max_age is not None \
+                and time.monotonic() - current.refreshed_at <= max_age:
+            return current
+        if current is None:
+            current = Snapshot.load(SNAPSHOT_DIR) if SNAPSHOT_DIR else Snapshot()
+        snap = current.copy()
+        if await snap.refresh(db):
+            if SNAPSHOT_DIR:
+                _save(snap)
+        _snapshot = snap
+        return snap
+
+
+async def invoice_numbers(db: AsyncSession, ids: Iterable[int]) -> Dict[int, str]:
+    """Invoice numbers for the (few) rows a columnar kernel flags."""
+    ids = list({int(i) for i in ids})
+    if not ids:
+        return {}
+    rows = (await db.execute(select(Invoice.id, Invoice.invoice_number).where(Invoice.id.in_(ids)))).all()
+    return {r.id: r.invoice_number for r in rows}
@@ -0,0 +1,62 @@
+"""Small in-process LRU cache with per-entry expiry."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Least-recently-used mapping whose entries expire `ttl` seconds after
+    being set.  Not shared between processes; callers invalidate explicitly
+    when they know the underlying rows changed.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """Split `keys` into cached values and the keys still to be loaded."""
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            value = self.get(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def invalidate(self, keys: Iterable[Hashable] = None):
+        """Drop the given keys, or everything when none are given."""
+        if keys is None:
+            self._data.clear()
+            return
+        for key in keys:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses}
@@ -1,50 +1,308 @@
-"""WebSocket endpoint for real-time fraud alerts."""
+"""
+WebSocket endpoint for real-time fraud alerts.
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List
+Broadcasting never waits on a socket: each message is serialized once and
+pushed into every client's bounded queue, which a per-client sender task
+drains.  A client whose queue fills up (or whose send stalls past
+WS_SEND_TIMEOUT_SECONDS) is disconnected instead of holding up the others.
+
+Events are published on the cross-worker bus (`app.pubsub`); every worker's
+`event_subscriber` task delivers them to its own clients, so an alert raised
+in one uvicorn worker reaches sockets connected to any of them.
+
+Clients may narrow the alert stream with server-side filters (severity,
+fraud_type, entity_ids) given as query parameters or in a `subscribe`
+message.  Every event carries a cluster-wide `seq`; each worker keeps the
+last WS_REPLAY_SIZE events, so a client reconnecting with `last_seq`
+receives what it missed instead of reloading /api/alerts.
+"""
+
+import os
 import json
 import asyncio
+import logging
+from collections import deque
+from typing import Dict, Iterable, Mapping, Optional, Set
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from app.pubsub import next_sequence, publish, run_subscriber
+
+logger = logging.getLogger(__name__)
 
 ws_router = APIRouter()
 
-# Active WebSocket connections
-active_connections: List[WebSocket] = []
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_REPLAY_SIZE = int(os.getenv("WS_REPLAY_SIZE", "1000"))
+
+ALERT_EVENTS = ("alert", "alert_batch")
+
+
+def _as_set(value, cast=str) -> Optional[Set]:
+    """Accept a list or a comma-separated string; None/empty means no filter."""
+    if value is None or value == "":
+        return None
+    items = value.split(",") if isinstance(value, str) else value
+    return {cast(v) for v in items if str(v).strip() != ""} or None
+
+
+class Subscription:
+    """Server-side alert filter; an empty filter matches everything."""
+
+    def __init__(self, severity: Optional[Iterable] = None, fraud_type: Optional[Iterable] = None,
+                 entity_ids: Optional[Iterable] = None):
+        self.severity = _as_set(severity)
+        self.fraud_type = _as_set(fraud_type)
+        self.entity_ids = _as_set(entity_ids, int)
+
+    @classmethod
+    def from_params(cls, params: Mapping) -> "Subscription":
+        return cls(params.get("severity"), params.get("fraud_type"), params.get("entity_ids"))
+
+    @classmethod
+    def parse(cls, params: Mapping) -> Optional["Subscription"]:
+        """`from_params`, or None if a filter value is malformed (e.g. entity_ids=abc)."""
+        try:
+            return cls.from_params(params)
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def is_all(self) -> bool:
+        return not (self.severity or self.fraud_type or self.entity_ids)
+
+    def matches(self, alert: dict) -> bool:
+        if self.severity and alert.get("severity") not in self.severity:
+            return False
+        if self.fraud_type and alert.get("fraud_type") not in self.fraud_type:
+            return False
+        if self.entity_ids:
+            related = _as_set(alert.get("related_entity_ids"), int) or set()
+            if not related & self.entity_ids:
+                return False
+        return True
+
+    def describe(self) -> dict:
+        return {
+            "severity": sorted(self.severity or []),
+            "fraud_type": sorted(self.fraud_type or []),
+            "entity_ids": sorted(self.entity_ids or []),
+        }
+
+
+def _render(event: dict, text: str, subscription: Subscription, cache: dict) -> Optional[str]:
+    """
+    The text to send a client for `event`, or None if its filter rejects it.
+    Identical filtered views of one event are serialized once via `cache`.
+    """
+    if subscription.is_all or event.get("type") not in ALERT_EVENTS:
+        return text
+    if event["type"] == "alert":
+        return text if subscription.matches(event.get("data") or {}) else None
+
+    alerts = (event.get("data") or {}).get("alerts", [])
+    keep = tuple(i for i, a in enumerate(alerts) if subscription.matches(a))
+    if not keep:
+        return None
+    if len(keep) == len(alerts):
+        return text
+    if keep not in cache:
+        cache[keep] = json.dumps({**event, "data": {**event["data"], "alerts": [alerts[i] for i in keep]}})
+    return cache[keep]
+
+
+class Client:
+    """One connected socket with its outbound queue and sender task."""
+
+    def __init__(self, websocket: WebSocket, subscription: Subscription):
+        self.websocket = websocket
+        self.subscription = subscription
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+
+    async def send_loop(self, manager: "ConnectionManager"):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=WS_SEND_TIMEOUT)
+                manager.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Stalled or broken socket – drop it rather than retry
+            await manager.disconnect(self, close=True)
+
+
+class ConnectionManager:
+    """Registry of connected clients with non-blocking fan-out."""
+
+    def __init__(self):
+        self.clients: Dict[int, Client] = {}
+        self.broadcasts = 0
+        self.sent = 0
+        self.dropped = 0
+        self._closing = set()
+        self.history: deque = deque(maxlen=WS_REPLAY_SIZE)  # (seq, event, text)
+
+    async def connect(self, websocket: WebSocket, subscription: Subscription) -> Client:
+        await websocket.accept()
+        client = Client(websocket, subscription)
+        self.clients[id(websocket)] = client
+        client.sender = asyncio.create_task(client.send_loop(self))
+        return client
+
+    async def disconnect(self, client: Client, close: bool = False):
+        if self.clients.pop(id(client.websocket), None) is None:
+            return
+        if client.sender and client.sender is not asyncio.current_task():
+            client.sender.cancel()
+        if close:
+            try:
+                await client.websocket.close(code=1013)  # try again later
+            except Exception:
+                pass
+
+    def send(self, client: Client, text: str) -> bool:
+        """Queue `text` for one client; a full queue disconnects it."""
+        try:
+            client.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("disconnecting slow websocket client (%d queued)", client.queue.qsize())
+            task = asyncio.create_task(self.disconnect(client, close=True))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            return False
+
+    def broadcast(self, text: str):
+        """
+        Record a serialized bus event and enqueue it for every local client
+        whose filter accepts it, without awaiting any socket.
+        """
+        event = json.loads(text)
+        if event.get("seq") is not None:
+            self.history.append((event["seq"], event, text))
+        self.broadcasts += 1
+        cache: dict = {}
+        for client in list(self.clients.values()):
+            out = _render(event, text, client.subscription, cache)
+            if out is not None:
+                self.send(client, out)
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self.history[-1][0] if self.history else None
+
+    def replay(self, client: Client, last_seq: int):
+        """Queue the buffered events after `last_seq` that pass the client's filter."""
+        if self.history and self.history[0][0] > last_seq + 1:
+            # Part of the gap has already left the buffer
+            self.send(client, json.dumps({"type": "replay_gap", "data": {
+                "last_seq": last_seq, "oldest_seq": self.history[0][0],
+            }}))
+        for seq, event, text in list(self.history):
+            if seq > last_seq:
+                out = _render(event, text, client.subscription, {})
+                if out is not None and not self.send(client, out):
+                    return
+
+    def metrics(self) -> dict:
+        depths = [c.queue.qsize() for c in self.clients.values()]
+        return {
+            "connections": len(self.clients),
+            "queue_capacity": WS_QUEUE_SIZE,
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "broadcasts": self.broadcasts,
+            "messages_sent": self.sent,
+            "dropped_clients": self.dropped,
+            "replay_buffer": len(self.history),
+            "last_seq": self.last_seq,
+        }
+
+
+manager = ConnectionManager()
 
 
 @ws_router.websocket("/ws/alerts")
 async def websocket_alerts(websocket: WebSocket):
-    """WebSocket endpoint for real-time alert streaming."""
-    await websocket.accept()
-    active_connections.append(websocket)
+    """
+    WebSocket endpoint for real-time alert streaming.
+    Optional query parameters: severity, fraud_type, entity_ids (comma
+    separated) and last_seq to resume.  A client can later send
+    {"action": "subscribe", ...} with the same keys to change its filter.
+    Malformed filters close the handshake with 1008 (policy violation), or
+    get an error frame when sent in a subscribe message.
+    """
+    params = websocket.query_params
+    subscription = Subscription.parse(params)
+    if subscription is None:
+        await websocket.close(code=1008, reason="Invalid filter")
+        return
+    client = await manager.connect(websocket, subscription)
 
-    try:
-        # Send welcome message
-        await websocket.send_json({
-            "type": "connection",
-            "message": "Connected to IntelliTrace Alert Stream",
-            "active_connections": len(active_connections),
-        })
+    # Send welcome message
+    manager.send(client, json.dumps({
+        "type": "connection",
+        "message": "Connected to IntelliTrace Alert Stream",
+        "active_connections": len(manager.clients),
+        "seq": manager.last_seq,
+        "filters": client.subscription.describe(),
+    }))
+    if params.get("last_seq", "").isdigit():
+        manager.replay(client, int(params["last_seq"]))
 
+    try:
         while True:
             # Keep connection alive, listen for client messages
             data = await websocket.receive_text()
             if data == "ping":
-                await websocket.send_json({"type": "pong"})
-    except WebSocketDisconnect:
-        active_connections.remove(websocket)
+                manager.send(client, json.dumps({"type": "pong"}))
+                continue
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("action") == "subscribe":
+                subscription = Subscription.parse(message)
+                if subscription is None:
+                    manager.send(client, json.dumps({"type": "error", "message": "Invalid filter"}))
+                    continue
+                client.subscription = subscription
+                manager.send(client, json.dumps({
+                    "type": "subscribed",
+                    "seq": manager.last_seq,
+                    "filters": client.subscription.describe(),
+                }))
+                if isinstance(message.get("last_seq"), int):
+                    manager.replay(client, message["last_seq"])
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await manager.disconnect(client)
+
+
+@ws_router.get("/api/ws/metrics")
+async def websocket_metrics():
+    """Connection count, queue depths and drop counters for the alert stream."""
+    return manager.metrics()
 
 
 async def broadcast_alert(alert_data: dict):
     """Broadcast an alert to all connected clients."""
-    disconnected = []
-    for ws in active_connections:
-        try:
-            await ws.send_json({
-                "type": "alert",
-                "data": alert_data,
-            })
-        except Exception:
-            disconnected.append(ws)
+    await broadcast_event("alert", alert_data)
+
+
+async def broadcast_event(event_type: str, data: dict):
+    """Broadcast a typed event (alert, scan_progress, ...) to all connected clients."""
+    text = json.dumps({"seq": await next_sequence(), "type": event_type, "data": data}, default=str)
+    if not await publish(text):
+        # Bus unavailable – at least reach this worker's clients
+        manager.broadcast(text)
+
 
-    for ws in disconnected:
-        active_connections.remove(ws)
+async def event_subscriber():
+    """Deliver bus events to this worker's clients until cancelled."""
+    await run_subscriber(manager.broadcast)
@@ -0,0 +1,263 @@
+"""
+Columnar kernels must raise exactly the flags the row-wise engines raise.
+
+Each test builds one synthetic ledger, loads it into a Snapshot the way
+INVOICE_BATCH_SQL / COLLECTION_BATCH_SQL would, and compares the kernel's
+flags with the engine's row-wise path: the same flag builders fed the rows
+the engine's queries return, grouped and ordered as the engine does.
+"""
+
+import asyncio
+import hashlib
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.models import Tier
+from app.snapshot import (
+    COLLECTION_COLUMNS, INVOICE_COLUMNS, TIERS, Snapshot, fingerprint_code,
+)
+from app.engines.duplicate_detector import detect_duplicates_columnar, duplicate_group_flags
+from app.engines.feasibility_monitor import (
+    FEASIBILITY_CEILINGS, detect_infeasible_volume_columnar, rolling_feasibility_flags,
+)
+from app.engines.velocity_detector import (
+    SAME_DAY_MIN_AMOUNT, detect_velocity_anomalies_columnar, velocity_flags,
+)
+from app.engines.cascade_detector import cascade_flags, detect_cascade_fraud_columnar
+from app.engines.dilution_monitor import DILUTION_THRESHOLD, detect_dilution_columnar, dilution_flag
+
+EPOCH = date(1970, 1, 1)
+SUPPLIERS = range(1, 9)
+BUYERS = range(9, 13)
+LENDERS = (13, 14)
+
+
+# ── Synthetic ledger ────────────────────────────────────────────────
+def _fingerprint(rng: random.Random) -> str:
+    return hashlib.sha256(str(rng.random()).encode()).hexdigest()
+
+
+def build_ledger(seed: int):
+    rng = random.Random(seed)
+    entities = {}
+    for i in SUPPLIERS:
+        # Supplier 1 has no revenue on file; 2 and 3 are small for their volume
+        revenue = 0.0 if i == 1 else (400_000.0 if i in (2, 3) else 50_000_000.0)
+        entities[i] = SimpleNamespace(id=i, name=f"Supplier {i}", entity_type="supplier", annual_revenue=revenue)
+    for i in BUYERS:
+        entities[i] = SimpleNamespace(id=i, name=f"Buyer {i}", entity_type="buyer", annual_revenue=0.0)
+    for i in LENDERS:
+        entities[i] = SimpleNamespace(id=i, name=f"Lender {i}", entity_type="lender", annual_revenue=0.0)
+
+    invoices = []
+
+    def add(supplier_id, amount, day, tier=None, fingerprint=None, lender_id=None, cascade_group=None):
+        invoice_id = len(invoices) + 1
+        invoices.append(SimpleNamespace(
+            id=invoice_id,
+            invoice_number=f"INV-{invoice_id:05d}",
+            supplier_id=supplier_id,
+            buyer_id=rng.choice(BUYERS),
+            lender_id=lender_id if lender_id is not None else rng.choice(LENDERS + (None,)),
+            amount=float(round(amount)),   # whole dollars: window sums are exact either way
+            invoice_date=date(2024, 1, 1) + timedelta(days=day),
+            tier=tier or rng.choice(list(Tier)),
+            fingerprint=fingerprint or _fingerprint(rng),
+            cascade_group=cascade_group,
+        ))
+        return invoices[-1]
+
+    # Ordinary trading, with same-day repeats and large amounts mixed in
+    for _ in range(400):
+        add(rng.choice(SUPPLIERS), rng.lognormvariate(10.5, 1.0), rng.randrange(0, 400))
+    for _ in range(30):
+        base = rng.choice(invoices)
+        add(base.supplier_id, rng.uniform(0.5, 2) * SAME_DAY_MIN_AMOUNT, (base.invoice_date - date(2024, 1, 1)).days)
+
+    # Duplicates: re-submitted fingerprints, some with another lender
+    for _ in range(15):
+        base = rng.choice(invoices)
+        add(base.supplier_id, base.amount, rng.randrange(0, 400), base.tier, base.fingerprint,
+            lender_id=rng.choice(LENDERS))
+
+    # Cascade groups, some multiplying exposure down the tiers
+    for g in range(20):
+        group = f"CG-{g:03d}"
+        root = rng.uniform(10_000, 200_000)
+        factor = rng.choice([0.3, 0.5, 1.0, 1.5, 2.5])
+        tiers = rng.sample(list(Tier), rng.randint(1, 3))
+        for tier in tiers:
+            for _ in range(rng.randint(1, 2)):
+                add(rng.choice(SUPPLIERS), root * (factor if tier != tiers[0] else 1.0),
+                    rng.randrange(0, 400), tier, cascade_group=group)
+
+    # A supplier whose last invoices spike far above its history
+    for day in (395, 397, 399):
+        add(4, 5_000_000.0, day)
+
+    collections = []
+    for inv in rng.sample(invoices, 120):
+        ratio = round(rng.choice([0.0, 0.05, 0.1, 0.25, 0.4, 0.6]) + rng.random() * 0.05, 4)
+        collections.append(SimpleNamespace(
+            id=len(collections) + 1, invoice_id=inv.id, expected_amount=inv.amount,
+            collected_amount=round(inv.amount * (1 - ratio), 2), dilution_ratio=ratio,
+        ))
+    return SimpleNamespace(entities=entities, invoices=invoices, collections=collections)
+
+
+def build_snapshot(ledger) -> Snapshot:
+    """The snapshot `Snapshot.refresh` would load for this ledger."""
+    snap = Snapshot()
+    invoices = sorted(ledger.invoices, key=lambda i: i.id)
+    values = {
+        "id": [i.id for i in invoices],
+        "supplier_id": [i.supplier_id for i in invoices],
+        "buyer_id": [i.buyer_id for i in invoices],
+        "lender_id": [i.lender_id or 0 for i in invoices],
+        "amount": [i.amount for i in invoices],
+        "day": [(i.invoice_date - EPOCH).days for i in invoices],
+        "tier": [TIERS[i.tier.value] for i in invoices],
+        "fingerprint": [fingerprint_code(i.fingerprint) for i in invoices],
+        "cascade": [snap._cascade_code(i.cascade_group) for i in invoices],
+    }
+    snap.invoices = {name: np.array(values[name], dtype=dtype) for name, dtype in INVOICE_COLUMNS.items()}
+    snap.collections = {
+        name: np.array([getattr(c, name) for c in ledger.collections], dtype=dtype)
+        for name, dtype in COLLECTION_COLUMNS.items()
+    }
+    entities = sorted(ledger.entities.values(), key=lambda e: e.id)
+    snap.entity_ids = np.array([e.id for e in entities], dtype=np.int64)
+    snap.entity_revenue = np.array([e.annual_revenue for e in entities])
+    snap.entity_risk = np.zeros(len(entities))
+    snap.entity_is_supplier = np.array([e.entity_type == "supplier" for e in entities])
+    snap.entity_names = {e.id: e.name for e in entities}
+    return snap
+
+
+class _Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return self
+
+
+class FakeSession:
+    """Answers the invoice-number lookups from the ledger."""
+
+    def __init__(self, ledger):
+        self.numbers = [SimpleNamespace(id=i.id, invoice_number=i.invoice_number) for i in ledger.invoices]
+
+    async def execute(self, statement, params=None):
+        if "invoice_number" in str(statement):
+            return _Result(self.numbers)
+        return _Result([])
+
+
+def flag_keys(flags):
+    return sorted(
+        (f.invoice_id, f.engine, f.rule, f.fraud_type, round(f.confidence, 9), f.severity, f.description)
+        for f in flags
+    )
+
+
+def run_kernel(kernel, ledger):
+    return asyncio.run(kernel(FakeSession(ledger), build_snapshot(ledger)))
+
+
+@pytest.fixture(params=[1, 2, 3])
+def ledger(request):
+    return build_ledger(request.param)
+
+
+# ── Row-wise paths (as the ORM engines group and order their rows) ──
+def row_wise_duplicates(ledger):
+    groups = defaultdict(list)
+    for inv in sorted(ledger.invoices, key=lambda i: i.id):
+        groups[inv.fingerprint].append(inv)
+    flags = []
+    for group in groups.values():
+        if len(group) > 1:
+            flags.extend(duplicate_group_flags(group))
+    return flags
+
+
+def row_wise_feasibility(ledger):
+    """ROLLING_VOLUME_SQL's windows, summed by brute force."""
+    rows = []
+    for inv in ledger.invoices:
+        supplier = ledger.entities[inv.supplier_id]
+        if supplier.annual_revenue <= 0:
+            continue
+        volumes = {
+            days: sum(o.amount for o in ledger.invoices if o.supplier_id == inv.supplier_id
+                      and inv.invoice_date - timedelta(days=days - 1) <= o.invoice_date <= inv.invoice_date)
+            for days in FEASIBILITY_CEILINGS
+        }
+        if any(volumes[d] > supplier.annual_revenue * share for d, share in FEASIBILITY_CEILINGS.items()):
+            rows.append(SimpleNamespace(
+                id=inv.id, invoice_number=inv.invoice_number, supplier_name=supplier.name,
+                annual_revenue=supplier.annual_revenue, **{f"vol_{d}": v for d, v in volumes.items()},
+            ))
+    return rolling_feasibility_flags(rows)
+
+
+def row_wise_velocity(ledger):
+    flags = []
+    for supplier in ledger.entities.values():
+        if supplier.entity_type != "supplier":
+            continue
+        invoices = sorted((i for i in ledger.invoices if i.supplier_id == supplier.id),
+                          key=lambda i: (i.invoice_date, i.id))
+        flags.extend(velocity_flags(supplier.name, invoices))
+    return flags
+
+
+def row_wise_cascades(ledger):
+    groups = defaultdict(list)
+    for inv in sorted(ledger.invoices, key=lambda i: (i.cascade_group or "", i.tier.value, i.id)):
+        if inv.cascade_group:
+            groups[inv.cascade_group].append(inv)
+    flags = []
+    for group_id, group in groups.items():
+        flags.extend(cascade_flags(group_id, group))
+    return flags
+
+
+def row_wise_dilution(ledger):
+    invoices = {i.id: i for i in ledger.invoices}
+    return [
+        dilution_flag(c, invoices[c.invoice_id].invoice_number,
+                      ledger.entities[invoices[c.invoice_id].supplier_id].name)
+        for c in ledger.collections if c.dilution_ratio > DILUTION_THRESHOLD
+    ]
+
+
+# ── Parity ──────────────────────────────────────────────────────────
+@pytest.mark.parametrize("kernel, row_wise", [
+    (detect_duplicates_columnar, row_wise_duplicates),
+    (detect_infeasible_volume_columnar, row_wise_feasibility),
+    (detect_velocity_anomalies_columnar, row_wise_velocity),
+    (detect_cascade_fraud_columnar, row_wise_cascades),
+    (detect_dilution_columnar, row_wise_dilution),
+], ids=["duplicate", "feasibility", "velocity", "cascade", "dilution"])
+def test_columnar_kernel_matches_row_wise(ledger, kernel, row_wise):
+    expected = row_wise(ledger)
+    assert expected, "the ledger should trip every rule"
+    assert flag_keys(run_kernel(kernel, ledger)) == flag_keys(expected)
+
+
+def test_empty_snapshot_raises_nothing():
+    ledger = SimpleNamespace(entities={}, invoices=[], collections=[])
+    for kernel in (detect_duplicates_columnar, detect_infeasible_volume_columnar,
+                   detect_velocity_anomalies_columnar, detect_cascade_fraud_columnar,
+                   detect_dilution_columnar):
+        assert run_kernel(kernel, ledger) == []
@@ -0,0 +1,97 @@
+"""Running pair statistics: batch merge, removal and the quantile sketch."""
+
+import math
+import random
+import statistics
+
+import pytest
+
+from app.pair_stats import EMPTY, PAIR_SKETCH_ACCURACY, PairStats
+
+
+def _amounts(n, seed):
+    rng = random.Random(seed)
+    return [round(rng.lognormvariate(10, 1.2), 2) for _ in range(n)]
+
+
+def _assert_matches(stats: PairStats, amounts):
+    assert stats.count == len(amounts)
+    assert stats.mean == pytest.approx(statistics.fmean(amounts), rel=1e-9)
+    assert stats.std == pytest.approx(statistics.stdev(amounts), rel=1e-9)
+    assert sum(stats.sketch.values()) == len(amounts)
+
+
+@pytest.mark.parametrize("split", [1, 7, 250, 499])
+def test_merge_matches_whole_batch(split):
+    amounts = _amounts(500, seed=split)
+    merged = PairStats.of(amounts[:split]).merge(PairStats.of(amounts[split:]))
+    _assert_matches(merged, amounts)
+    assert merged.sketch == PairStats.of(amounts).sketch
+
+
+def test_merge_many_batches_in_sequence():
+    amounts = _amounts(1000, seed=1)
+    stats = EMPTY
+    for start in range(0, len(amounts), 37):
+        stats = stats.merge(PairStats.of(amounts[start:start + 37]))
+    _assert_matches(stats, amounts)
+
+
+def test_merge_with_empty_is_identity():
+    stats = PairStats.of([100.0, 200.0, 400.0])
+    assert stats.merge(EMPTY) == stats
+    assert EMPTY.merge(stats) == stats
+
+
+def test_without_removes_one_invoice():
+    amounts = _amounts(200, seed=2)
+    stats = PairStats.of(amounts)
+    for i in (0, 57, 199):
+        rest = amounts[:i] + amounts[i + 1:]
+        removed = stats.without(amounts[i])
+        _assert_matches(removed, rest)
+        assert removed.sketch == PairStats.of(rest).sketch
+
+
+@pytest.mark.parametrize("split", [1, 50, 198])
+def test_remove_takes_a_batch_back_out(split):
+    amounts = _amounts(200, seed=split)
+    removed = PairStats.of(amounts).remove(PairStats.of(amounts[:split]))
+    _assert_matches(removed, amounts[split:])
+    assert removed.sketch == PairStats.of(amounts[split:]).sketch
+
+
+def test_remove_everything_is_empty():
+    amounts = _amounts(20, seed=4)
+    assert PairStats.of(amounts).remove(PairStats.of(amounts)) == EMPTY
+
+
+def test_tight_pair_keeps_its_variance():
+    """Large, nearly equal amounts: a one-pass SUM(x²) - SUM(x)²/n would lose this."""
+    amounts = [5_000_000.0 + i * 0.01 for i in range(1000)]
+    stats = EMPTY
+    for start in range(0, len(amounts), 100):
+        stats = stats.merge(PairStats.of(amounts[start:start + 100]))
+    assert stats.std == pytest.approx(statistics.stdev(amounts), rel=1e-6)
+
+
+def test_without_last_invoice_is_empty():
+    assert PairStats.of([1234.5]).without(1234.5) == EMPTY
+
+
+def test_from_row_accepts_json_sketch():
+    stats = PairStats.from_row(2, 150.0, 5000.0, '{"10": 1, "11": 1}')
+    assert stats.sketch == {10: 1, 11: 1}
+    assert stats.std == pytest.approx(math.sqrt(5000.0))
+
+
+@pytest.mark.parametrize("q", [0.0, 0.1, 0.5, 0.9, 0.99, 1.0])
+def test_quantile_within_sketch_accuracy(q):
+    amounts = sorted(_amounts(5000, seed=3))
+    exact = amounts[math.floor(q * (len(amounts) - 1))]
+    estimate = PairStats.of(amounts).quantile(q)
+    assert abs(estimate - exact) <= PAIR_SKETCH_ACCURACY * exact * (1 + 1e-9)
+
+
+def test_quantile_of_empty_is_none():
+    assert EMPTY.quantile(0.5) is None
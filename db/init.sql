@@ -8,7 +8,8 @@ CREATE TYPE tier_enum AS ENUM ('tier_1', 'tier_2', 'tier_3');
 CREATE TYPE invoice_status_enum AS ENUM ('pending', 'validated', 'flagged', 'rejected', 'financed');
 CREATE TYPE fraud_type_enum AS ENUM (
     'phantom_invoice', 'duplicate_financing', 'over_invoicing',
-    'carousel_trade', 'dilution', 'velocity_anomaly', 'cascade_fraud'
+    'carousel_trade', 'dilution', 'velocity_anomaly', 'cascade_fraud',
+    'ml_anomaly'
 );
 CREATE TYPE alert_severity_enum AS ENUM ('low', 'medium', 'high', 'critical');
 CREATE TYPE alert_status_enum AS ENUM ('open', 'investigating', 'resolved', 'dismissed');
@@ -52,6 +53,10 @@ CREATE TABLE IF NOT EXISTS invoices (
 
 CREATE INDEX IF NOT EXISTS ix_invoice_fingerprint ON invoices(fingerprint);
 CREATE INDEX IF NOT EXISTS ix_invoice_supplier_date ON invoices(supplier_id, invoice_date);
+DROP INDEX IF EXISTS ix_invoice_risk_id;
+CREATE INDEX IF NOT EXISTS ix_invoice_risk_key ON invoices((COALESCE(risk_score, 0)), id);
+CREATE INDEX IF NOT EXISTS ix_invoice_created_id ON invoices(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_invoice_supplier_po ON invoices(supplier_id, po_number);
 
 -- Fraud Flags
 CREATE TABLE IF NOT EXISTS fraud_flags (
@@ -62,10 +67,14 @@ CREATE TABLE IF NOT EXISTS fraud_flags (
     severity alert_severity_enum DEFAULT 'medium',
     description TEXT,
     engine VARCHAR(100),
+    rule VARCHAR(50) NOT NULL DEFAULT '',
     detected_at TIMESTAMP DEFAULT NOW(),
     resolved BOOLEAN DEFAULT FALSE
 );
 
+CREATE INDEX IF NOT EXISTS ix_fraud_flag_confidence_id ON fraud_flags(confidence, id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_fraud_flag_natural_key ON fraud_flags(invoice_id, fraud_type, engine, rule);
+
 -- Alerts
 CREATE TABLE IF NOT EXISTS alerts (
     id SERIAL PRIMARY KEY,
@@ -81,6 +90,8 @@ CREATE TABLE IF NOT EXISTS alerts (
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE INDEX IF NOT EXISTS ix_alert_created_id ON alerts(created_at, id);
+
 -- Cash Collections (for dilution monitoring)
 CREATE TABLE IF NOT EXISTS cash_collections (
     id SERIAL PRIMARY KEY,
@@ -92,6 +103,8 @@ CREATE TABLE IF NOT EXISTS cash_collections (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE INDEX IF NOT EXISTS ix_collection_created_id ON cash_collections(created_at, id);
+
 -- Supply Chain Edges (for graph analytics)
 CREATE TABLE IF NOT EXISTS supply_chain_edges (
     id SERIAL PRIMARY KEY,
@@ -106,3 +119,83 @@ CREATE TABLE IF NOT EXISTS supply_chain_edges (
     risk_score FLOAT DEFAULT 0.0,
     UNIQUE(source_id, target_id)
 );
+
+-- ERP ledger: purchase orders and goods receipts (bulk-loaded from extracts)
+CREATE TABLE IF NOT EXISTS purchase_orders (
+    id SERIAL PRIMARY KEY,
+    po_number VARCHAR(100) NOT NULL,
+    supplier_id INTEGER NOT NULL REFERENCES entities(id),
+    buyer_id INTEGER NOT NULL REFERENCES entities(id),
+    quantity FLOAT NOT NULL,
+    unit_price FLOAT NOT NULL,
+    amount FLOAT NOT NULL,
+    currency VARCHAR(10) DEFAULT 'USD',
+    issue_date DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_purchase_order_number UNIQUE (supplier_id, po_number)
+);
+
+CREATE INDEX IF NOT EXISTS ix_purchase_order_buyer ON purchase_orders(buyer_id);
+
+CREATE TABLE IF NOT EXISTS goods_receipts (
+    id SERIAL PRIMARY KEY,
+    grn_number VARCHAR(100) NOT NULL,
+    supplier_id INTEGER NOT NULL REFERENCES entities(id),
+    po_number VARCHAR(100) NOT NULL,
+    quantity FLOAT NOT NULL,
+    received_date DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_goods_receipt_number UNIQUE (supplier_id, grn_number)
+);
+
+CREATE INDEX IF NOT EXISTS ix_goods_receipt_po ON goods_receipts(supplier_id, po_number);
+
+-- Running amount statistics per supplier-buyer pair (trigger-maintained)
+CREATE TABLE IF NOT EXISTS pair_amount_stats (
+    supplier_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    mean FLOAT NOT NULL DEFAULT 0,
+    m2 FLOAT NOT NULL DEFAULT 0,
+    sketch JSONB NOT NULL DEFAULT '{}',
+    PRIMARY KEY (supplier_id, buyer_id)
+);
+
+-- Background scan jobs
+CREATE TABLE IF NOT EXISTS scan_jobs (
+    id VARCHAR(36) PRIMARY KEY,
+    status VARCHAR(20) DEFAULT 'queued',
+    mode VARCHAR(20) DEFAULT 'auto',
+    chunked BOOLEAN DEFAULT FALSE,
+    parallel BOOLEAN DEFAULT FALSE,
+    progress JSON,
+    result JSON,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_scan_job_status_created ON scan_jobs(status, created_at);
+
+-- Per-engine high-water marks for incremental scans
+CREATE TABLE IF NOT EXISTS scan_checkpoints (
+    engine VARCHAR(100) PRIMARY KEY,
+    invoice_created_at TIMESTAMP,
+    invoice_id INTEGER,
+    collection_created_at TIMESTAMP,
+    collection_id INTEGER,
+    last_full_scan_at TIMESTAMP,
+    last_run_at TIMESTAMP,
+    last_duration_ms FLOAT,
+    last_flags INTEGER,
+    cursor_due_date DATE,
+    cursor_id INTEGER,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+ALTER TABLE scan_checkpoints ADD COLUMN IF NOT EXISTS last_run_at TIMESTAMP;
+ALTER TABLE scan_checkpoints ADD COLUMN IF NOT EXISTS last_duration_ms FLOAT;
+ALTER TABLE scan_checkpoints ADD COLUMN IF NOT EXISTS last_flags INTEGER;
+ALTER TABLE scan_checkpoints ADD COLUMN IF NOT EXISTS cursor_due_date DATE;
+ALTER TABLE scan_checkpoints ADD COLUMN IF NOT EXISTS cursor_id INTEGER;
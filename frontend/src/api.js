@@ -21,6 +21,7 @@ export const invoiceAPI = {
 
 export const fraudAPI = {
   scan: () => api.post("/fraud/scan"),
+  scanStatus: (id) => api.get(`/fraud/scans/${id}`),
   flags: (params) => api.get("/fraud/flags", { params }),
   exposure: () => api.get("/fraud/exposure"),
 };
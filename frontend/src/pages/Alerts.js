@@ -17,6 +17,7 @@ const FRAUD_LABELS = {
   dilution: "Dilution",
   velocity_anomaly: "Velocity Anomaly",
   cascade_fraud: "Cascade Fraud",
+  ml_anomaly: "ML Anomaly",
 };
 
 const SEVERITY_ICONS = {
@@ -34,6 +34,7 @@ const FRAUD_COLORS = {
   dilution: "#ec4899",
   velocity_anomaly: "#06b6d4",
   cascade_fraud: "#f43f5e",
+  ml_anomaly: "#10b981",
 };
 
 const FRAUD_LABELS = {
@@ -44,6 +45,7 @@ const FRAUD_LABELS = {
   dilution: "Dilution",
   velocity_anomaly: "Velocity Anomaly",
   cascade_fraud: "Cascade Fraud",
+  ml_anomaly: "ML Anomaly",
 };
 
 const RISK_COLORS = {
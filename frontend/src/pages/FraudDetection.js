@@ -34,6 +34,7 @@ const FRAUD_LABELS = {
   dilution: "Dilution",
   velocity_anomaly: "Velocity Anomaly",
   cascade_fraud: "Cascade Fraud",
+  ml_anomaly: "ML Anomaly",
 };
 
 const FRAUD_COLORS = {
@@ -44,6 +45,7 @@ const FRAUD_COLORS = {
   dilution: "#ec4899",
   velocity_anomaly: "#06b6d4",
   cascade_fraud: "#f43f5e",
+  ml_anomaly: "#10b981",
 };
 
 const formatMoney = (val) => {
@@ -72,15 +74,30 @@ function FraudDetection() {
 
   const runScan = () => {
     setScanning(true);
+
+    // Scans run as background jobs – poll until the job finishes
+    const poll = (scanId) =>
+      fraudAPI
+        .scanStatus(scanId)
+        .then((res) => {
+          const job = res.data;
+          if (job.status === "completed") {
+            setScanResult(job.result);
+            setScanning(false);
+            // Refresh data
+            fraudAPI.flags().then((r) => setFlags(r.data));
+            fraudAPI.exposure().then((r) => setExposure(r.data));
+          } else if (job.status === "failed") {
+            setScanning(false);
+          } else {
+            setTimeout(() => poll(scanId), 1000);
+          }
+        })
+        .catch(() => setScanning(false));
+
     fraudAPI
       .scan()
-      .then((res) => {
-        setScanResult(res.data);
-        setScanning(false);
-        // Refresh data
-        fraudAPI.flags().then((r) => setFlags(r.data));
-        fraudAPI.exposure().then((r) => setExposure(r.data));
-      })
+      .then((res) => poll(res.data.scan_id))
       .catch(() => setScanning(false));
   };
 
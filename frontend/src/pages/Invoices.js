@@ -18,6 +18,7 @@ const FRAUD_LABELS = {
   dilution: "Dilution",
   velocity_anomaly: "Velocity Anomaly",
   cascade_fraud: "Cascade Fraud",
+  ml_anomaly: "ML Anomaly",
 };
 
 const formatMoney = (val) => `$${val.toLocaleString()}`;